@@ -0,0 +1,465 @@
+"""Stand-in Raspberry Pi for benchmarks: a paramiko SSH/SFTP server plus fake rpitx tools.
+
+Everything runs on this machine under a throwaway directory. Remote paths
+like /home/pi/rpitx are mapped into that directory, and commands run under
+/bin/sh with shim versions of sudo, killall, pkill, pgrep, gpio and rmmod
+on the PATH. The kill shims only ever touch processes started by this
+server (they all share one process group), so an emergency stop in a
+benchmark can't hit anything else on the machine.
+
+LinkProxy sits between the client and the server and adds latency and a
+bandwidth limit, to model Wi-Fi or a slow uplink without a Pi.
+"""
+import base64
+import collections
+import json
+import os
+import shlex
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface, SFTP_OK
+
+# Every tool the controller launches. Each one reports key-up on stderr,
+# swallows its input file (or stdin) like the real tool would, then stays
+# on air until killed. The sleep doesn't hold the output pipes, so killing
+# the tool ends the SSH channel just like on a Pi.
+FAKE_TOOL = r"""#!/bin/sh
+echo "ON AIR $(basename "$0") $*" >&2
+for arg in "$@"; do
+    if [ "$arg" = /dev/stdin ] || [ -f "$arg" ]; then cat "$arg" >/dev/null; fi
+done
+case "$(basename "$0")" in
+    pocsag) cat >/dev/null; exit 0 ;;
+    testrtty.sh|testopera.sh) sleep 0.05; exit 0 ;;
+esac
+trap 'kill $pid 2>/dev/null; exit 143' TERM INT
+sleep 3600 </dev/null >/dev/null 2>&1 &
+pid=$!
+wait $pid
+"""
+
+# pifmrds as the playlist engine drives it: a WAV stream on stdin, taken at
+# the real rate (48 kHz mono 16-bit) so the engine sees the same backpressure
+FAKE_PIFMRDS = r"""#!/usr/bin/env python3
+import os, sys, time
+sys.stderr.write("ON AIR pifmrds %s\n" % " ".join(sys.argv[1:]))
+sys.stderr.flush()
+started, taken = time.time(), -44
+while True:
+    data = os.read(0, 4800)
+    if not data:
+        break
+    taken += len(data)
+    time.sleep(max(0, started + taken / 96000.0 - time.time()))
+"""
+
+FAKE_TOOLS = ("testvfo.sh", "pichirp", "testspectrum.sh", "testfmrds.sh", "testnfm.sh", "testssb.sh",
+              "testam.sh", "testfreedv.sh", "testsstv.sh", "pocsag", "testopera.sh", "testrtty.sh", "tune",
+              "sendiq", "spectrumpaint", "pisstv")
+
+SHIMS = {
+    "sudo": '[ "$1" = -n ] && shift\nexec "$@"\n',
+    "pkill": 'exec {pkill} -g "$FAKE_PI_PGID" "$@"\n',
+    # Zombies are left out: a container's init can take seconds to reap them, a Pi's doesn't.
+    # So are this shim and its $(...) subshell, whose command lines contain the pattern.
+    "pgrep": (
+        'found=1\n'
+        'for pid in $({pgrep} -g "$FAKE_PI_PGID" "$@"); do\n'
+        '    set -- $(sed "s/.*) //" /proc/$pid/stat 2>/dev/null)\n'
+        '    [ -z "$1" ] || [ "$1" = Z ] || [ "$pid" = $$ ] || [ "$2" = $$ ] && continue\n'
+        '    echo $pid\n'
+        '    found=0\n'
+        'done\n'
+        'exit $found\n'
+    ),
+    "killall": (
+        'sig=TERM\n'
+        'case "$1" in -9) sig=KILL; shift ;; esac\n'
+        'rc=1\n'
+        'for name in "$@"; do {pkill} -"$sig" -g "$FAKE_PI_PGID" -x "$name" && rc=0; done\n'
+        'exit $rc\n'
+    ),
+    "gpio": '[ "$3" = read ] && echo 0\nexit 0\n',
+    "rmmod": 'exit 1\n',
+}
+
+
+class _Handle(SFTPHandle):
+    def stat(self):
+        return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def chattr(self, attr):
+        return SFTP_OK
+
+
+class _SandboxSFTP(SFTPServerInterface):
+    """SFTP with every path mapped under the sandbox root"""
+
+    root = None
+
+    def _path(self, path):
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def _call(self, fn, *args):
+        try:
+            return fn(*args)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        return self._call(lambda: SFTPAttributes.from_stat(os.stat(self._path(path))))
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        def do_open():
+            fd = os.open(self._path(path), flags, 0o644)
+            if flags & os.O_WRONLY:
+                mode = "ab" if flags & os.O_APPEND else "wb"
+            elif flags & os.O_RDWR:
+                mode = "a+b" if flags & os.O_APPEND else "r+b"
+            else:
+                mode = "rb"
+            handle = _Handle(flags)
+            handle.filename = path
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+        return self._call(do_open)
+
+    def remove(self, path):
+        return self._call(lambda: os.remove(self._path(path)) or SFTP_OK)
+
+    def rename(self, old, new):
+        return self._call(lambda: os.replace(self._path(old), self._path(new)) or SFTP_OK)
+
+    posix_rename = rename
+
+    def mkdir(self, path, attr):
+        return self._call(lambda: os.mkdir(self._path(path)) or SFTP_OK)
+
+    def chattr(self, path, attr):
+        def do_chattr():
+            if attr._flags & attr.FLAG_AMTIME:
+                os.utime(self._path(path), (attr.st_atime, attr.st_mtime))
+            return SFTP_OK
+        return self._call(do_chattr)
+
+    def list_folder(self, path):
+        def do_list():
+            entries = []
+            for name in os.listdir(self._path(path)):
+                attr = SFTPAttributes.from_stat(os.stat(os.path.join(self._path(path), name)))
+                attr.filename = name
+                entries.append(attr)
+            return entries
+        return self._call(do_list)
+
+
+class _Server(paramiko.ServerInterface):
+    def __init__(self, pi):
+        self.pi = pi
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.pi._exec, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+class FakePi:
+    """SSH server on 127.0.0.1 that behaves enough like a Pi with rpitx installed.
+
+    Any username/password is accepted. Use `rpitx_path` for the
+    controller's rpitx directory setting.
+    """
+
+    def __init__(self, username="pi", exec_delay=0.0):
+        self.username = username
+        # Extra server-side delay per command, e.g. to model a slow Pi
+        self.exec_delay = exec_delay
+        self.root = tempfile.mkdtemp(prefix="fakepi-")
+        self.rpitx_path = f"/home/{username}/rpitx"
+        self.commands = collections.deque(maxlen=1000)
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._transports = []
+        self._closing = False
+        self._setup_tree()
+        # Long-lived anchor process; every command joins its process group
+        self._anchor = subprocess.Popen(["sleep", "1000000"], preexec_fn=os.setpgrp)
+        self._env = dict(os.environ, FAKE_PI_PGID=str(self._anchor.pid),
+                         PATH=os.path.join(self.root, "bin") + os.pathsep + os.environ["PATH"])
+        self._sock = socket.socket()
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(50)
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _setup_tree(self):
+        tools = os.path.join(self.root, self.rpitx_path.lstrip("/"))
+        os.makedirs(tools)
+        for name in FAKE_TOOLS:
+            self._write_script(os.path.join(tools, name), FAKE_TOOL)
+        self._write_script(os.path.join(tools, "pifmrds"), FAKE_PIFMRDS)
+        bin_dir = os.path.join(self.root, "bin")
+        os.makedirs(bin_dir)
+        real = {"pkill": shutil.which("pkill"), "pgrep": shutil.which("pgrep")}
+        if None in real.values():
+            raise RuntimeError("The fake Pi needs pkill and pgrep (procps) on this machine")
+        for name, body in SHIMS.items():
+            self._write_script(os.path.join(bin_dir, name), "#!/bin/sh\n" + body.format(**real))
+
+    @staticmethod
+    def _write_script(path, text):
+        with open(path, "w") as f:
+            f.write(text)
+        os.chmod(path, 0o755)
+
+    def _accept_loop(self):
+        while not self._closing:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                break
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self._host_key)
+            sftp = type("SandboxSFTP", (_SandboxSFTP,), {"root": self.root})
+            transport.set_subsystem_handler("sftp", SFTPServer, sftp)
+            try:
+                transport.start_server(server=_Server(self))
+            except Exception:
+                continue
+            self._transports.append(transport)
+
+    def _exec(self, channel, command):
+        self.commands.append(command)
+        # Remote home directories live inside the sandbox
+        home = os.path.join(self.root, "home") + "/"
+        command = self._map_job(command, home).replace("/home/", home)
+        # The remote agent gets its commands on stdin, so map those paths too
+        rewrite = "khanfar-agent" in command
+        # ...and paths it or the job supervisor's list report go back the other way
+        unmap = rewrite or ("jobctl-" in command and " list " in command)
+        if self.exec_delay:
+            time.sleep(self.exec_delay)
+        # Output goes through socketpairs so a closed channel can be shut down under the command
+        out, out_child = socket.socketpair()
+        err, err_child = socket.socketpair()
+        proc = subprocess.Popen(
+            ["/bin/sh", "-c", command], cwd=self.root, env=self._env,
+            stdin=subprocess.PIPE, stdout=out_child, stderr=err_child,
+            preexec_fn=lambda: os.setpgid(0, self._anchor.pid)
+        )
+        out_child.close()
+        err_child.close()
+
+        def pump_stdin():
+            pending = b""
+            try:
+                while True:
+                    data = channel.recv(32768)
+                    if not data:
+                        break
+                    if rewrite:
+                        pending += data
+                        data, _, pending = pending.rpartition(b"\n")
+                        if not data:
+                            continue
+                        data = b"\n".join(self._map_request(line, home) for line in data.split(b"\n")) + b"\n"
+                    proc.stdin.write(data)
+                    proc.stdin.flush()
+            except Exception:
+                pass
+            try:
+                proc.stdin.close()
+            except Exception:
+                pass
+
+        def pump_stderr():
+            try:
+                for data in iter(lambda: err.recv(32768), b""):
+                    channel.sendall_stderr(data)
+            except Exception:
+                pass
+
+        def watch_channel():
+            # Like sshd: once the channel is gone, so is the command's stdout/stderr
+            while proc.poll() is None:
+                transport = channel.get_transport()
+                if channel.closed or transport is None or not transport.is_active():
+                    for sock in (out, err):
+                        try:
+                            sock.shutdown(socket.SHUT_RDWR)
+                        except OSError:
+                            pass
+                    return
+                time.sleep(0.05)
+
+        threading.Thread(target=pump_stdin, daemon=True).start()
+        threading.Thread(target=watch_channel, daemon=True).start()
+        stderr_thread = threading.Thread(target=pump_stderr, daemon=True)
+        stderr_thread.start()
+        try:
+            pending = b""
+            for data in iter(lambda: out.recv(32768), b""):
+                if unmap:
+                    data, _, pending = (pending + data).rpartition(b"\n")
+                    if not data:
+                        continue
+                    data = data.replace(home.encode(), b"/home/") + b"\n"
+                channel.sendall(data)
+            if pending:
+                channel.sendall(pending.replace(home.encode(), b"/home/"))
+        except Exception:
+            pass
+        code = proc.wait()
+        stderr_thread.join(1)
+        out.close()
+        err.close()
+        try:
+            channel.send_exit_status(code if code >= 0 else 128 - code)
+            channel.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _map_job(command, home):
+        """A detached job's own command line travels base64 encoded; map its paths as well"""
+        words = shlex.split(command) if "jobctl-" in command else []
+        if "start" not in words or words.index("start") + 2 >= len(words):
+            return command
+        meta_at = words.index("start") + 2
+        meta = json.loads(base64.b64decode(words[meta_at]))
+        meta["command"] = meta["command"].replace("/home/", home)
+        words[meta_at] = base64.b64encode(json.dumps(meta).encode()).decode()
+        return " ".join(shlex.quote(w) for w in words)
+
+    def _map_request(self, line, home):
+        try:
+            request = json.loads(line)
+            request["cmd"] = self._map_job(request["cmd"], home)
+            line = json.dumps(request).encode()
+        except (ValueError, TypeError, KeyError):
+            pass
+        return line.replace(b"/home/", home.encode())
+
+    def kill_all(self):
+        """Kill every fake tool still running (not the anchor)"""
+        found = subprocess.run([shutil.which("pgrep"), "-g", str(self._anchor.pid)],
+                               stdout=subprocess.PIPE, universal_newlines=True).stdout
+        for pid in map(int, found.split()):
+            if pid != self._anchor.pid:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def close(self):
+        self._closing = True
+        self._sock.close()
+        for transport in self._transports:
+            transport.close()
+        try:
+            os.killpg(self._anchor.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self._anchor.wait()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+class LinkProxy:
+    """TCP forwarder that adds one-way delay and a bandwidth cap per direction.
+
+    Data is delayed, not held back until acknowledged, so a large transfer
+    can have many chunks in flight, like on a real link.
+    """
+
+    def __init__(self, target_port, rtt=0.0, bandwidth=None, target_host="127.0.0.1"):
+        self.target = (target_host, target_port)
+        self.delay = rtt / 2
+        # Bytes per second in each direction, None for unlimited
+        self.bandwidth = bandwidth
+        self._sock = socket.socket()
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(50)
+        self.port = self._sock.getsockname()[1]
+        self._closing = False
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while not self._closing:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                break
+            upstream = socket.create_connection(self.target)
+            for s in (client, upstream):
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._pipe(client, upstream)
+            self._pipe(upstream, client)
+
+    def _pipe(self, src, dst):
+        queue = collections.deque()
+        ready = threading.Condition()
+        state = {"line_free": 0.0, "done": False}
+
+        def reader():
+            while True:
+                try:
+                    data = src.recv(16384)
+                except OSError:
+                    data = b""
+                now = time.monotonic()
+                with ready:
+                    if data and self.bandwidth:
+                        # Serialise onto the link, then add the propagation delay
+                        state["line_free"] = max(now, state["line_free"]) + len(data) / self.bandwidth
+                        due = state["line_free"] + self.delay
+                    else:
+                        due = now + self.delay
+                    queue.append((due, data))
+                    ready.notify()
+                if not data:
+                    return
+
+        def writer():
+            while True:
+                with ready:
+                    while not queue:
+                        ready.wait()
+                    due, data = queue.popleft()
+                wait = due - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                if not data:
+                    try:
+                        dst.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+                    return
+                try:
+                    dst.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=reader, daemon=True).start()
+        threading.Thread(target=writer, daemon=True).start()
+
+    def close(self):
+        self._closing = True
+        self._sock.close()
@@ -0,0 +1,653 @@
+"""Offline performance benchmarks against a fake Pi (see fake_pi.py).
+
+Measures SSH connect time, the round trip of a short command through the
+remote agent versus its own channel, launch latency (run() until the fake tool
+reports key-up), emergency stop latency, how long a detached job takes to be
+followed again after the link drops, upload throughput for several
+file sizes, how much an upload re-sends after the link drops halfway, how
+fast IQ waveforms are synthesized, how long a 12 MP photo takes to become
+a Spectrum/SSTV picture, how many pager messages per second a batch
+file gets through compared with one launch per message, how much silence
+a playlist needs between tracks while the next ones upload, how long the
+GUI takes to start, and how long each GUI run_* handler blocks the Tk thread.
+Results are written as JSON and checked against the limits for the
+chosen link profile in thresholds.json; the exit code is 1 on any
+regression, so this can gate a change.
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --profile wifi --output wifi.json
+    python benchmarks/run_benchmarks.py --rtt-ms 150 --bandwidth-mbit 1 --sizes 64K,1M
+
+The GUI part needs a display (e.g. run under xvfb-run); it is skipped
+without one.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, REPO)
+
+from fake_pi import FakePi, LinkProxy  # noqa: E402
+from rpitx_controller import TransmitterController, load_settings  # noqa: E402
+from rpitx_iq import IQSynth, MAX_RATE  # noqa: E402
+from rpitx_image import ImagePreprocessor, ImageProcessingError, MODE_FORMATS as IMAGE_FORMATS  # noqa: E402
+from rpitx_messages import messages_report  # noqa: E402
+from rpitx_playlist import playlist_report  # noqa: E402
+from rpitx_metrics import METRICS, percentile  # noqa: E402
+
+# Link models: round-trip time in ms and bandwidth in Mbit/s (None = loopback speed)
+PROFILES = {
+    "lan": {"rtt_ms": 0, "bandwidth_mbit": None, "sizes": "64K,1M,8M,32M"},
+    "wifi": {"rtt_ms": 20, "bandwidth_mbit": 20, "sizes": "64K,1M,8M"},
+    "slow": {"rtt_ms": 150, "bandwidth_mbit": 1, "sizes": "64K,512K"},
+}
+
+# Waveforms timed by bench_iq, from cheapest to heaviest
+IQ_WAVEFORMS = {
+    "tone": "tone 1000",
+    "chirp": "chirp -100000 100000 1",
+    "multitone": "multitone -90000,-60000,-30000,0,30000,60000,90000",
+    "mixed": "tone 1000; logchirp 100 100000 0.5; steps -50000 50000 8 0.01; noise -30",
+}
+
+# Run in a fresh interpreter: how long importing the GUI takes, and whether it dragged paramiko in
+STARTUP_PROBE = (
+    "import json, sys\n"
+    "import rpitx_remote_gui\n"
+    "from rpitx_startup import STARTUP\n"
+    "STARTUP.mark('imports')\n"
+    "json.dump({'imports_ms': STARTUP.steps[-1][2] * 1000, 'paramiko': 'paramiko' in sys.modules}, sys.stdout)\n"
+)
+
+GUI_HANDLERS = ("run_tune", "run_chirp", "run_spectrum", "run_fmrds", "run_nfm", "run_ssb", "run_am",
+                "run_freedv", "run_sstv", "run_pocsag", "run_opera", "run_rtty", "run_sweep", "run_iq",
+                "run_messages", "run_playlist")
+
+
+def parse_size(text):
+    units = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+    text = text.strip().upper()
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def stats(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "min": values[0],
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "max": values[-1],
+    }
+
+
+def write_wav(path, seconds=1.0, rate=44100):
+    with wave.open(path, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        frames = bytearray()
+        for i in range(int(seconds * rate)):
+            sample = int(8000 * math.sin(2 * math.pi * 440 * i / rate))
+            frames += struct.pack("<hh", sample, sample)
+        w.writeframes(bytes(frames))
+
+
+def make_controller(pi, port, settings_overrides=None):
+    settings = load_settings("does-not-exist.json")
+    settings.update({"host": "127.0.0.1", "port": port, "username": pi.username, "password": "x",
+                     "rpitx_path": pi.rpitx_path, "log_file": ""})
+    settings.update(settings_overrides or {})
+    return TransmitterController(settings)
+
+
+def wait_for_key_up(controller, timeout=10.0):
+    """Event set when the fake tool prints its ON AIR line"""
+    on_air = threading.Event()
+    feed = controller.processes.on_output
+
+    def on_output(proc, stream, data):
+        if b"ON AIR" in data:
+            on_air.set()
+        feed(proc, stream, data)
+
+    controller.processes.on_output = on_output
+    return on_air
+
+
+def bench_connect(pi, port, iterations):
+    times = []
+    for _ in range(iterations):
+        controller = make_controller(pi, port)
+        started = time.perf_counter()
+        controller.connect()
+        times.append(time.perf_counter() - started)
+        controller.close()
+    return stats([t * 1000 for t in times])
+
+
+def bench_launch_stop(pi, port, iterations):
+    controller = make_controller(pi, port)
+    controller.connect()
+    launch, returned, stop, failures = [], [], [], []
+    try:
+        for i in range(iterations):
+            on_air = wait_for_key_up(controller)
+            started = time.perf_counter()
+            controller.run("tune", 434000000 + i * 1000)
+            returned.append(time.perf_counter() - started)
+            if not on_air.wait(10):
+                failures.append(f"launch {i}: no key-up within 10 s")
+                continue
+            launch.append(time.perf_counter() - started)
+            result = controller.stop()
+            stop.append(result.latency)
+            if not result.stopped:
+                failures.append(f"stop {i}: {result.describe()}")
+    finally:
+        pi.kill_all()
+        controller.close()
+    return {
+        "launch_ms": stats([t * 1000 for t in launch]),
+        "launch_return_ms": stats([t * 1000 for t in returned]),
+        "stop_ms": stats([t * 1000 for t in stop]),
+        "failures": failures,
+    }
+
+
+def bench_reattach(pi, port, iterations):
+    """Drop the link while a job is on air; time until it is followed again, and check it kept running"""
+    controller = make_controller(pi, port)
+    controller.connect()
+    times, failures = [], []
+    try:
+        for i in range(iterations):
+            on_air = wait_for_key_up(controller)
+            proc = controller.run("tune", 434000000 + i * 1000)
+            if not on_air.wait(10) or proc.job is None:
+                failures.append(f"reattach {i}: job didn't start detached")
+                continue
+            on_air.clear()
+            follower = proc.channel
+            started = time.perf_counter()
+            controller.session.get_transport().close()
+            deadline = started + 30
+            while proc.channel in (follower, None) and proc.active and time.perf_counter() < deadline:
+                time.sleep(0.002)
+            if proc.lost_link or not proc.active:
+                failures.append(f"reattach {i}: {proc.describe()}")
+            else:
+                times.append((time.perf_counter() - started) * 1000)
+            if on_air.is_set():
+                failures.append(f"reattach {i}: the tool was started again")
+            controller.stop()
+    finally:
+        pi.kill_all()
+        controller.close()
+    return {"reattach_ms": stats(times), "failures": failures}
+
+
+def bench_agent(pi, port, iterations):
+    """Short command round trip: through the remote agent, and on a channel of its own"""
+    controller = make_controller(pi, port)
+    controller.connect()
+    try:
+        if not controller.agent.start():
+            return {"skipped": controller.agent.last_error}
+        timings = {"agent_ms": [], "exec_ms": []}
+        for _ in range(iterations):
+            for name, run in (("agent_ms", controller.agent.exec_command),
+                              ("exec_ms", controller.session.exec_command)):
+                started = time.perf_counter()
+                run("true")
+                timings[name].append((time.perf_counter() - started) * 1000)
+    finally:
+        controller.close()
+    results = {name: stats(values) for name, values in timings.items()}
+    results["speedup_x"] = results["exec_ms"]["p50"] / results["agent_ms"]["p50"]
+    return results
+
+
+def bench_upload(pi, port, sizes, workdir, repeats):
+    controller = make_controller(pi, port, {"upload_cache_max_mb": 4096})
+    controller.connect()
+    results = {}
+    try:
+        for size in sizes:
+            rates, hits = [], []
+            for r in range(repeats):
+                # Fresh random content every time, so the remote cache can't short-circuit it
+                path = os.path.join(workdir, f"upload-{size}-{r}.bin")
+                with open(path, "wb") as f:
+                    f.write(os.urandom(size))
+                started = time.perf_counter()
+                controller.upload(path)
+                rates.append(size / (time.perf_counter() - started) / 1e6)
+                started = time.perf_counter()
+                controller.upload(path)
+                hits.append((time.perf_counter() - started) * 1000)
+                os.remove(path)
+            results[str(size)] = {"mb_per_s": stats(rates), "cache_hit_ms": stats(hits)}
+    finally:
+        controller.close()
+    return results
+
+
+def bench_resume(pi, port, size, workdir, repeats):
+    """Drop the link halfway through an upload; report the time to finish and the MB sent twice"""
+    controller = make_controller(pi, port, {"upload_sync_mb": max(size / 8, 65536) / (1024 * 1024)})
+    controller.connect()
+    cache = controller.upload_cache
+    times, resent = [], []
+    try:
+        for r in range(repeats):
+            path = os.path.join(workdir, f"resume-{size}-{r}.bin")
+            with open(path, "wb") as f:
+                f.write(os.urandom(size))
+            cache.ensure_dir()
+            remote_path = cache.remote_path_for(path)
+            dropped = []
+
+            def progress(sent, total):
+                if not dropped and sent >= total // 2:
+                    dropped.append(sent)
+                    controller.session.get_transport().close()
+
+            started = time.perf_counter()
+            sent = cache.upload(path, remote_path, progress=progress)
+            times.append((time.perf_counter() - started) * 1000)
+            resent.append(max(sent - size, 0) / 1e6)
+            os.remove(path)
+    finally:
+        controller.close()
+    return {"total_ms": stats(times), "resent_mb": stats(resent)}
+
+
+def bench_iq(seconds=1.0):
+    """Local IQ synthesis speed, as a multiple of sendiq's highest sample rate"""
+    results = {}
+    for name, waveform in IQ_WAVEFORMS.items():
+        rate = IQSynth(waveform, MAX_RATE).benchmark(seconds)
+        results[name] = {"msps": rate / 1e6, "realtime_x": rate / MAX_RATE}
+    return results
+
+
+def write_photo(path, width=4000, height=3000):
+    """A camera-sized JPEG with detail the encoder can't squash to nothing. False without Pillow/NumPy"""
+    try:
+        import numpy as np
+        from PIL import Image
+    except ImportError:
+        return False
+    rng = np.random.default_rng(1)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    pixels = np.clip(base + rng.integers(-24, 24, size=base.shape), 0, 255).astype(np.uint8)
+    Image.fromarray(pixels).save(path, "JPEG", quality=90)
+    return True
+
+
+def bench_image(workdir, repeats=3):
+    """Local conversion of a 12 MP photo for each picture mode, cold and from the cache"""
+    photo = os.path.join(workdir, "photo.jpg")
+    if not write_photo(photo):
+        return {"skipped": "Pillow/NumPy not installed"}
+    results = {}
+    for mode, fmt in IMAGE_FORMATS.items():
+        cold, cached = [], []
+        for _ in range(repeats):
+            preprocessor = ImagePreprocessor(cache_dir=tempfile.mkdtemp(dir=workdir))
+            try:
+                started = time.perf_counter()
+                prepared = preprocessor.process(photo, fmt)
+                cold.append((time.perf_counter() - started) * 1000)
+                started = time.perf_counter()
+                preprocessor.process(photo, fmt)
+                cached.append((time.perf_counter() - started) * 1000)
+            except ImageProcessingError as e:
+                return {"skipped": str(e)}
+            shutil.rmtree(preprocessor.cache_dir)
+        results[mode] = {"convert_ms": stats(cold), "cached_ms": stats(cached), "ratio": prepared.ratio}
+    return results
+
+
+def write_pages(path, count):
+    with open(path, "w") as f:
+        f.write("address,function,message\n")
+        for i in range(count):
+            # In runs of one function, as pocsag takes the function per launch
+            f.write(f"{1000000 + i},{i * 4 // count},Bench page {i}, with a comma\n")
+
+
+def bench_messages(pi, port, workdir, count=500, singles=10):
+    """Pager messages per second: a whole file in one run, and one pocsag launch per message"""
+    path = os.path.join(workdir, "pages.csv")
+    write_pages(path, count)
+    controller = make_controller(pi, port)
+    controller.connect()
+    try:
+        started = time.perf_counter()
+        proc = controller.messages(466230000, "pocsag", path)
+        controller.processes.wait(proc, timeout=120)
+        elapsed = time.perf_counter() - started
+        report = messages_report(proc) or {}
+        batch = {"per_s": report.get("sent", 0) / elapsed, "sent": report.get("sent", 0),
+                 "failed": report.get("failed"), "total_ms": elapsed * 1000}
+
+        started = time.perf_counter()
+        for i in range(singles):
+            proc = controller.run("pocsag", 466230000, message=f"{1000000 + i}:Bench page {i}")
+            controller.processes.wait(proc, timeout=30)
+        single = {"per_s": singles / (time.perf_counter() - started)}
+    finally:
+        controller.close()
+    return {"batch": batch, "single": single, "speedup_x": batch["per_s"] / single["per_s"]}
+
+
+def bench_playlist(pi, port, workdir, tracks=4, seconds=2.0):
+    """Silence the playlist engine had to insert between tracks while the next ones were converted and uploaded"""
+    paths = []
+    for i in range(tracks):
+        # Slightly different lengths, so every track is a fresh conversion and upload
+        paths.append(os.path.join(workdir, f"track{i}.wav"))
+        write_wav(paths[-1], seconds=seconds + i * 0.01)
+    playlist = os.path.join(workdir, "station.m3u")
+    with open(playlist, "w") as f:
+        f.write("\n".join(paths) + "\n")
+    controller = make_controller(pi, port)
+    controller.connect()
+    try:
+        started = time.perf_counter()
+        proc = controller.playlist(98000000, playlist, loop=False)
+        controller.processes.wait(proc, timeout=tracks * seconds * 10 + 60)
+        elapsed = time.perf_counter() - started
+        report = playlist_report(proc) or {}
+    finally:
+        controller.close()
+    return {"played": report.get("played", 0), "gaps": report.get("gaps"), "gap_seconds": report.get("gap_seconds"),
+            "total_ms": elapsed * 1000, "audio_ms": sum(seconds + i * 0.01 for i in range(tracks)) * 1000}
+
+
+def bench_startup(workdir, repeats=5):
+    """GUI module import time in a fresh interpreter, plus the full startup report when there is a display"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO, os.environ.get("PYTHONPATH")])))
+    imports, eager = [], 0
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", STARTUP_PROBE], cwd=workdir, env=env,
+                             capture_output=True, text=True, timeout=60)
+        if out.returncode != 0:
+            return {"skipped": (out.stderr.strip().splitlines() or ["import failed"])[-1]}
+        probe = json.loads(out.stdout)
+        imports.append(probe["imports_ms"])
+        eager += probe["paramiko"]
+    results = {"imports_ms": stats(imports), "eager_paramiko": eager}
+
+    report = os.path.join(workdir, "startup.json")
+    try:
+        subprocess.run([sys.executable, os.path.join(REPO, "rpitx_remote_gui.py"), "--startup-report", report,
+                        "--quit-after-startup"], cwd=workdir, env=env, capture_output=True, timeout=60)
+    except subprocess.TimeoutExpired:
+        pass
+    if os.path.exists(report):
+        with open(report) as f:
+            steps = {step["step"]: step["at_ms"] for step in json.load(f)["steps"]}
+        results["window_ms"] = steps.get("window")
+        results["ready_ms"] = steps.get("ssh_ready")
+    else:
+        results["window"] = {"skipped": "no display"}
+    return results
+
+
+def bench_gui(pi, port, workdir):
+    """Time each run_* handler on the Tk thread and the worst event-loop stall while it works"""
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception as e:
+        return {"skipped": f"no display ({str(e).splitlines()[0]})"}
+    root.withdraw()
+
+    import rpitx_remote_gui as gui
+
+    # Answer every dialog without user interaction
+    wav = os.path.join(workdir, "tone.wav")
+    write_wav(wav)
+    image = os.path.join(workdir, "picture.jpg")
+    if not write_photo(image, 1600, 1200):
+        with open(image, "wb") as f:
+            f.write(os.urandom(64 * 1024))
+    rf = os.path.join(workdir, "voice.rf")
+    with open(rf, "wb") as f:
+        f.write(os.urandom(64 * 1024))
+    pages = os.path.join(workdir, "pages-gui.csv")
+    write_pages(pages, 50)
+    playlist = os.path.join(workdir, "gui.m3u")
+    with open(playlist, "w") as f:
+        f.write(f"{wav}\n{wav}\n")
+    files = {"run_spectrum": image, "run_sstv": image, "run_freedv": rf, "run_messages": pages,
+             "run_playlist": playlist}
+    answers = {"current": None}
+    gui.filedialog.askopenfilename = lambda **kw: files.get(answers["current"], wav)
+    answers_by_title = {"Sweep": "434.0, 434.1", "IQ": "tone 1000; noise -40", "Message Kind": "pocsag"}
+    gui.simpledialog.askstring = lambda title, *a, **kw: next(
+        (v for k, v in answers_by_title.items() if k in title), "1234567:Bench")
+    gui.simpledialog.askfloat = lambda *a, **kw: 50.0
+    gui.simpledialog.askinteger = lambda title, *a, **kw: 48000 if "Rate" in title else 1
+    errors = []
+    for name in ("showinfo", "showwarning", "showerror"):
+        setattr(gui.messagebox, name, lambda *a, **kw: errors.append(a))
+    gui.messagebox.askyesno = lambda *a, **kw: True
+
+    app = gui.RpitxRemoteGUI(root)
+    while not app.ready:
+        root.update()
+    app.settings.update({"host": "127.0.0.1", "port": port, "username": pi.username, "password": "x",
+                         "rpitx_path": pi.rpitx_path})
+    app.controller.connect()
+
+    beats = []
+
+    def heartbeat():
+        beats.append(time.perf_counter())
+        root.after(5, heartbeat)
+
+    results = {}
+    try:
+        root.after(5, heartbeat)
+        for handler in GUI_HANDLERS:
+            answers["current"] = handler
+            errors.clear()
+            beats.clear()
+            previous = app.controller.processes.latest()
+            started = time.perf_counter()
+            getattr(app, handler)()
+            call = time.perf_counter() - started
+            # Keep the loop running until the work is done and the process is up
+            deadline = time.perf_counter() + 30
+            while time.perf_counter() < deadline:
+                root.update()
+                if not app.worker.pending and app.controller.processes.latest() is not previous:
+                    break
+                time.sleep(0.002)
+            for _ in range(20):
+                root.update()
+                time.sleep(0.005)
+            gaps = [b - a for a, b in zip(beats, beats[1:])]
+            results[handler] = {
+                "call_ms": call * 1000,
+                "max_stall_ms": max([0.0] + [(g - 0.005) * 1000 for g in gaps]),
+                "errors": [str(e) for e in errors],
+            }
+            results[handler]["stop_ms"] = app.controller.stop().latency * 1000
+            pi.kill_all()
+    finally:
+        app.worker.shutdown()
+        app.controller.close()
+        root.destroy()
+    return results
+
+
+def flatten(results):
+    """Dotted metric names for the threshold checks"""
+    flat = {}
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for k, v in value.items():
+                walk(f"{prefix}.{k}" if prefix else k, v)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix] = value
+
+    walk("", results)
+    return flat
+
+
+def check_thresholds(metrics, limits):
+    """Compare against {"metric": {"max": x} or {"min": y}}; a * in a name matches any one part (size, handler)"""
+    checks = []
+    for pattern, limit in limits.items():
+        names = sorted(m for m in metrics if _matches(pattern, m)) if "*" in pattern else [pattern]
+        for name in names:
+            value = metrics.get(name)
+            if value is None:
+                # e.g. a size left out with --sizes; not a regression
+                checks.append({"metric": name, "ok": True, "value": None, "limit": limit, "note": "not measured"})
+                continue
+            ok = ("max" not in limit or value <= limit["max"]) and ("min" not in limit or value >= limit["min"])
+            checks.append({"metric": name, "ok": ok, "value": value, "limit": limit})
+    return checks
+
+
+def _matches(pattern, name):
+    parts, names = pattern.split("."), name.split(".")
+    return len(parts) == len(names) and all(p == "*" or p == n for p, n in zip(parts, names))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="rpitx remote benchmarks against a fake Pi")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="lan")
+    parser.add_argument("--rtt-ms", type=float, help="override the profile's round-trip time")
+    parser.add_argument("--bandwidth-mbit", type=float, help="override the profile's bandwidth")
+    parser.add_argument("--sizes", help="upload sizes, e.g. 64K,1M,8M")
+    parser.add_argument("--iterations", type=int, default=10, help="connect/launch/stop repetitions")
+    parser.add_argument("--upload-repeats", type=int, default=3)
+    parser.add_argument("--skip-gui", action="store_true")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--thresholds", default=os.path.join(HERE, "thresholds.json"))
+    args = parser.parse_args(argv)
+
+    profile = dict(PROFILES[args.profile])
+    if args.rtt_ms is not None:
+        profile["rtt_ms"] = args.rtt_ms
+    if args.bandwidth_mbit is not None:
+        profile["bandwidth_mbit"] = args.bandwidth_mbit
+    if args.sizes:
+        profile["sizes"] = args.sizes
+    sizes = [parse_size(s) for s in profile["sizes"].split(",")]
+
+    # The fake server's side of every closed connection would be logged as an error
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+    output = os.path.abspath(args.output)
+    thresholds_path = os.path.abspath(args.thresholds)
+    workdir = tempfile.mkdtemp(prefix="rpitx-bench-")
+    # The controller and GUI keep their settings, digests and logs in the working directory
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    pi = FakePi()
+    proxy = None
+    port = pi.port
+    if profile["rtt_ms"] or profile["bandwidth_mbit"]:
+        bandwidth = profile["bandwidth_mbit"] * 1e6 / 8 if profile["bandwidth_mbit"] else None
+        proxy = LinkProxy(pi.port, rtt=profile["rtt_ms"] / 1000, bandwidth=bandwidth)
+        port = proxy.port
+
+    results = {
+        "profile": args.profile,
+        "link": {"rtt_ms": profile["rtt_ms"], "bandwidth_mbit": profile["bandwidth_mbit"]},
+        "started": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    try:
+        print(f"Link: {profile['rtt_ms']} ms RTT, "
+              f"{profile['bandwidth_mbit'] or 'unlimited'} Mbit/s")
+        print("Connect...")
+        results["connect_ms"] = bench_connect(pi, port, args.iterations)
+        print("Remote agent...")
+        results["agent"] = bench_agent(pi, port, args.iterations)
+        print("Launch and stop...")
+        results.update(bench_launch_stop(pi, port, args.iterations))
+        print("Reattach after a dropped link...")
+        results["reattach"] = bench_reattach(pi, port, args.iterations)
+        results["failures"] += results["reattach"].pop("failures")
+        print("Upload...")
+        results["upload"] = bench_upload(pi, port, sizes, workdir, args.upload_repeats)
+        print("IQ synthesis...")
+        results["iq"] = bench_iq()
+        print("Image preprocessing...")
+        results["image"] = bench_image(workdir)
+        print("Message batches...")
+        results["messages"] = bench_messages(pi, port, workdir)
+        print("Gapless playlist...")
+        results["playlist"] = bench_playlist(pi, port, workdir)
+        print("GUI startup...")
+        results["startup"] = bench_startup(workdir)
+        print("Upload resume after a dropped link...")
+        results["resume"] = bench_resume(pi, port, max(sizes), workdir, args.upload_repeats)
+        if args.skip_gui:
+            results["gui"] = {"skipped": "--skip-gui"}
+        else:
+            print("GUI handlers...")
+            results["gui"] = bench_gui(pi, port, workdir)
+        results["phases"] = METRICS.snapshot()
+    finally:
+        if proxy is not None:
+            proxy.close()
+        pi.close()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    try:
+        with open(thresholds_path) as f:
+            limits = json.load(f).get(args.profile, {})
+    except FileNotFoundError:
+        limits = {}
+    # Per-phase timings are informational; only the headline numbers are gated
+    checks = check_thresholds(flatten({k: v for k, v in results.items() if k != "phases"}), limits)
+    results["checks"] = checks
+    results["passed"] = all(c["ok"] for c in checks) and not results.get("failures")
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4)
+
+    print(f"\n{'metric':<44}{'value':>12}  limit")
+    for c in checks:
+        value = c.get("note", "-") if c["value"] is None else f"{c['value']:.2f}"
+        limit = ", ".join(f"{k} {v}" for k, v in c["limit"].items())
+        print(f"{c['metric']:<44}{value:>12}  {limit}{'' if c['ok'] else '  <-- REGRESSION'}")
+    for failure in results.get("failures", []):
+        print(f"FAILED: {failure}")
+    print(f"\nResults written to {output}")
+    return 0 if results["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
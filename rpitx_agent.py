@@ -0,0 +1,484 @@
+import itertools
+import json
+import shlex
+import socket
+import threading
+import time
+
+from rpitx_metrics import METRICS
+from rpitx_session import SessionError
+
+AGENT_VERSION = 2
+# Seconds between the health reports the agent pushes on its own
+HEALTH_INTERVAL = 5.0
+
+# Started once per connection as `sudo -n python3 -u -c AGENT_BOOTSTRAP khanfar-agent`;
+# the script itself is the first stdin line, JSON-encoded. The tag must not
+# contain rpitx, pichirp or tune, or the stop sequence would kill the agent.
+AGENT_BOOTSTRAP = "import json, sys; exec(json.loads(sys.stdin.readline()))"
+AGENT_COMMAND = f"sudo -n python3 -u -c {shlex.quote(AGENT_BOOTSTRAP)} khanfar-agent"
+
+# The agent: one JSON object per line each way. Requests carry an id and an
+# op; replies repeat the id with ok and a result or error. Launched jobs run
+# as root (the agent already is, so no sudo per launch) and their output and
+# exit are pushed as events; short commands run as the SSH user.
+AGENT_SCRIPT = r'''
+import json, os, pwd, subprocess, sys, threading, time
+
+out_lock = threading.Lock()
+jobs = {}
+USER = pwd.getpwuid(int(os.environ["SUDO_UID"])) if os.getuid() == 0 and os.environ.get("SUDO_UID") else None
+
+def send(message):
+    line = json.dumps(message, separators=(",", ":")) + "\n"
+    try:
+        with out_lock:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+    except (OSError, ValueError):
+        # The connection is gone; jobs keep running, like after a dropped ssh exec
+        os._exit(0)
+
+def as_user():
+    os.setgid(USER.pw_gid)
+    os.initgroups(USER.pw_name, USER.pw_gid)
+    os.setuid(USER.pw_uid)
+
+def exit_code(rc):
+    return rc if rc >= 0 else 128 - rc
+
+def op_exec(req):
+    root = req.get("root") or USER is None
+    env = dict(os.environ)
+    if not root:
+        env.update(HOME=USER.pw_dir, USER=USER.pw_name, LOGNAME=USER.pw_name)
+    proc = subprocess.Popen(["/bin/sh", "-c", req["cmd"]], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, env=env, preexec_fn=None if root else as_user,
+                            cwd=None if root else USER.pw_dir)
+    try:
+        out, err = proc.communicate((req.get("stdin") or "").encode(), timeout=req.get("timeout"))
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        raise Exception("timed out after %ss" % req["timeout"])
+    return {"code": exit_code(proc.returncode), "stdout": out.decode(errors="replace"),
+            "stderr": err.decode(errors="replace")}
+
+def forward(job, pipe, stream):
+    for data in iter(lambda: os.read(pipe.fileno(), 32768), b""):
+        # latin-1 maps bytes 1:1, so the client gets back exactly what the job wrote
+        send({"event": "output", "job": job, "stream": stream, "data": data.decode("latin-1")})
+
+def reap(job, proc, readers):
+    for reader in readers:
+        reader.join()
+    code = exit_code(proc.wait())
+    jobs.pop(job, None)
+    send({"event": "exit", "job": job, "code": code})
+
+def op_launch(req):
+    job = req["job"]
+    proc = subprocess.Popen(["/bin/sh", "-c", req["cmd"]], stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    jobs[job] = proc
+    readers = [threading.Thread(target=forward, args=(job, getattr(proc, s), s), daemon=True)
+               for s in ("stdout", "stderr")]
+    for reader in readers:
+        reader.start()
+    threading.Thread(target=reap, args=(job, proc, readers), daemon=True).start()
+    return {"pid": proc.pid}
+
+def descendants(pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open("/proc/%s/stat" % entry) as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    found, todo = [], [pid]
+    while todo:
+        found.append(todo.pop())
+        todo.extend(children.get(found[-1], []))
+    return found
+
+def op_signal(req):
+    proc = jobs.get(req["job"])
+    if proc is None:
+        return {"signalled": 0}
+    pids = descendants(proc.pid)
+    for pid in pids:
+        try:
+            os.kill(pid, req.get("signal", 15))
+        except OSError:
+            pass
+    return {"signalled": len(pids)}
+
+def read(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return ""
+
+def health():
+    meminfo = dict(line.split(":", 1) for line in read("/proc/meminfo").splitlines() if ":" in line)
+    temp = read("/sys/class/thermal/thermal_zone0/temp").strip()
+    return {
+        "load": float((read("/proc/loadavg").split() or ["0"])[0]),
+        "temp_c": int(temp) / 1000.0 if temp.isdigit() else None,
+        "mem_available_mb": int(meminfo.get("MemAvailable", "0 kB").split()[0]) // 1024,
+        "uptime": float((read("/proc/uptime").split() or ["0"])[0]),
+        "jobs": len(jobs),
+    }
+
+def op_stat(req):
+    try:
+        st = os.stat(req["path"])
+    except OSError:
+        return None
+    return {"size": st.st_size, "mtime": st.st_mtime, "isdir": os.path.isdir(req["path"])}
+
+OPS = {
+    "exec": op_exec,
+    "launch": op_launch,
+    "signal": op_signal,
+    "status": lambda req: {"jobs": {str(job): proc.pid for job, proc in list(jobs.items())}},
+    "health": lambda req: health(),
+    "time": lambda req: {"time": time.time()},
+    "stat": op_stat,
+}
+
+def handle(req):
+    try:
+        send({"id": req["id"], "ok": True, "result": OPS[req["op"]](req)})
+    except Exception as e:
+        send({"id": req.get("id"), "ok": False, "error": "%s: %s" % (type(e).__name__, e)})
+
+def report_health():
+    while True:
+        time.sleep(HEALTH_INTERVAL)
+        send(dict(health(), event="health"))
+
+send({"event": "ready", "version": VERSION, "pid": os.getpid(), "user": USER.pw_name if USER else None})
+threading.Thread(target=report_health, daemon=True).start()
+for line in sys.stdin:
+    if line.strip():
+        threading.Thread(target=handle, args=(json.loads(line),), daemon=True).start()
+os._exit(0)
+'''
+
+
+class AgentError(SessionError):
+    """Raised when the agent isn't running or can't do something; callers fall back to plain exec"""
+
+
+class AgentJob:
+    """A process launched by the agent, with the parts of a paramiko channel ProcessTracker uses.
+
+    Output and the exit code arrive as events from the agent's reader
+    thread; fileno() becomes readable whenever there is something new, so
+    the tracker's select() loop watches it like any other channel.
+    """
+
+    def __init__(self, agent, job, channel):
+        self.agent = agent
+        self.job = job
+        # The agent channel it was launched over; if that ends, so does the job's output
+        self.channel = channel
+        self.closed = False
+        self.eof_received = False
+        self.exit_status = -1
+        self._buffers = {"stdout": bytearray(), "stderr": bytearray()}
+        self._lock = threading.Lock()
+        self._flagged = False
+        self._rsock, self._wsock = socket.socketpair()
+        self._rsock.setblocking(False)
+
+    def fileno(self):
+        return self._rsock.fileno()
+
+    def exit_status_ready(self):
+        return self.eof_received or self.closed
+
+    def recv_ready(self):
+        return bool(self._buffers["stdout"])
+
+    def recv_stderr_ready(self):
+        return bool(self._buffers["stderr"])
+
+    def recv(self, size):
+        return self._take("stdout", size)
+
+    def recv_stderr(self, size):
+        return self._take("stderr", size)
+
+    def close(self):
+        """Forget the job, sending it SIGTERM if it is still running"""
+        if self.closed:
+            return
+        self.closed = True
+        if not self.eof_received:
+            self.agent.notify("signal", job=self.job, signal=15)
+        self.agent.forget(self.job)
+        self._rsock.close()
+        self._wsock.close()
+
+    def add_output(self, stream, data):
+        with self._lock:
+            self._buffers[stream] += data
+            self._flag()
+
+    def set_exit(self, code):
+        with self._lock:
+            self.exit_status = code
+            self.eof_received = True
+            self._flag()
+
+    def _take(self, stream, size):
+        with self._lock:
+            buffer = self._buffers[stream]
+            data = bytes(buffer[:size])
+            del buffer[:size]
+            if self._flagged and not self.eof_received and not any(self._buffers.values()):
+                try:
+                    self._rsock.recv(64)
+                except OSError:
+                    pass
+                self._flagged = False
+            return data
+
+    def _flag(self):
+        if not self._flagged and not self.closed:
+            self._flagged = True
+            try:
+                self._wsock.send(b"x")
+            except OSError:
+                pass
+
+
+class RemoteAgent:
+    """A small helper process on the Pi, started once per connection.
+
+    Every plain command otherwise costs a new SSH channel, a shell started
+    by sshd and usually a sudo. The agent keeps one channel open and takes
+    JSON-line requests (launch, signal, exec, stat, time, health, status),
+    answering in a millisecond or two of Pi time, and pushes job output,
+    job exits and periodic health reports back. It runs as root, so
+    launches need no sudo. Whenever it can't be started (no python3, sudo
+    wants a password) or dies, callers use the plain exec path.
+    """
+
+    def __init__(self, session, timeout=10.0, start_timeout=5.0):
+        self.session = session
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.info = None
+        self.health = None
+        self.last_error = None
+        self._channel = None
+        # Transport of the last start attempt, so a failed start isn't retried on the same connection
+        self._transport = None
+        self._pending = {}
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._answered = threading.Event()
+        self._starting = False
+
+    @property
+    def available(self):
+        channel = self._channel
+        return (self.info is not None and channel is not None and not channel.closed
+                and channel.get_transport() is not None and channel.get_transport().is_active())
+
+    def start(self):
+        """Deploy and start the agent on the current connection. Returns True once it answers"""
+        with self._lock:
+            if self.available:
+                return True
+            self._drop()
+            try:
+                self._transport = self.session.get_transport()
+                with METRICS.timer("agent.start"):
+                    channel = self.session.open_channel()
+                    channel.exec_command(AGENT_COMMAND)
+                    script = f"VERSION = {AGENT_VERSION}\nHEALTH_INTERVAL = {HEALTH_INTERVAL}\n" + AGENT_SCRIPT
+                    channel.sendall((json.dumps(script) + "\n").encode())
+                    self._channel = channel
+                    self._answered.clear()
+                    threading.Thread(target=self._read_loop, args=(channel,), daemon=True).start()
+                    if not self._answered.wait(self.start_timeout) or self.info is None:
+                        raise AgentError(self.last_error or "no answer")
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Remote agent not available, using plain exec: {self.last_error}")  # Debug output
+                self._drop()
+                return False
+        print(f"Remote agent running as pid {self.info.get('pid')}")  # Debug output
+        return True
+
+    def ensure(self):
+        """True if the agent is up. On a new connection it is started in the background; until then, False"""
+        if self.available:
+            return True
+        if not self.session.is_connected():
+            return False
+        with self._lock:
+            if self._starting or self.session.get_transport() is self._transport:
+                return False
+            self._starting = True
+        threading.Thread(target=self._start_in_background, daemon=True).start()
+        return False
+
+    def wait_started(self):
+        """Wait out a background start under way; True if the agent is up"""
+        deadline = time.time() + self.start_timeout + 1
+        while self._starting and time.time() < deadline:
+            time.sleep(0.01)
+        return self.available
+
+    def close(self):
+        with self._lock:
+            self._drop()
+
+    def request(self, op, wait=None, **args):
+        """Send one request and wait for its result. Raises AgentError"""
+        channel = self._channel
+        if not self.available:
+            raise AgentError("agent not running")
+        request_id = next(self._ids)
+        reply = {"done": threading.Event()}
+        self._pending[request_id] = reply
+        try:
+            with METRICS.timer(f"agent.{op}"):
+                self._send(channel, dict(args, id=request_id, op=op))
+                if not reply["done"].wait(wait or self.timeout):
+                    raise AgentError(f"agent did not answer '{op}' in time")
+        finally:
+            self._pending.pop(request_id, None)
+        if "ok" not in reply:
+            raise AgentError(f"agent connection lost ({self.last_error})")
+        if not reply["ok"]:
+            raise AgentError(reply.get("error") or f"{op} failed")
+        return reply.get("result")
+
+    def notify(self, op, **args):
+        """Send a request without waiting for the reply"""
+        try:
+            self._send(self._channel, dict(args, id=next(self._ids), op=op))
+        except Exception:
+            pass
+
+    def exec_command(self, command, timeout=None, root=False, stdin=None):
+        """Like SSHSessionManager.exec_command, run by the agent. Returns (exit_status, stdout, stderr)"""
+        # No timeout waits as long as a command on its own channel would
+        wait = timeout + self.timeout if timeout is not None else 24 * 3600
+        result = self.request("exec", wait=wait, cmd=command, timeout=timeout, root=root, stdin=stdin)
+        return result["code"], result["stdout"], result["stderr"]
+
+    def launch(self, command):
+        """Start `command` as root; returns an AgentJob for ProcessTracker"""
+        job_id = next(self._ids)
+        job = AgentJob(self, job_id, self._channel)
+        self._jobs[job_id] = job
+        try:
+            self.request("launch", job=job_id, cmd=command)
+        except AgentError:
+            self._jobs.pop(job_id, None)
+            job.closed = True
+            raise
+        return job
+
+    def forget(self, job_id):
+        self._jobs.pop(job_id, None)
+
+    def describe(self):
+        if self.available:
+            return {"state": "running", "pid": self.info.get("pid"), "health": self.health}
+        return {"state": "off", "error": self.last_error}
+
+    def _start_in_background(self):
+        try:
+            self.start()
+        finally:
+            self._starting = False
+
+    def _send(self, channel, message):
+        data = (json.dumps(message, separators=(",", ":")) + "\n").encode()
+        with self._send_lock:
+            channel.sendall(data)
+
+    def _read_loop(self, channel):
+        stream = channel.makefile("rb")
+        try:
+            for line in stream:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                self._dispatch(message)
+        except Exception as e:
+            self.last_error = str(e)
+        if self.info is None:
+            # Usually sudo asking for a password, or no python3
+            try:
+                err = channel.makefile_stderr("rb").read().decode(errors="replace").strip()
+            except Exception:
+                err = ""
+            self.last_error = (err.splitlines() or [self.last_error or "agent exited"])[-1]
+        else:
+            self.last_error = self.last_error or "agent exited"
+        self._lost(channel)
+
+    def _dispatch(self, message):
+        event = message.get("event")
+        if event is None:
+            reply = self._pending.get(message.get("id"))
+            if reply is not None:
+                reply.update(message)
+                reply["done"].set()
+        elif event == "output":
+            job = self._jobs.get(message.get("job"))
+            if job is not None:
+                job.add_output(message.get("stream", "stdout"), message.get("data", "").encode("latin-1"))
+        elif event == "exit":
+            job = self._jobs.get(message.get("job"))
+            if job is not None:
+                job.set_exit(message.get("code", -1))
+        elif event == "health":
+            message["received"] = time.time()
+            self.health = message
+        elif event == "ready":
+            self.info = message
+            self._answered.set()
+
+    def _lost(self, channel):
+        """The agent's channel ended: fail whatever was waiting on it"""
+        if channel is self._channel:
+            self.info = None
+        self._answered.set()
+        for reply in list(self._pending.values()):
+            reply["done"].set()
+        for job in list(self._jobs.values()):
+            if job.channel is channel:
+                # Like a dropped SSH channel: no exit status
+                self._jobs.pop(job.job, None)
+                if not job.eof_received:
+                    job.set_exit(-1)
+        try:
+            channel.close()
+        except Exception:
+            pass
+
+    def _drop(self):
+        channel, self._channel = self._channel, None
+        self.info = None
+        if channel is not None:
+            try:
+                channel.close()
+            except Exception:
+                pass
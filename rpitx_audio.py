@@ -0,0 +1,328 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import struct
+import threading
+import wave
+
+from rpitx_cache import DigestIndex
+
+CACHE_VERSION = 1
+BLOCK_FRAMES = 65536
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class AudioProcessingError(Exception):
+    """Raised when a file can't be preprocessed (caller should send it as-is)"""
+
+
+class AudioFormat:
+    """Target sample format for one transmission mode"""
+
+    def __init__(self, sample_rate, channels=1, sample_width=2):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+
+    def key(self):
+        return f"{self.sample_rate}/{self.channels}/{self.sample_width * 8}"
+
+
+# What the rpitx test scripts convert their input to before modulating.
+# Sending exactly this spares the Pi the sox/csdr conversion work.
+MODE_FORMATS = {
+    "fmrds": AudioFormat(48000, 1, 2),
+    "nfm": AudioFormat(48000, 1, 2),
+    "ssb": AudioFormat(48000, 1, 2),
+    "am": AudioFormat(48000, 1, 2),
+}
+
+
+def require_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise AudioProcessingError("NumPy is not installed (pip install numpy)")
+    return numpy
+
+
+class WavInfo:
+    """Minimal RIFF/WAVE header parser (handles PCM, float and EXTENSIBLE)"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+            if riff != b"RIFF" or wave_id != b"WAVE":
+                raise AudioProcessingError("Not a RIFF/WAVE file")
+
+            fmt = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise AudioProcessingError("WAV file has no data chunk")
+                chunk_id, size = struct.unpack("<4sI", header)
+                if chunk_id == b"fmt ":
+                    fmt = f.read(size)
+                elif chunk_id == b"data":
+                    self.data_offset = f.tell()
+                    # Some streaming writers leave the size at 0 or 0xFFFFFFFF
+                    remaining = os.path.getsize(path) - self.data_offset
+                    self.data_size = size if 0 < size <= remaining else remaining
+                    break
+                else:
+                    f.seek(size, os.SEEK_CUR)
+                if size % 2:
+                    f.seek(1, os.SEEK_CUR)
+
+        if fmt is None or len(fmt) < 16:
+            raise AudioProcessingError("WAV file has no fmt chunk")
+        tag, self.channels, self.sample_rate, _, self.block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+        if tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            tag = struct.unpack("<H", fmt[24:26])[0]
+        if tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+            raise AudioProcessingError(f"Unsupported WAV encoding 0x{tag:04x}")
+        self.is_float = tag == WAVE_FORMAT_IEEE_FLOAT
+        self.sample_width = bits // 8
+        if self.is_float and self.sample_width not in (4, 8):
+            raise AudioProcessingError(f"Unsupported float width {bits}")
+        if not self.is_float and self.sample_width not in (1, 2, 3, 4):
+            raise AudioProcessingError(f"Unsupported PCM width {bits}")
+
+    @property
+    def frames(self):
+        return self.data_size // self.block_align
+
+    def blocks(self, block_frames=BLOCK_FRAMES):
+        """Yield float32 arrays of shape (frames, channels) in [-1, 1]"""
+        np = require_numpy()
+        with open(self.path, "rb") as f:
+            f.seek(self.data_offset)
+            remaining = self.frames * self.block_align
+            while remaining > 0:
+                raw = f.read(min(remaining, block_frames * self.block_align))
+                if not raw:
+                    break
+                remaining -= len(raw)
+                raw = raw[:len(raw) - len(raw) % self.block_align]
+                yield decode_samples(np, raw, self.sample_width, self.is_float).reshape(-1, self.channels)
+
+
+def decode_samples(np, raw, sample_width, is_float=False):
+    """Convert little-endian PCM/float bytes into float32 samples"""
+    if is_float:
+        return np.frombuffer(raw, dtype="<f4" if sample_width == 4 else "<f8").astype(np.float32)
+    if sample_width == 1:
+        return (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    if sample_width == 2:
+        return np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    if sample_width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        # Assemble into the top 24 bits of an int32 so the sign comes for free
+        value = (b[:, 0] << 8) | (b[:, 1] << 16) | (b[:, 2] << 24)
+        return value.astype(np.float32) / 2147483648.0
+    return np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+
+
+def encode_samples(np, samples, sample_width, rng=None):
+    """Requantize float samples to little-endian PCM, with TPDF dither if rng is given"""
+    scale = {1: 127.0, 2: 32767.0, 4: 2147483647.0}[sample_width]
+    scaled = samples.astype(np.float64) * scale
+    if rng is not None and sample_width < 4:
+        scaled += rng.random(scaled.shape) - rng.random(scaled.shape)
+    pcm = np.clip(np.rint(scaled), -scale - 1, scale)
+    if sample_width == 1:
+        return (pcm + 128).astype(np.uint8).tobytes()
+    return pcm.astype("<i2" if sample_width == 2 else "<i4").tobytes()
+
+
+def lowpass_taps(np, cutoff, taps=63):
+    """Blackman-windowed sinc low-pass; cutoff in cycles/sample (0..0.5)"""
+    n = np.arange(taps) - (taps - 1) / 2.0
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(taps)
+    return (h / h.sum()).astype(np.float32)
+
+
+class StreamingResampler:
+    """Block-by-block resampler: anti-alias FIR followed by linear interpolation.
+
+    State is carried between blocks so a file of any length is processed in
+    constant memory and the output has no seams at block boundaries.
+    """
+
+    def __init__(self, np, in_rate, out_rate, channels):
+        self.np = np
+        self.step = in_rate / float(out_rate)
+        self.passthrough = in_rate == out_rate
+        self.channels = channels
+        self.taps = None
+        if out_rate < in_rate:
+            self.taps = lowpass_taps(np, 0.45 * out_rate / in_rate)
+            self.history = np.zeros((len(self.taps) - 1, channels), dtype=np.float32)
+        self.carry = np.zeros((0, channels), dtype=np.float32)
+        self.base = 0
+        self.next_k = 0
+
+    def process(self, block):
+        if self.passthrough:
+            return block
+        np = self.np
+        if self.taps is not None:
+            padded = np.concatenate([self.history, block])
+            self.history = padded[len(padded) - (len(self.taps) - 1):]
+            block = np.stack(
+                [np.convolve(padded[:, c], self.taps, mode="valid") for c in range(self.channels)],
+                axis=1
+            ).astype(np.float32)
+
+        buf = np.concatenate([self.carry, block])
+        if len(buf) == 0:
+            return buf
+        last = self.base + len(buf) - 1
+        k_max = int(np.floor(last / self.step))
+        if k_max < self.next_k:
+            self.carry = buf
+            return np.zeros((0, self.channels), dtype=np.float32)
+
+        ks = np.arange(self.next_k, k_max + 1, dtype=np.float64)
+        positions = ks * self.step - self.base
+        index = np.arange(len(buf))
+        out = np.stack([np.interp(positions, index, buf[:, c]) for c in range(self.channels)], axis=1)
+
+        self.next_k = k_max + 1
+        keep_from = min(int(np.floor(self.next_k * self.step)) - self.base, len(buf))
+        self.carry = buf[keep_from:]
+        self.base += keep_from
+        return out.astype(np.float32)
+
+    def flush(self):
+        """Push the filter's group delay out at the end of the file"""
+        if self.passthrough or self.taps is None:
+            return self.np.zeros((0, self.channels), dtype=self.np.float32)
+        tail = self.np.zeros(((len(self.taps) - 1) // 2, self.channels), dtype=self.np.float32)
+        return self.process(tail)
+
+
+class PreparedAudio:
+    """A preprocessed audio file ready for transfer"""
+
+    def __init__(self, path, encoding, input_bytes, output_bytes, from_cache):
+        self.path = path
+        self.encoding = encoding  # None or "gzip"
+        self.input_bytes = input_bytes
+        self.output_bytes = output_bytes
+        self.from_cache = from_cache
+
+    @property
+    def ratio(self):
+        return self.input_bytes / float(self.output_bytes) if self.output_bytes else 1.0
+
+
+class AudioPreprocessor:
+    """Downmix, resample and requantize WAVs locally before they go to the Pi.
+
+    Results are cached on disk by input digest plus target parameters, so a
+    file that is replayed all day is only converted once.
+    """
+
+    def __init__(self, cache_dir=None, digests=None, max_cache_bytes=2 * 1024 * 1024 * 1024, dither=True):
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".khanfar_tx", "audio")
+        self.digests = digests or DigestIndex()
+        self.max_cache_bytes = max_cache_bytes
+        self.dither = dither
+        # One lock per output, so concurrent requests for the same file convert it once
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def cache_key(self, path, fmt, compress):
+        params = {
+            "digest": self.digests.digest(path),
+            "format": fmt.key(),
+            "encoding": "gzip" if compress else None,
+            "dither": self.dither,
+            "version": CACHE_VERSION,
+        }
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def process(self, path, fmt, compress=False):
+        """Return a PreparedAudio for `path` in format `fmt`"""
+        np = require_numpy()
+        info = WavInfo(path)
+        input_bytes = os.path.getsize(path)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        key = self.cache_key(path, fmt, compress)
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            return self._process(np, info, input_bytes, key, fmt, compress)
+
+    def _process(self, np, info, input_bytes, key, fmt, compress):
+        out_path = os.path.join(self.cache_dir, key + (".wav.gz" if compress else ".wav"))
+        encoding = "gzip" if compress else None
+        if os.path.exists(out_path):
+            os.utime(out_path, None)
+            return PreparedAudio(out_path, encoding, input_bytes, os.path.getsize(out_path), True)
+
+        wav_tmp = os.path.join(self.cache_dir, key + ".wav.tmp")
+        try:
+            self._convert(np, info, fmt, wav_tmp)
+            if compress:
+                gz_tmp = out_path + ".tmp"
+                with open(wav_tmp, "rb") as src, gzip.open(gz_tmp, "wb", compresslevel=6) as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.remove(wav_tmp)
+                os.replace(gz_tmp, out_path)
+            else:
+                os.replace(wav_tmp, out_path)
+        finally:
+            for leftover in (wav_tmp, out_path + ".tmp"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+        self.trim_cache(keep=out_path)
+        return PreparedAudio(out_path, encoding, input_bytes, os.path.getsize(out_path), False)
+
+    def _convert(self, np, info, fmt, out_path):
+        channels = min(fmt.channels, info.channels)
+        resampler = StreamingResampler(np, info.sample_rate, fmt.sample_rate, channels)
+        rng = np.random.default_rng() if self.dither else None
+
+        with wave.open(out_path, "wb") as out:
+            out.setnchannels(channels)
+            out.setsampwidth(fmt.sample_width)
+            out.setframerate(fmt.sample_rate)
+            for block in info.blocks():
+                if channels == 1 and info.channels > 1:
+                    block = block.mean(axis=1, keepdims=True)
+                elif block.shape[1] > channels:
+                    block = block[:, :channels]
+                out.writeframes(encode_samples(np, resampler.process(block), fmt.sample_width, rng))
+            out.writeframes(encode_samples(np, resampler.flush(), fmt.sample_width, rng))
+
+    def trim_cache(self, keep=None):
+        """Delete least recently used outputs once the cache exceeds its size limit"""
+        trim_directory(self.cache_dir, self.max_cache_bytes, keep=[keep])
+
+
+def trim_directory(directory, max_bytes, keep=()):
+    """Delete the least recently used files in `directory` until it fits in max_bytes"""
+    entries = []
+    for name in os.listdir(directory):
+        full = os.path.join(directory, name)
+        if os.path.isfile(full) and not name.endswith(".tmp"):
+            st = os.stat(full)
+            entries.append((st.st_mtime, st.st_size, full))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for _, size, full in entries:
+        if total <= max_bytes:
+            break
+        if full not in keep:
+            os.remove(full)
+            total -= size
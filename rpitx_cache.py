@@ -0,0 +1,386 @@
+import collections
+import hashlib
+import json
+import os
+import posixpath
+import shlex
+import socket
+import threading
+import time
+
+from rpitx_metrics import METRICS
+from rpitx_session import SessionError, load_paramiko
+
+# Read size for uploads; paramiko splits each chunk into 32 KB SFTP writes sent back to back
+UPLOAD_CHUNK = 256 * 1024
+
+
+class VerifyError(IOError):
+    """The file on the Pi doesn't match the local one after an upload"""
+
+
+def transfer_errors():
+    """Errors that mean the link dropped mid-transfer and the upload can resume"""
+    return IOError, EOFError, socket.error, load_paramiko().SSHException, SessionError
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 of a local file, read in chunks so big WAVs don't load into memory"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DigestIndex:
+    """Remembers local file digests keyed by (path, size, mtime).
+
+    Hashing a 200 MB WAV takes a noticeable moment, so the result is kept
+    (and persisted to a small JSON file) until the file changes on disk.
+    """
+
+    def __init__(self, index_path="rpitx_digests.json", max_entries=2000):
+        self.index_path = index_path
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def digest(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        key = [st.st_size, st.st_mtime_ns]
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry["key"] == key:
+                return entry["digest"]
+
+        digest = file_digest(path)
+        with self._lock:
+            self._entries.pop(path, None)
+            self._entries[path] = {"key": key, "digest": digest}
+            # Drop the oldest entries once the index grows too large
+            while len(self._entries) > self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._save()
+        return digest
+
+    def _load(self):
+        try:
+            with open(self.index_path, "r") as f:
+                self._entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._entries = {}
+
+    def _save(self):
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"Could not save digest index: {e}")
+
+
+class TransferMeter:
+    """Turns (sent, total) progress callbacks into a smoothed rate and ETA.
+
+    update() returns True at most every `interval` seconds, so callers can
+    redraw a progress bar without flooding the UI. Bytes that were already
+    on the Pi when a resumed upload started don't count towards the rate.
+    """
+
+    def __init__(self, interval=0.2, smoothing=0.3):
+        self.interval = interval
+        self.smoothing = smoothing
+        self.sent = 0
+        self.total = 0
+        self.rate = None
+        self._last = None
+        self._shown = 0.0
+
+    def update(self, sent, total):
+        now = time.monotonic()
+        if self._last is None or sent < self.sent:
+            self._last = (now, sent)
+        else:
+            last_time, last_sent = self._last
+            if now - last_time >= self.interval / 2:
+                rate = (sent - last_sent) / (now - last_time)
+                self.rate = rate if self.rate is None else self.rate + self.smoothing * (rate - self.rate)
+                self._last = (now, sent)
+        self.sent, self.total = sent, total
+        if sent >= total or now - self._shown >= self.interval:
+            self._shown = now
+            return True
+        return False
+
+    @property
+    def fraction(self):
+        return self.sent / self.total if self.total else 0.0
+
+    @property
+    def eta(self):
+        if not self.rate:
+            return None
+        return (self.total - self.sent) / self.rate
+
+    def describe(self):
+        text = f"{self.sent / 1e6:.1f} of {self.total / 1e6:.1f} MB"
+        if self.rate:
+            text += f", {self.rate / 1e6:.1f} MB/s"
+        if self.sent < self.total and self.eta is not None:
+            minutes, seconds = divmod(int(self.eta), 60)
+            text += f", {minutes}:{seconds:02d} left"
+        return text
+
+
+class RemoteFileCache:
+    """Content-addressed file cache on the Pi.
+
+    Files are stored as `<cache_dir>/<sha256><ext>`, so an upload is skipped
+    whenever the Pi already holds the same content. The file mtime doubles as
+    the LRU timestamp: hits touch it, and once the directory grows beyond
+    `max_bytes` the least recently used files are removed.
+
+    Uploads go to `<name>.part` in `sync_bytes` steps; each step ends with
+    every write acknowledged, so after a dropped link the upload resumes
+    from the size of the .part file instead of starting over. Before the
+    rename the Pi's sha256sum of the file must match its name.
+
+    Files handed out with `pin=True` are never evicted until unpin()ed, so a
+    staged job or a prefetched playlist track keeps its file until it's used.
+    """
+
+    def __init__(self, session, cache_dir, owner, max_bytes=1024 * 1024 * 1024, digests=None,
+                 sync_bytes=16 * 1024 * 1024, retries=3, verify=True):
+        self.session = session
+        # Short commands go through here; the controller points it at the remote agent when there is one
+        self.exec_command = session.exec_command
+        self.cache_dir = cache_dir
+        self.owner = owner
+        self.max_bytes = max_bytes
+        self.digests = digests or DigestIndex()
+        self.sync_bytes = sync_bytes
+        self.retries = retries
+        self.verify = verify
+        self.resumed = 0
+        self.hits = 0
+        self.misses = 0
+        self._prepared_for = None
+        self._lock = threading.Lock()
+        # Remote paths still needed by prepared or running commands, with a count each
+        self.pinned = collections.Counter()
+        self._pin_lock = threading.Lock()
+
+    def ensure_dir(self):
+        """Create the cache directory once per connection (single round trip)"""
+        transport = self.session.get_transport()
+        if self._prepared_for is transport:
+            return
+        parent = shlex.quote(posixpath.dirname(self.cache_dir))
+        owner = shlex.quote(f"{self.owner}:{self.owner}")
+        with METRICS.timer("upload.mkdir"):
+            self.exec_command(
+                f"sudo mkdir -p {shlex.quote(self.cache_dir)} && "
+                f"sudo chown -R {owner} {parent} && "
+                f"sudo chmod -R 755 {parent}"
+            )
+        self._prepared_for = transport
+
+    def remote_path_for(self, local_path):
+        ext = os.path.splitext(local_path)[1].lower()
+        return posixpath.join(self.cache_dir, self.digests.digest(local_path) + ext)
+
+    def upload(self, local_path, remote_path, progress=None):
+        """Copy a file to `remote_path` via `<remote_path>.part`, resuming after drops. Returns bytes sent"""
+        size = os.path.getsize(local_path)
+        partial_path = remote_path + ".part"
+        sent_total = 0
+        failures = 0
+        verify_failures = 0
+        # Offset this attempt started from, and how far it got
+        reached = [0, 0]
+        errors = transfer_errors()
+
+        def track(sent, total):
+            reached[1] = sent
+            if progress:
+                progress(sent, total)
+
+        while True:
+            try:
+                sftp = self.session.open_sftp()
+                offset = self._partial_size(sftp, partial_path, size)
+                if offset:
+                    self.resumed += 1
+                    print(f"Resuming upload of {os.path.basename(local_path)} at {offset / 1e6:.1f} MB")
+                reached[:] = [offset, offset]
+                self._send(sftp, local_path, partial_path, offset, size, track)
+                sent_total += reached[1] - reached[0]
+                reached[0] = reached[1]
+                if self.verify:
+                    with METRICS.timer("upload.verify"):
+                        self._verify_and_rename(local_path, partial_path, remote_path)
+                else:
+                    sftp.posix_rename(partial_path, remote_path)
+                return sent_total
+            except errors as e:
+                progressed = reached[1] > reached[0]
+                sent_total += reached[1] - reached[0]
+                reached[0] = reached[1]
+                if isinstance(e, VerifyError):
+                    # One fresh upload is worth a try; a second mismatch won't fix itself
+                    verify_failures += 1
+                    if verify_failures > 1:
+                        raise
+                else:
+                    # Only attempts that got nowhere count against the retry limit
+                    failures = 1 if progressed else failures + 1
+                    if failures > self.retries:
+                        raise
+                print(f"Upload interrupted ({e}); retrying")
+                # Wait for the session monitor to bring the link back
+                try:
+                    self.session.get_transport(wait=self.session.reconnect_wait * 2)
+                except SessionError:
+                    pass
+
+    def fetch(self, local_path, progress=None, pin=False):
+        """Make sure `local_path` is on the Pi and return its remote path (pinned if `pin`)"""
+        with self._lock:
+            with METRICS.timer("upload.digest"):
+                remote_path = self.remote_path_for(local_path)
+            if pin:
+                # Before anything can evict it, including this upload's own eviction pass
+                self.pin([remote_path])
+            try:
+                return self._fetch(local_path, remote_path, progress)
+            except BaseException:
+                if pin:
+                    self.unpin([remote_path])
+                raise
+
+    def _fetch(self, local_path, remote_path, progress):
+        self.ensure_dir()
+        sftp = self.session.open_sftp()
+
+        size = os.path.getsize(local_path)
+        with METRICS.timer("upload.stat"):
+            try:
+                remote_size = sftp.stat(remote_path).st_size
+            except IOError:
+                remote_size = None
+
+        if remote_size == size:
+            # Cache hit: just bump its LRU timestamp
+            self.hits += 1
+            sftp.utime(remote_path, None)
+            return remote_path
+
+        self.misses += 1
+        started = time.perf_counter()
+        with METRICS.timer("upload.transfer"):
+            sent = self.upload(local_path, remote_path, progress=progress)
+        METRICS.observe("upload.throughput", sent / max(time.perf_counter() - started, 1e-6),
+                        unit="bytes_per_second")
+
+        with METRICS.timer("upload.evict"):
+            self.evict(keep=remote_path)
+        return remote_path
+
+    def _partial_size(self, sftp, partial_path, size):
+        try:
+            offset = sftp.stat(partial_path).st_size
+        except IOError:
+            return 0
+        # Longer than the file can't be a prefix of it
+        return offset if offset <= size else 0
+
+    def _send(self, sftp, local_path, partial_path, offset, size, progress):
+        """Write local_path[offset:] into partial_path. Returns bytes sent"""
+        if size == 0:
+            sftp.open(partial_path, "wb").close()
+            return 0
+        sent = offset
+        with open(local_path, "rb") as src:
+            src.seek(offset)
+            while sent < size:
+                # Truncate only on a fresh start; a resume opens the existing file
+                dst = sftp.open(partial_path, "r+b" if sent else "wb")
+                try:
+                    dst.set_pipelined(True)
+                    dst.seek(sent)
+                    step_end = min(size, sent + self.sync_bytes)
+                    while sent < step_end:
+                        chunk = src.read(min(UPLOAD_CHUNK, step_end - sent))
+                        if not chunk:
+                            raise IOError(f"{local_path} shrank during upload")
+                        dst.write(chunk)
+                        sent += len(chunk)
+                        if progress:
+                            progress(sent, size)
+                finally:
+                    # Closing waits for every outstanding write: the sync point resumes start from
+                    dst.close()
+        return sent - offset
+
+    def _verify_and_rename(self, local_path, partial_path, remote_path):
+        """Check the Pi's sha256sum of the upload and move it into place, in one round trip"""
+        digest = self.digests.digest(local_path)
+        status, out, err = self.exec_command(
+            f"[ \"$(sha256sum < {shlex.quote(partial_path)})\" = \"{digest}  -\" ] && "
+            f"mv -f {shlex.quote(partial_path)} {shlex.quote(remote_path)}"
+        )
+        if status != 0:
+            # Don't resume from a corrupt file; the retry starts again from zero
+            try:
+                self.session.open_sftp().remove(partial_path)
+            except IOError:
+                pass
+            raise VerifyError(f"Upload of {os.path.basename(local_path)} failed verification "
+                              f"({err.strip() or 'checksum mismatch'})")
+
+    def pin(self, paths):
+        with self._pin_lock:
+            self.pinned.update(paths)
+
+    def unpin(self, paths):
+        with self._pin_lock:
+            self.pinned.subtract(paths)
+            for path in [p for p, count in self.pinned.items() if count <= 0]:
+                del self.pinned[path]
+
+    def usage(self):
+        """Return the cache entries as a list of (mtime, size, path), oldest first"""
+        sftp = self.session.open_sftp()
+        entries = []
+        for attr in sftp.listdir_attr(self.cache_dir):
+            entries.append((attr.st_mtime, attr.st_size, posixpath.join(self.cache_dir, attr.filename)))
+        entries.sort()
+        return entries
+
+    def evict(self, keep=None):
+        """Remove least recently used files, except pinned ones, until the cache fits in max_bytes"""
+        sftp = self.session.open_sftp()
+        entries = self.usage()
+        with self._pin_lock:
+            pinned = set(self.pinned)
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep or path in pinned:
+                continue
+            # Leftover partial uploads older than an hour are fair game too
+            if path.endswith(".part") and time.time() - mtime < 3600:
+                continue
+            try:
+                sftp.remove(path)
+                total -= size
+                removed.append(path)
+            except IOError:
+                pass
+        return removed
@@ -0,0 +1,525 @@
+"""Command-line front end for TransmitterController.
+
+Examples:
+    python rpitx_cli.py tune 434.0 --duration 10
+    python rpitx_cli.py chirp 434.0 --bandwidth 60000 --speed 10 --duration 30
+    python rpitx_cli.py play nfm 145.5 message.wav
+    python rpitx_cli.py pocsag 466.23 "1234567:Hello"
+    python rpitx_cli.py sweep 434.0-435.0:0.1 --dwell 0.25 --loops 3
+    python rpitx_cli.py messages pocsag 466.23 pages.csv
+    python rpitx_cli.py playlist 98.5 station.m3u --ps "KHANFAR"
+    python rpitx_cli.py iq 434.0 "chirp -20000 20000 1; noise -30" --rate 96000 --duration 60
+    python rpitx_cli.py stop
+    python rpitx_cli.py status
+    python rpitx_cli.py jobs
+    python rpitx_cli.py batch schedule.txt
+    python rpitx_cli.py --fleet rpitx_fleet.json --start-in 5 tune 434.0 --duration 10
+    python rpitx_cli.py --fleet rpitx_fleet.json --hosts pi1,pi2 stop
+    python rpitx_cli.py queue add --duration 30 chirp 434.0
+    python rpitx_cli.py queue add --in 60 --every 3600 pocsag 466.23 "1234567:Hourly"
+    python rpitx_cli.py queue add --preset "70cm beacon" chirp
+    python rpitx_cli.py queue run
+    python rpitx_cli.py presets beacon
+    python rpitx_cli.py --metrics timings.json play nfm 145.5 message.wav
+    python rpitx_cli.py --profile profiles pocsag 466.23 "1234567:Hello"
+
+A batch file holds one of the commands above per line (# starts a comment)
+and runs them all over a single SSH connection.
+
+With --fleet every command goes to all hosts in the inventory at once, and
+--start-in holds the transmitters until a common moment so they key up
+together.
+
+Transmissions that don't stream their input run detached on the Pi: if
+the connection drops they keep going and are followed again once it is
+back. `jobs` lists them (also ones left by an earlier session) and `stop`
+ends them.
+
+--metrics writes per-phase timings (connect, upload steps, launch, stop
+steps) with p50/p95/p99 to a JSON file on exit; --metrics-port serves them
+in Prometheus text format at http://127.0.0.1:PORT/metrics while running.
+--profile DIR runs the command under cProfile and leaves a .prof file and a
+text report of the slowest calls in DIR.
+"""
+import argparse
+import json
+import shlex
+import sys
+import time
+
+from rpitx_cache import TransferMeter
+from rpitx_controller import TransmitterController, TransmitterError, load_settings, MODES, SETTINGS_FILE
+from rpitx_fleet import FleetController
+from rpitx_jobs import JobQueue, JobScheduler, JOBS_FILE, describe_job
+from rpitx_metrics import METRICS, format_table
+from rpitx_presets import PresetStore
+from rpitx_session import SessionError
+from rpitx_supervisor import describe_remote_job
+from rpitx_sweep import parse_plan, sweep_report, describe_report
+from rpitx_messages import MESSAGE_KINDS, load_messages, messages_report, apply_report, describe_messages
+from rpitx_playlist import playlist_report, describe_playlist
+from rpitx_watchdog import HandlerProfiler
+
+PLAY_MODES = ("spectrum", "fmrds", "nfm", "ssb", "am", "freedv", "sstv")
+
+
+def add_operation_parsers(sub):
+    p = sub.add_parser("tune", help="transmit a carrier")
+    p.add_argument("freq", help="frequency in MHz")
+    p.add_argument("--duration", type=float, help="seconds to transmit before stopping")
+
+    p = sub.add_parser("chirp", help="transmit a moving carrier")
+    p.add_argument("freq", help="frequency in MHz")
+    p.add_argument("--bandwidth", type=int)
+    p.add_argument("--speed", type=int)
+    p.add_argument("--duration", type=float, help="seconds to transmit before stopping")
+
+    p = sub.add_parser("play", help="transmit a file in one of the file modes")
+    p.add_argument("mode", choices=PLAY_MODES)
+    p.add_argument("freq", help="frequency in MHz")
+    p.add_argument("file")
+    p.add_argument("--stream", action="store_true", default=None, help="pipe audio instead of uploading")
+    p.add_argument("--no-preprocess", dest="preprocess", action="store_false", default=None)
+    p.add_argument("--compress", action="store_true", default=None)
+    p.add_argument("--duration", type=float, help="seconds to transmit before stopping")
+
+    p = sub.add_parser("pocsag", help="send a pager message")
+    p.add_argument("freq", help="frequency in MHz")
+    p.add_argument("message")
+
+    p = sub.add_parser("messages", help="send a CSV/JSON-lines file of pages or texts in one transmitter run")
+    p.add_argument("kind", choices=MESSAGE_KINDS)
+    p.add_argument("freq", help="frequency in MHz")
+    p.add_argument("file", help="pocsag: address,function,message; rtty: message; opera: callsign")
+
+    p = sub.add_parser("playlist", help="broadcast an M3U/text list of WAVs on FM RDS without gaps between tracks")
+    p.add_argument("freq", help="frequency in MHz")
+    p.add_argument("file", help="playlist; #EXTINF titles become the radiotext")
+    p.add_argument("--ps", help="RDS station name (up to 8 characters)")
+    p.add_argument("--once", dest="loop", action="store_false", default=None,
+                   help="play the list once instead of until stopped")
+    p.add_argument("--prefetch", type=int, help="tracks kept ready on the Pi ahead of the one on air")
+    p.add_argument("--duration", type=float, help="seconds to transmit before stopping")
+
+    p = sub.add_parser("sweep", help="hop through a list or range of frequencies")
+    p.add_argument("plan", help="MHz list '434.0,434.1' or range '434.0-435.0:0.1'")
+    p.add_argument("--dwell", type=float, required=True, help="seconds on each frequency")
+    p.add_argument("--loops", type=int, default=1, help="passes through the plan (0 = until stopped)")
+    p.add_argument("--duration", type=float, help="seconds to transmit before stopping")
+
+    p = sub.add_parser("iq", help="synthesize a waveform locally and stream it to sendiq")
+    p.add_argument("freq", help="frequency in MHz")
+    p.add_argument("waveform", help="components separated by ';', e.g. 'tone 1000; noise -30'")
+    p.add_argument("--rate", type=int, help="samples per second (10000-250000)")
+    p.add_argument("--duration", type=float, help="seconds to transmit before stopping")
+
+    sub.add_parser("stop", help="stop every transmission on the Pi")
+    sub.add_parser("status", help="print connection and transmission status as JSON")
+    sub.add_parser("jobs", help="list jobs running detached on the Pi (stop ends them)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="rpitx_cli.py", description="Headless rpitx remote control")
+    parser.add_argument("--settings", default=SETTINGS_FILE, help="settings file shared with the GUI")
+    parser.add_argument("--host")
+    parser.add_argument("--user", dest="username")
+    parser.add_argument("--password")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--path", dest="rpitx_path", help="rpitx directory on the Pi")
+    parser.add_argument("-v", "--verbose", action="store_true", help="echo remote output to stderr")
+    parser.add_argument("--fleet", metavar="FILE", help="host inventory; run the command on every host")
+    parser.add_argument("--hosts", help="comma-separated subset of the fleet inventory")
+    parser.add_argument("--start-in", type=float, metavar="SECONDS",
+                        help="fleet only: key up all hosts together this many seconds after they are prepared")
+    parser.add_argument("--metrics", metavar="FILE", help="write per-phase timings to this JSON file on exit")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics on 127.0.0.1:PORT while running")
+    parser.add_argument("--profile", metavar="DIR", help="run the command under cProfile and write the report to DIR")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add_operation_parsers(sub)
+
+    p = sub.add_parser("batch", help="run commands from a file over one connection")
+    p.add_argument("file", help="batch file, or - for stdin")
+    p.add_argument("--keep-going", action="store_true", help="continue after a failed line")
+
+    p = sub.add_parser("queue", help="manage and run the job queue")
+    jobs_file = argparse.ArgumentParser(add_help=False)
+    jobs_file.add_argument("--jobs", default=JOBS_FILE, help="job queue file shared with the GUI")
+    actions = p.add_subparsers(dest="action", required=True)
+    actions.add_parser("list", parents=[jobs_file])
+    actions.add_parser("clear", parents=[jobs_file])
+    actions.add_parser("run", parents=[jobs_file], help="run queued jobs back to back")
+    q = actions.add_parser("remove", parents=[jobs_file])
+    q.add_argument("id", type=int)
+    q = actions.add_parser("add", parents=[jobs_file], help="queue a tune/chirp/play/pocsag command")
+    q.add_argument("--in", dest="start_in", type=float, metavar="SECONDS", help="first run this far from now")
+    q.add_argument("--duration", type=float, help="seconds on air")
+    q.add_argument("--every", type=float, metavar="SECONDS", help="repeat interval")
+    q.add_argument("--preset", help="take frequency and settings from this preset; the job is then just a mode")
+    q.add_argument("job", nargs=argparse.REMAINDER)
+
+    p = sub.add_parser("presets", help="list or search saved presets")
+    p.add_argument("query", nargs="?", default="", help="name, prefix or letters in order")
+    p.add_argument("--limit", type=int, default=50)
+    return parser
+
+
+def build_batch_parser():
+    parser = argparse.ArgumentParser(prog="batch", add_help=False)
+    add_operation_parsers(parser.add_subparsers(dest="command", required=True))
+    return parser
+
+
+def wait_for(controller, proc, duration):
+    """Wait for a launched process to end, or stop it after `duration` seconds"""
+    if not controller.processes.wait(proc, timeout=duration):
+        result = controller.stop()
+        print(f"stopped after {duration:g}s: {result.describe()}")
+    elif proc.state == "failed":
+        tail = proc.stderr_tail().strip()
+        raise TransmitterError(proc.describe() + (f"\n{tail}" if tail else ""))
+    else:
+        print(proc.describe())
+    report = sweep_report(proc)
+    if report:
+        print(f"sweep: {describe_report(report)}")
+    report = playlist_report(proc)
+    if report:
+        print(f"playlist: {describe_playlist(report)}")
+
+
+def print_message_status(proc, params):
+    """One line per record of a finished message batch, then the totals"""
+    records = load_messages(params["file_path"], params["kind"])
+    report = messages_report(proc)
+    for record in apply_report(records, report):
+        print(f"line {record.line}: {record.status}")
+    if report:
+        print(f"messages: {describe_messages(report, records)}")
+
+
+def operation_params(args):
+    """Map a parsed transmit command to (mode, frequency in MHz, prepare params)"""
+    command = args.command
+    if command == "tune":
+        return "tune", args.freq, {}
+    if command == "chirp":
+        return "chirp", args.freq, {"bandwidth": args.bandwidth, "speed": args.speed}
+    if command == "play":
+        params = {"file_path": args.file}
+        if args.mode in ("fmrds", "nfm", "ssb", "am"):
+            params.update(stream=args.stream, preprocess=args.preprocess, compress=args.compress)
+        elif args.mode in ("spectrum", "sstv"):
+            params.update(preprocess=args.preprocess)
+        return args.mode, args.freq, params
+    if command == "pocsag":
+        return "pocsag", args.freq, {"message": args.message}
+    if command == "messages":
+        return "messages", args.freq, {"kind": args.kind, "file_path": args.file}
+    if command == "playlist":
+        return "playlist", args.freq, {"file_path": args.file, "ps": args.ps, "loop": args.loop,
+                                       "prefetch": args.prefetch}
+    if command == "sweep":
+        try:
+            plan = parse_plan(args.plan)
+        except ValueError as e:
+            raise TransmitterError(str(e))
+        return "sweep", plan[0] / 1e6, {"frequencies": plan, "dwell": args.dwell, "loops": args.loops}
+    if command == "iq":
+        return "iq", args.freq, {"waveform": args.waveform, "rate": args.rate, "duration": args.duration}
+    raise TransmitterError(f"Unknown command '{command}'")
+
+
+def upload_progress():
+    """Progress callback that keeps an upload's MB/s and ETA on one terminal line"""
+    if not sys.stderr.isatty():
+        return None
+    meter = TransferMeter()
+
+    def progress(sent, total):
+        if meter.update(sent, total):
+            end = "\n" if sent >= total else ""
+            print(f"\rupload: {meter.describe()}\033[K", end=end, file=sys.stderr, flush=True)
+    return progress
+
+
+def run_operation(controller, args):
+    command = args.command
+    if command == "status":
+        print(json.dumps(controller.status(), indent=2))
+        return
+    if command == "stop":
+        result = controller.stop()
+        print(result.describe())
+        if not result.stopped:
+            raise TransmitterError("Some processes might still be running")
+        return
+    if command == "jobs":
+        for job in controller.remote_jobs():
+            print(describe_remote_job(job))
+        return
+
+    mode, freq, params = operation_params(args)
+    prepared = controller.prepare(mode, controller.freq_to_hz(freq), progress=upload_progress(), **params)
+    duration = getattr(args, "duration", None)
+    if mode in ("sweep", "playlist") and duration is not None:
+        # Let the Pi end the engine on time, so it still sends its report
+        prepared.duration = duration
+        duration += 5
+    elif mode == "iq" and duration is not None:
+        # The sample stream itself ends on time; sendiq exits at end of input
+        duration += 5
+    proc = controller.start(prepared)
+    print(f"started {proc.label}")
+    try:
+        wait_for(controller, proc, duration)
+    finally:
+        if mode == "messages":
+            print_message_status(proc, params)
+
+
+def run_fleet_operation(fleet, args, start_in=None):
+    command = args.command
+    if command == "status":
+        result = fleet.status_all()
+        print(json.dumps({r.name: r.value if r.ok else {"error": r.error} for r in result.results}, indent=2))
+        return
+    if command == "stop":
+        result = fleet.stop_all()
+        print(result.describe())
+        if not result.ok:
+            raise TransmitterError("Some hosts might still be transmitting")
+        return
+    if command == "jobs":
+        result = fleet.dispatch("remote_jobs")
+        for r in result.results:
+            if not r.ok:
+                print(f"{r.name}: error: {r.error}")
+            for job in r.value or []:
+                print(f"{r.name}: {describe_remote_job(job)}")
+        return
+
+    mode, freq, params = operation_params(args)
+    result = fleet.run(mode, TransmitterController.freq_to_hz(freq), start_in=start_in, **params)
+    print(result.describe())
+    procs = {r.name: r.value for r in result.results if r.ok}
+
+    duration = getattr(args, "duration", None)
+    if duration is not None and result.start_at is not None:
+        # Count the duration from the coordinated start, not from now
+        duration += max(0.0, result.start_at - time.time())
+    deadline = time.time() + duration if duration is not None else None
+    for name, proc in procs.items():
+        remaining = max(0.0, deadline - time.time()) if deadline is not None else None
+        fleet.controllers[name].processes.wait(proc, timeout=remaining)
+    if any(proc.active for proc in procs.values()):
+        print(f"stopping after {args.duration:g}s")
+        print(fleet.stop_all().describe())
+    for name, proc in procs.items():
+        print(f"{name}: {proc.describe()}")
+        report = sweep_report(proc)
+        if report:
+            print(f"{name}: sweep: {describe_report(report)}")
+        report = playlist_report(proc)
+        if report:
+            print(f"{name}: playlist: {describe_playlist(report)}")
+        report = messages_report(proc)
+        if report:
+            print(f"{name}: messages: {describe_messages(report, load_messages(params['file_path'], params['kind']))}")
+    if result.failed or any(proc.state == "failed" for proc in procs.values()):
+        raise TransmitterError("Some hosts failed")
+
+
+def open_presets(settings):
+    """The preset store, with any presets left in the settings file by older versions added"""
+    presets = PresetStore(settings["presets_file"])
+    presets.import_legacy(settings["saved_presets"])
+    return presets
+
+
+def list_presets(presets, args):
+    for name in presets.search(args.query, limit=args.limit):
+        preset = presets.get(name)
+        modes = ", ".join(sorted(preset["params"]))
+        print(f"{preset['frequency']:>12g} MHz  {name}" + (f"  ({modes})" if modes else ""))
+
+
+def run_queue(controller, args, presets):
+    queue = JobQueue(args.jobs)
+    if args.action == "list":
+        for job in queue.list():
+            print(f"{job['id']:4d}  {describe_job(job)}")
+        return
+    if args.action == "clear":
+        queue.clear()
+        return
+    if args.action == "remove":
+        queue.remove(args.id)
+        return
+    if args.action == "add" and args.preset:
+        if len(args.job) != 1 or args.job[0] not in MODES:
+            raise TransmitterError("With --preset give just the mode, e.g. 'queue add --preset NAME chirp'")
+        if args.preset not in presets:
+            raise TransmitterError(f"Preset '{args.preset}' not found")
+        start_at = time.time() + args.start_in if args.start_in is not None else None
+        job = queue.add(args.job[0], preset=args.preset, start_at=start_at,
+                        duration=args.duration, repeat_every=args.every)
+        print(f"{job['id']:4d}  {describe_job(job)}")
+        return
+    if args.action == "add":
+        op_args = build_batch_parser().parse_args(args.job)
+        if op_args.command in ("stop", "status"):
+            raise TransmitterError(f"'{op_args.command}' can't be queued")
+        mode, freq, params = operation_params(op_args)
+        TransmitterController.freq_to_hz(freq)
+        start_at = time.time() + args.start_in if args.start_in is not None else None
+        job = queue.add(mode, frequency=float(freq), params=params, start_at=start_at,
+                        duration=args.duration, repeat_every=args.every)
+        print(f"{job['id']:4d}  {describe_job(job)}")
+        return
+
+    # run: until every one-shot job has been on air (recurring jobs keep it going until Ctrl-C)
+    def on_event(kind, job, detail):
+        if kind == "launched":
+            print(f"launched: {describe_job(job)}")
+        elif kind == "failed":
+            print(f"failed: {describe_job(job)}: {detail}", file=sys.stderr)
+        elif kind == "error":
+            print(f"scheduler error: {detail}", file=sys.stderr)
+
+    scheduler = JobScheduler(controller, queue, on_event=on_event, presets=presets)
+    scheduler.start()
+    while queue.jobs or not scheduler.idle():
+        time.sleep(0.2)
+    time.sleep(0.5)
+    for job in queue.finished():
+        print(f"done: {describe_job(job)}")
+    print(json.dumps({"gaps": scheduler.gap_summary()}, indent=2))
+
+
+def run_batch(run, path, keep_going=False):
+    """Run each line of a batch file through run(args)"""
+    parser = build_batch_parser()
+    failures = 0
+    source = sys.stdin if path == "-" else open(path, "r")
+    try:
+        for number, line in enumerate(source, 1):
+            words = shlex.split(line, comments=True)
+            if not words:
+                continue
+            try:
+                run(parser.parse_args(words))
+            except (TransmitterError, SessionError, SystemExit) as e:
+                failures += 1
+                print(f"line {number}: {e}", file=sys.stderr)
+                if not keep_going:
+                    break
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    return failures
+
+
+def main_fleet(args):
+    names = args.hosts.split(",") if args.hosts else None
+    fleet = FleetController.from_file(args.fleet, load_settings(args.settings), names=names)
+    if not fleet.controllers:
+        print("Error: no hosts selected from the inventory", file=sys.stderr)
+        return 1
+    if args.verbose:
+        for controller in fleet.controllers.values():
+            controller.log.echo = sys.stderr
+    run = lambda op_args: run_fleet_operation(fleet, op_args, args.start_in)
+    try:
+        result = fleet.connect_all()
+        if result.failed:
+            print(result.describe(), file=sys.stderr)
+        if args.command == "batch":
+            return 1 if run_batch(run, args.file, args.keep_going) else 0
+        run(args)
+        return 0
+    except KeyboardInterrupt:
+        print(fleet.stop_all().describe())
+        return 130
+    except (TransmitterError, SessionError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    finally:
+        fleet.close()
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.metrics_port:
+        METRICS.serve(args.metrics_port)
+    try:
+        if args.profile:
+            return HandlerProfiler(args.profile, enabled=True, background=False).run(args.command, run_command, args)
+        return run_command(args)
+    finally:
+        METRICS.stop_server()
+        if args.metrics:
+            METRICS.save(args.metrics)
+            if args.verbose:
+                print(format_table(METRICS.snapshot()), file=sys.stderr)
+
+
+def run_command(args):
+    settings = load_settings(args.settings)
+    if args.command == "presets" or (args.command == "queue" and args.action != "run"):
+        # Editing the queue or looking up presets doesn't need the Pi
+        presets = open_presets(settings)
+        try:
+            if args.command == "presets":
+                list_presets(presets, args)
+            else:
+                run_queue(None, args, presets)
+            return 0
+        except (TransmitterError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        finally:
+            presets.close()
+    if args.fleet:
+        if args.command == "queue":
+            print("Error: the job queue runs on a single host", file=sys.stderr)
+            return 1
+        return main_fleet(args)
+    controller = TransmitterController(settings)
+    if args.verbose:
+        controller.log.echo = sys.stderr
+    try:
+        controller.connect(
+            host=args.host, username=args.username, password=args.password,
+            port=args.port, rpitx_path=args.rpitx_path
+        )
+        if args.command == "queue":
+            presets = open_presets(settings)
+            try:
+                run_queue(controller, args, presets)
+            finally:
+                presets.close()
+            return 0
+        if args.command == "batch":
+            run = lambda op_args: run_operation(controller, op_args)
+            return 1 if run_batch(run, args.file, args.keep_going) else 0
+        run_operation(controller, args)
+        return 0
+    except KeyboardInterrupt:
+        print(controller.stop().describe())
+        return 130
+    except (TransmitterError, SessionError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    finally:
+        controller.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,869 @@
+import itertools
+import json
+import os
+import posixpath
+import shlex
+import struct
+import threading
+import time
+
+from rpitx_session import SSHSessionManager, SessionError
+from rpitx_stop import EmergencyStop
+from rpitx_agent import RemoteAgent
+from rpitx_cache import RemoteFileCache
+from rpitx_stream import AUDIO_SCRIPTS, STREAM_COMMANDS, file_chunks
+from rpitx_audio import AudioPreprocessor, AudioProcessingError, MODE_FORMATS, WavInfo
+from rpitx_image import ImagePreprocessor, ImageProcessingError, MODE_FORMATS as IMAGE_FORMATS, RAW_COMMANDS
+from rpitx_process import ProcessTracker
+from rpitx_log import LogBuffer
+from rpitx_metrics import METRICS
+from rpitx_sweep import MIN_DWELL, MAX_HOPS, build_sweep_script
+from rpitx_iq import IQSynth
+from rpitx_messages import MESSAGE_KINDS, MESSAGES_BOOTSTRAP, load_messages, message_chunks
+from rpitx_playlist import PLAYLIST_BOOTSTRAP, PlaylistFeed, build_playlist_script, load_playlist
+from rpitx_supervisor import SCRIPT_NAME, RemoteJob, list_command, parse_job_list, run_dir, script_source
+
+SETTINGS_FILE = "rpitx_settings.json"
+
+# Runs on the Pi before a scheduled command: waits for the previous job's done
+# file and/or a start time, then marks the real start on the Pi's clock
+START_WAIT_SCRIPT = (
+    "import os, sys, time\n"
+    "t, f = float(sys.argv[2]), sys.argv[3]\n"
+    "while f and not os.path.exists(f): time.sleep(0.005)\n"
+    "time.sleep(max(0, t - time.time()))\n"
+    "sys.stderr.write(\"@rpitx start %.6f\\n\" % time.time())\n"
+)
+
+# Default settings
+DEFAULT_SETTINGS = {
+    "host": "192.168.0.197",
+    "port": 22,
+    "username": "mwk",
+    "password": "",
+    "rpitx_path": "/home/mwk/rpitx",
+    "frequency": 434.0,
+    "chirp_bandwidth": 60000,
+    "chirp_speed": 10,
+    "stop_latency_budget": 1.5,
+    "use_agent": True,
+    "detach_jobs": True,
+    "upload_cache_max_mb": 1024,
+    "upload_window_kb": 2048,
+    "upload_sync_mb": 16,
+    "upload_verify": True,
+    "stream_audio": False,
+    "preprocess_audio": True,
+    "compress_transfer": False,
+    "preprocess_images": True,
+    "playlist_ps": "RPITX",
+    "playlist_loop": True,
+    "playlist_prefetch": 2,
+    "fleet_file": "",
+    "fleet_start_delay": 2.0,
+    "sweep_plan": "",
+    "sweep_dwell_ms": 500,
+    "iq_waveform": "tone 1000",
+    "iq_sample_rate": 48000,
+    "log_lines": 2000,
+    "log_file": "rpitx_remote.log",
+    "log_max_mb": 5,
+    "log_backups": 3,
+    "metrics_file": "rpitx_metrics.json",
+    "metrics_port": 0,
+    "ui_watchdog": True,
+    "ui_heartbeat_ms": 50,
+    "ui_stall_ms": 200,
+    "ui_stall_log": "rpitx_ui_stalls.log",
+    "profile_dir": "profiles",
+    "presets_file": "rpitx_presets.json",
+    # Only read to migrate presets saved by older versions into presets_file
+    "saved_presets": []
+}
+
+MIN_FREQ_HZ = 5000
+MAX_FREQ_HZ = 1500000000
+
+# Every mode the controller can prepare, in the order the GUI shows them
+MODES = ("tune", "chirp", "spectrum", "fmrds", "nfm", "ssb", "am", "freedv", "sstv", "pocsag", "opera", "rtty",
+         "sweep", "iq", "messages", "playlist")
+FILE_MODES = {
+    "spectrum": "testspectrum.sh",
+    "freedv": "testfreedv.sh",
+    "sstv": "testsstv.sh",
+}
+
+
+class TransmitterError(Exception):
+    """Raised for invalid parameters or a remote setup problem"""
+
+
+def load_settings(path=SETTINGS_FILE):
+    """Return DEFAULT_SETTINGS updated with whatever is saved in `path`"""
+    settings = json.loads(json.dumps(DEFAULT_SETTINGS))
+    try:
+        with open(path, "r") as f:
+            settings.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    return settings
+
+
+class PreparedCommand:
+    """A transmission that is ready to launch: files uploaded, command built"""
+
+    def __init__(self, mode, freq_hz, command, stdin_chunks=None, input_command=None, start_at=None):
+        self.mode = mode
+        self.freq_hz = freq_hz
+        self.command = command
+        self.stdin_chunks = stdin_chunks
+        self.input_command = input_command
+        # False for commands that aren't a tool in the rpitx directory (no ./ prefix)
+        self.in_rpitx = True
+        # Scheduling, all enforced on the Pi: hold until start_at (Pi clock)
+        # and/or until the `after` file exists, stop after `duration` seconds,
+        # and touch `done_file` once finished
+        self.start_at = start_at
+        self.after = None
+        self.duration = None
+        self.done_file = None
+        # Called with the TrackedProcess once launched, for modes that follow their own progress
+        self.on_launch = None
+        # Cache files the command reads on the Pi; pinned against eviction until it ends
+        self.files = []
+
+    @property
+    def deferred(self):
+        return self.start_at is not None or self.after is not None
+
+    @property
+    def label(self):
+        return f"{self.mode} @ {self.freq_hz / 1e6:.6f} MHz"
+
+
+class TransmitterController:
+    """GUI-free control of an rpitx installation over SSH.
+
+    Owns the session, upload cache, preprocessing and process tracking, and
+    exposes one method per transmission mode. Methods block and raise
+    TransmitterError/SessionError; callers decide how to report that. One
+    controller reuses a single connection for any number of operations.
+    """
+
+    def __init__(self, settings=None, session=None, on_process_change=None, digests=None):
+        # The dict is shared, not copied, so a GUI editing it is seen here
+        self.settings = settings if settings is not None else load_settings()
+        self.session = session or SSHSessionManager()
+        self.session.sftp_window = int(self.settings["upload_window_kb"]) * 1024
+        self.emergency_stop = EmergencyStop(self.session, budget=self.settings["stop_latency_budget"])
+        # Helper process on the Pi that takes commands over one channel; plain exec is the fallback
+        self.agent = RemoteAgent(self.session)
+        self.emergency_stop.agent = self.agent
+        self.upload_cache = RemoteFileCache(
+            self.session,
+            f"{self.remote_temp_dir()}/cache",
+            self.settings["username"],
+            max_bytes=int(self.settings["upload_cache_max_mb"]) * 1024 * 1024,
+            digests=digests,
+            sync_bytes=int(self.settings["upload_sync_mb"] * 1024 * 1024),
+            verify=self.settings["upload_verify"]
+        )
+        self.upload_cache.exec_command = self.exec_command
+        self.audio_preprocessor = AudioPreprocessor(digests=self.upload_cache.digests)
+        self.image_preprocessor = ImagePreprocessor(digests=self.upload_cache.digests)
+        # Remote stdout/stderr, kept in a ring buffer and rotated to disk
+        self.log = LogBuffer(
+            max_lines=int(self.settings["log_lines"]),
+            log_file=self.settings["log_file"] or None,
+            max_bytes=int(self.settings["log_max_mb"] * 1024 * 1024),
+            backups=int(self.settings["log_backups"])
+        )
+        self.on_process_change = on_process_change
+        self.processes = ProcessTracker(self.session, on_change=self._process_changed, on_output=self.log.feed)
+        # Detached jobs are followed (again, after a drop) and killed through the agent when it's up
+        self.processes.opener = self._open_follower
+        self.processes.exec_command = self.exec_command
+        self._checked_path = None
+        self._job_script_for = None
+        # Uploads during prepare() are pinned and collected here (per thread)
+        self._uploads = threading.local()
+        self._pinned_by = {}
+        self._pins_lock = threading.Lock()
+        self._job_script_lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+
+    # Connection
+
+    def connect(self, host=None, username=None, password=None, port=None, rpitx_path=None):
+        """Connect, reusing the live transport if the target is unchanged"""
+        for key, value in (("host", host), ("username", username), ("password", password),
+                           ("port", port), ("rpitx_path", rpitx_path)):
+            if value is not None:
+                self.settings[key] = value
+        s = self.settings
+        changed = self.session.configure(s["host"], s["username"], s["password"], port=s.get("port", 22))
+        if changed or not self.session.is_connected():
+            self.session.reconnect()
+        self.emergency_stop.prepare()
+        # Started in the background; until it answers, commands use plain exec
+        self.remote_agent()
+        if self.settings["detach_jobs"]:
+            # Installed ahead of the first launch, which then doesn't wait on it
+            threading.Thread(target=self._prepare_job_script, daemon=True).start()
+
+    def close(self):
+        # Detached jobs stay on air; the next connect can pick them up again
+        self.processes.release()
+        self.agent.close()
+        self.session.close()
+        self.log.close()
+
+    def _process_changed(self, proc):
+        self.log.add(proc.label, "event", proc.describe())
+        if not proc.active:
+            self.log.finish(proc)
+            with self._pins_lock:
+                files = self._take_pins(self._pinned_by.pop(proc, None))
+            if files:
+                self.upload_cache.unpin(files)
+        if self.on_process_change is not None:
+            self.on_process_change(proc)
+
+    def remote_agent(self):
+        """The remote agent if it's running, else None (starting it on a new connection)"""
+        if not self.settings["use_agent"]:
+            return None
+        return self.agent if self.agent.ensure() else None
+
+    def exec_command(self, command, timeout=None):
+        """Run a short remote command through the agent if it's up, else on its own channel"""
+        agent = self.remote_agent()
+        if agent is not None:
+            try:
+                return agent.exec_command(command, timeout=timeout)
+            except SessionError as e:
+                if agent.available:
+                    # The command itself failed or timed out; running it again won't help
+                    raise
+                print(f"Agent lost ({e}); using plain exec")
+        return self.session.exec_command(command, timeout=timeout)
+
+    def remote_temp_dir(self):
+        return f"/home/{self.settings['username']}/rpitx/temp"
+
+    def job_script(self):
+        """Path of the job supervisor on the Pi, installing it once per connection. None if that failed"""
+        with self._job_script_lock:
+            return self._install_job_script()
+
+    def _prepare_job_script(self):
+        if self.settings["use_agent"]:
+            # Its stat is one round trip on a channel that is open anyway
+            self.agent.wait_started()
+        self.job_script()
+
+    def _install_job_script(self):
+        path = f"{self.remote_temp_dir()}/{SCRIPT_NAME}"
+        try:
+            transport = self.session.get_transport()
+            if self._job_script_for is transport:
+                return path
+            agent = self.remote_agent()
+            if agent is not None:
+                # Named after its content, so an existing file is always the current version
+                installed = agent.request("stat", path=path) is not None
+                if not installed:
+                    # One request instead of an SFTP session
+                    quoted = shlex.quote(path)
+                    status, out, err = agent.exec_command(
+                        f"mkdir -p {shlex.quote(self.remote_temp_dir())} && cat > {quoted}.part && "
+                        f"mv {quoted}.part {quoted}", stdin=script_source()
+                    )
+                    installed = status == 0
+                if installed:
+                    self._job_script_for = transport
+                    return path
+            # Same directory setup as uploads (owned by the SSH user)
+            self.upload_cache.cache_dir = f"{self.remote_temp_dir()}/cache"
+            self.upload_cache.owner = self.settings["username"]
+            self.upload_cache.ensure_dir()
+            sftp = self.session.open_sftp()
+            try:
+                sftp.stat(path)
+            except IOError:
+                with sftp.open(path + ".part", "w") as f:
+                    f.write(script_source())
+                sftp.posix_rename(path + ".part", path)
+        except Exception as e:
+            print(f"Could not install the job supervisor ({e}); running attached")
+            return None
+        self._job_script_for = transport
+        return path
+
+    def remote_jobs(self):
+        """RemoteJobs on the Pi, running or recently finished (oldest first)"""
+        script = self.job_script()
+        if script is None:
+            raise TransmitterError("Job supervisor not available on the Pi")
+        status, out, err = self.exec_command(list_command(script, self.remote_temp_dir()))
+        if status != 0:
+            raise TransmitterError(f"Could not list remote jobs: {err.strip()}")
+        return parse_job_list(out, script)
+
+    def adopt_jobs(self):
+        """Track detached jobs still running on the Pi that this controller doesn't know about.
+
+        They were started by an earlier session (e.g. before the GUI was
+        restarted); their output and state are followed from now on and
+        stop() ends them. Returns the new TrackedProcesses.
+        """
+        if not self.settings["detach_jobs"]:
+            return []
+        known = {p.job.job_dir for p in self.processes.active() if p.job is not None}
+        return [self.processes.adopt(job) for job in self.remote_jobs()
+                if job.running and job.job_dir not in known]
+
+    def _open_follower(self, command):
+        agent = self.remote_agent()
+        if agent is not None:
+            try:
+                return agent.launch(command)
+            except SessionError:
+                pass
+        channel = self.session.open_channel()
+        channel.exec_command(command)
+        return channel
+
+    def check_rpitx_path(self):
+        """Verify the rpitx directory exists, once per connection and path"""
+        rpitx_path = self.settings["rpitx_path"]
+        key = (self.session.get_transport(), rpitx_path)
+        if self._checked_path == key:
+            return
+        with METRICS.timer("path_check"):
+            agent = self.remote_agent()
+            try:
+                exists = agent is not None and (agent.request("stat", path=rpitx_path) or {}).get("isdir")
+            except SessionError:
+                agent = None
+            if agent is None:
+                status, out, err = self.session.exec_command(f"test -d {shlex.quote(rpitx_path)} && echo EXISTS")
+                exists = out.strip() == "EXISTS"
+        if not exists:
+            raise TransmitterError(f"rpitx directory not found at {rpitx_path}")
+        self._checked_path = key
+
+    # Building blocks
+
+    @staticmethod
+    def freq_to_hz(freq_mhz):
+        try:
+            freq_hz = int(float(freq_mhz) * 1e6)
+        except (TypeError, ValueError):
+            raise TransmitterError("Invalid frequency value")
+        if not MIN_FREQ_HZ <= freq_hz <= MAX_FREQ_HZ:
+            raise TransmitterError("Frequency must be between 5 kHz and 1500 MHz")
+        return freq_hz
+
+    def build_command(self, command, input_command=None, start_at=None, after=None, duration=None, done_file=None,
+                      in_rpitx=True, sudo=True):
+        """Full remote command line: cd into rpitx and sudo the tool, optionally fed by a pipe.
+
+        With any scheduling option the line is wrapped so the Pi itself
+        handles the timing, and "@rpitx start/end" markers go to stderr.
+        `sudo=False` is for the remote agent, which already runs as root.
+        """
+        rpitx_path = shlex.quote(self.settings["rpitx_path"])
+        if in_rpitx:
+            command = f"./{command}"
+        root = "sudo " if sudo else ""
+        tool = f"{root}{command}"
+        if duration is not None:
+            # SIGTERM lets the tool release its DMA; SIGKILL 2 s later if it doesn't
+            tool = f"{root}timeout -k 2 {float(duration):.3f} {command}"
+        if input_command:
+            # e.g. decompress the transferred file into the modulator's stdin
+            tool = f"{input_command} | {tool}"
+        if start_at is None and after is None and duration is None and done_file is None:
+            return f"cd {rpitx_path} && {tool}"
+
+        line = f"cd {rpitx_path} && "
+        if start_at is not None or after is not None:
+            # The rpitx-start-wait tag lets the stop sequence's `pkill -f rpitx` cancel it
+            line += (f"python3 -c {shlex.quote(START_WAIT_SCRIPT)} rpitx-start-wait "
+                     f"{start_at or 0:.3f} {shlex.quote(after or '')} && ")
+        line += f"{tool}; rc=$?; "
+        if duration is not None:
+            # timeout reports 124 when it ended the tool on schedule
+            line += "[ $rc -eq 124 ] && rc=0; "
+        line += 'echo "@rpitx end $(date +%s.%N) $rc" >&2; '
+        if done_file:
+            line += f"touch {shlex.quote(done_file)}; "
+        return line + "exit $rc"
+
+    def clock_offset(self):
+        """Estimate the Pi's clock offset from ours (midpoint of one round trip). Returns (offset, rtt)"""
+        agent = self.remote_agent()
+        sent = time.time()
+        if agent is not None:
+            # Read by the agent itself, no process started
+            remote = agent.request("time")["time"]
+            received = time.time()
+            return remote - (sent + received) / 2, received - sent
+        status, out, err = self.session.exec_command("date +%s.%N")
+        received = time.time()
+        try:
+            remote = float(out.strip())
+        except ValueError:
+            raise TransmitterError(f"Unexpected clock reading from Pi: {out.strip()!r}")
+        return remote - (sent + received) / 2, received - sent
+
+    def upload(self, local_path, progress=None, pins=None):
+        """Put a local file in the remote cache and return its remote path.
+
+        Inside prepare() the file is pinned for the prepared command; pass a
+        command's `files` as `pins` to add to it from elsewhere.
+        """
+        self.upload_cache.cache_dir = f"{self.remote_temp_dir()}/cache"
+        self.upload_cache.owner = self.settings["username"]
+        if pins is None:
+            pins = getattr(self._uploads, "files", None)
+        remote_path = self.upload_cache.fetch(local_path, progress=progress, pin=pins is not None)
+        if pins is not None:
+            pins.append(remote_path)
+        return remote_path
+
+    def prepare_audio(self, mode, file_path, preprocess=True, compress=False):
+        """Downmix/resample/requantize locally. Returns (path, encoding)"""
+        if not preprocess:
+            return file_path, None
+        try:
+            prepared = self.audio_preprocessor.process(file_path, MODE_FORMATS[mode], compress=compress)
+            print(f"Audio preprocessed: {prepared.input_bytes} -> {prepared.output_bytes} bytes "
+                  f"({prepared.ratio:.1f}x{', cached' if prepared.from_cache else ''})")  # Debug output
+            return prepared.path, prepared.encoding
+        except (AudioProcessingError, OSError) as e:
+            # Fall back to sending the original file untouched
+            print(f"Audio preprocessing skipped: {str(e)}")
+            return file_path, None
+
+    def prepare_image(self, mode, file_path):
+        """Crop/scale/requantize a picture for spectrum or SSTV. Raises ImageProcessingError/OSError"""
+        with METRICS.timer("image.convert"):
+            prepared = self.image_preprocessor.process(file_path, IMAGE_FORMATS[mode])
+        print(f"Image preprocessed: {prepared.input_bytes} -> {prepared.output_bytes} bytes "
+              f"({prepared.ratio:.1f}x{', cached' if prepared.from_cache else ''})")  # Debug output
+        return prepared
+
+    def prepare(self, mode, freq_hz, progress=None, **params):
+        """Do everything a mode needs before going on air (uploads, conversion).
+
+        Returns a PreparedCommand for start(). Splitting the two lets a
+        scheduler stage the next job while the current one is still on air.
+        """
+        if mode not in MODES:
+            raise TransmitterError(f"Unknown mode '{mode}'")
+        if not MIN_FREQ_HZ <= int(freq_hz) <= MAX_FREQ_HZ:
+            raise TransmitterError("Frequency must be between 5 kHz and 1500 MHz")
+        if not self.session.is_configured():
+            raise SessionError("Not connected to Raspberry Pi")
+        self._uploads.files = files = []
+        try:
+            with METRICS.timer(f"prepare.{mode}"):
+                prepared = getattr(self, f"_prepare_{mode}")(int(freq_hz), progress=progress, **params)
+        except BaseException:
+            self.upload_cache.unpin(files)
+            raise
+        finally:
+            self._uploads.files = None
+        prepared.files = files
+        return prepared
+
+    def start(self, prepared):
+        """Launch a prepared command; returns its TrackedProcess"""
+        try:
+            with METRICS.timer("launch.total"):
+                proc = self._start(prepared)
+        except BaseException:
+            self.release(prepared)
+            raise
+        with self._pins_lock:
+            if proc.active:
+                # Unpinned by _process_changed once it ends
+                self._pinned_by[proc] = prepared.files
+                return proc
+        # Already over (it failed at once)
+        self.release(prepared)
+        return proc
+
+    def release(self, prepared):
+        """Unpin the cache files of a prepared command that won't be started"""
+        with self._pins_lock:
+            files = self._take_pins(prepared.files)
+        self.upload_cache.unpin(files)
+
+    @staticmethod
+    def _take_pins(files):
+        # Emptied in place: a playlist feed still holding the list then finds nothing left to unpin
+        if files is None:
+            return None
+        taken = list(files)
+        files.clear()
+        return taken
+
+    def _start(self, prepared):
+        self.check_rpitx_path()
+
+        def command(sudo=True):
+            return self.build_command(
+                prepared.command, prepared.input_command, prepared.start_at,
+                after=prepared.after, duration=prepared.duration, done_file=prepared.done_file,
+                in_rpitx=prepared.in_rpitx, sudo=sudo
+            )
+
+        # Jobs without stdin run detached under the supervisor, so they survive a dropped link
+        job = None
+        if self.settings["detach_jobs"] and prepared.stdin_chunks is None:
+            script = self.job_script()
+            if script is not None:
+                name = f"{time.time():.3f}-{os.getpid()}-{next(self._job_ids)}"
+                job = RemoteJob(script, f"{run_dir(self.remote_temp_dir())}/{name}")
+
+        def wrap(full_command):
+            return job.start_command(full_command, prepared.label) if job is not None else full_command
+
+        # The agent can't feed stdin, so streamed modes keep their own channel
+        agent = self.remote_agent() if prepared.stdin_chunks is None else None
+        if agent is None:
+            full_command = command()
+            print(f"Executing: {full_command}")  # Debug output
+            proc = self.processes.launch(
+                wrap(full_command), label=prepared.label, stdin_chunks=prepared.stdin_chunks,
+                deferred=prepared.deferred, job=job
+            )
+            if prepared.on_launch is not None:
+                prepared.on_launch(proc)
+            return proc
+
+        def open_job(launch_command):
+            try:
+                return agent.launch(launch_command)
+            except SessionError as e:
+                print(f"Agent launch failed ({e}); using plain exec")
+                channel = self.session.open_channel()
+                channel.exec_command(wrap(command()))
+                return channel
+
+        full_command = command(sudo=False)
+        print(f"Executing via agent: {full_command}")  # Debug output
+        return self.processes.launch(wrap(full_command), label=prepared.label, deferred=prepared.deferred,
+                                     opener=open_job, job=job)
+
+    def run(self, mode, freq_hz, progress=None, **params):
+        return self.start(self.prepare(mode, freq_hz, progress=progress, **params))
+
+    # Transmission modes
+
+    def tune(self, freq_hz):
+        return self.run("tune", freq_hz)
+
+    def chirp(self, freq_hz, bandwidth=None, speed=None):
+        return self.run("chirp", freq_hz, bandwidth=bandwidth, speed=speed)
+
+    def spectrum(self, freq_hz, image_path, progress=None):
+        return self.run("spectrum", freq_hz, progress=progress, file_path=image_path)
+
+    def fmrds(self, freq_hz, wav_path, progress=None, **options):
+        return self.run("fmrds", freq_hz, progress=progress, file_path=wav_path, **options)
+
+    def playlist(self, freq_hz, playlist_path, loop=None, ps=None, prefetch=None):
+        return self.run("playlist", freq_hz, file_path=playlist_path, loop=loop, ps=ps, prefetch=prefetch)
+
+    def nfm(self, freq_hz, wav_path, progress=None, **options):
+        return self.run("nfm", freq_hz, progress=progress, file_path=wav_path, **options)
+
+    def ssb(self, freq_hz, wav_path, progress=None, **options):
+        return self.run("ssb", freq_hz, progress=progress, file_path=wav_path, **options)
+
+    def am(self, freq_hz, wav_path, progress=None, **options):
+        return self.run("am", freq_hz, progress=progress, file_path=wav_path, **options)
+
+    def freedv(self, freq_hz, rf_path, progress=None):
+        return self.run("freedv", freq_hz, progress=progress, file_path=rf_path)
+
+    def sstv(self, freq_hz, image_path, progress=None):
+        return self.run("sstv", freq_hz, progress=progress, file_path=image_path)
+
+    def pocsag(self, freq_hz, message):
+        return self.run("pocsag", freq_hz, message=message)
+
+    def sweep(self, frequencies, dwell, loops=1):
+        return self.run("sweep", frequencies[0], frequencies=frequencies, dwell=dwell, loops=loops)
+
+    def opera(self, freq_hz, callsign):
+        return self.run("opera", freq_hz, callsign=callsign)
+
+    def rtty(self, freq_hz, message):
+        return self.run("rtty", freq_hz, message=message)
+
+    def messages(self, freq_hz, kind, file_path):
+        return self.run("messages", freq_hz, kind=kind, file_path=file_path)
+
+    def stop(self):
+        """Stop every tracked process and run the emergency stop; returns a StopResult"""
+        self.processes.stop(kill_jobs=False)
+        return self.emergency_stop.run()
+
+    def status(self):
+        """Snapshot of connection, processes and stop latency as a plain dict"""
+        latest = self.processes.latest()
+        return {
+            "connection": self.session.state,
+            "host": self.settings["host"],
+            "transmitting": self.processes.is_transmitting(),
+            "active": [p.describe() for p in self.processes.active()],
+            "last_process": latest.describe() if latest else None,
+            "last_exit_code": latest.exit_code if latest else None,
+            "stop_latency": self.emergency_stop.latency.summary(),
+            "agent": self.agent.describe(),
+            "upload_cache": {"hits": self.upload_cache.hits, "misses": self.upload_cache.misses,
+                             "resumed": self.upload_cache.resumed},
+        }
+
+    # Per-mode preparation
+
+    def _prepare_tune(self, freq_hz, progress=None):
+        return PreparedCommand("tune", freq_hz, f"testvfo.sh {freq_hz}")
+
+    def _prepare_chirp(self, freq_hz, progress=None, bandwidth=None, speed=None):
+        try:
+            bandwidth = int(bandwidth if bandwidth is not None else self.settings["chirp_bandwidth"])
+            speed = int(speed if speed is not None else self.settings["chirp_speed"])
+        except (TypeError, ValueError):
+            raise TransmitterError("Invalid frequency, bandwidth, or speed value")
+        # Use original pichirp command with our parameters
+        return PreparedCommand("chirp", freq_hz, f"pichirp {freq_hz} {bandwidth} {speed}")
+
+    def _prepare_sweep(self, freq_hz, progress=None, frequencies=None, dwell=None, loops=1):
+        """Hop through `frequencies` (Hz), `dwell` seconds each, in one long-lived remote job.
+
+        The hop engine runs on the Pi and relaunches ./tune itself, so hop
+        timing depends on the Pi rather than on SSH round trips.
+        """
+        frequencies = [int(f) for f in (frequencies or [freq_hz])]
+        try:
+            dwell = float(dwell)
+            loops = int(loops)
+        except (TypeError, ValueError):
+            raise TransmitterError("Invalid dwell time or loop count")
+        if dwell < MIN_DWELL:
+            raise TransmitterError(f"Dwell time must be at least {MIN_DWELL * 1000:.0f} ms")
+        if loops < 0 or len(frequencies) > MAX_HOPS:
+            raise TransmitterError("Invalid sweep plan")
+        for f in frequencies:
+            if not MIN_FREQ_HZ <= f <= MAX_FREQ_HZ:
+                raise TransmitterError("Frequency must be between 5 kHz and 1500 MHz")
+        # The engine script goes over stdin; rpitx-sweep is only a tag for the stop sequence
+        prepared = PreparedCommand(
+            "sweep", frequencies[0], "python3 -u - rpitx-sweep",
+            stdin_chunks=[build_sweep_script(frequencies, dwell, loops)]
+        )
+        prepared.in_rpitx = False
+        return prepared
+
+    def _prepare_iq(self, freq_hz, progress=None, waveform=None, rate=None, duration=None):
+        """Synthesize a waveform locally and stream it into sendiq, one block at a time"""
+        waveform = waveform if waveform is not None else self.settings["iq_waveform"]
+        try:
+            rate = int(rate if rate is not None else self.settings["iq_sample_rate"])
+            duration = float(duration) if duration is not None else None
+            synth = IQSynth(waveform, rate)
+        except (TypeError, ValueError, AudioProcessingError) as e:
+            raise TransmitterError(str(e))
+        # Runs until stopped, or until `duration` seconds of samples have been sent
+        return PreparedCommand("iq", freq_hz, f"sendiq -i /dev/stdin -s {rate} -f {freq_hz} -t float",
+                               stdin_chunks=synth.blocks(duration))
+
+    def _prepare_file_mode(self, mode, freq_hz, file_path, progress):
+        if not file_path or not os.path.isfile(file_path):
+            raise TransmitterError(f"File not found: {file_path}")
+        remote_path = self.upload(file_path, progress=progress)
+        return PreparedCommand(mode, freq_hz, f"{FILE_MODES[mode]} {freq_hz} {shlex.quote(remote_path)}")
+
+    def _prepare_image_mode(self, mode, freq_hz, file_path, progress=None, preprocess=None):
+        """Send a picture already in the mode's raw format, or the original for the Pi to convert"""
+        if not file_path or not os.path.isfile(file_path):
+            raise TransmitterError(f"File not found: {file_path}")
+        preprocess = self.settings["preprocess_images"] if preprocess is None else preprocess
+        if preprocess:
+            try:
+                prepared = self.prepare_image(mode, file_path)
+            except (ImageProcessingError, OSError) as e:
+                # Fall back to the test script, which converts on the Pi
+                print(f"Image preprocessing skipped: {str(e)}")
+            else:
+                remote_path = shlex.quote(self.upload(prepared.path, progress=progress))
+                return PreparedCommand(mode, freq_hz, RAW_COMMANDS[mode].format(path=remote_path, freq_hz=freq_hz))
+        return self._prepare_file_mode(mode, freq_hz, file_path, progress)
+
+    def _prepare_spectrum(self, freq_hz, progress=None, file_path=None, preprocess=None):
+        return self._prepare_image_mode("spectrum", freq_hz, file_path, progress, preprocess)
+
+    def _prepare_freedv(self, freq_hz, progress=None, file_path=None):
+        return self._prepare_file_mode("freedv", freq_hz, file_path, progress)
+
+    def _prepare_sstv(self, freq_hz, progress=None, file_path=None, preprocess=None):
+        return self._prepare_image_mode("sstv", freq_hz, file_path, progress, preprocess)
+
+    def _prepare_audio_mode(self, mode, freq_hz, file_path, progress=None,
+                            stream=None, preprocess=None, compress=None):
+        """Preprocess, then stream or upload an audio file for one of the audio modes"""
+        if not file_path or not os.path.isfile(file_path):
+            raise TransmitterError(f"File not found: {file_path}")
+        stream = self.settings["stream_audio"] if stream is None else stream
+        preprocess = self.settings["preprocess_audio"] if preprocess is None else preprocess
+        compress = self.settings["compress_transfer"] if compress is None else compress
+
+        path, encoding = self.prepare_audio(mode, file_path, preprocess, compress)
+        decompress = "gzip -dc" if encoding == "gzip" else None
+        stdin_command = STREAM_COMMANDS[mode].format(freq_hz=freq_hz)
+
+        if stream:
+            # Pipe the file over the channel, no upload needed
+            return PreparedCommand(mode, freq_hz, stdin_command, stdin_chunks=file_chunks(path),
+                                   input_command=decompress)
+
+        remote_path = shlex.quote(self.upload(path, progress=progress))
+        if decompress:
+            return PreparedCommand(mode, freq_hz, stdin_command, input_command=f"{decompress} {remote_path}")
+        return PreparedCommand(mode, freq_hz, f"{AUDIO_SCRIPTS[mode]} {freq_hz} {remote_path}")
+
+    def _prepare_fmrds(self, freq_hz, **params):
+        return self._prepare_audio_mode("fmrds", freq_hz, **params)
+
+    def _prepare_playlist(self, freq_hz, progress=None, file_path=None, loop=None, ps=None, prefetch=None):
+        """Play a playlist of WAVs through one FM RDS modulator, without gaps between tracks.
+
+        Only the first track is made ready here; the rest are converted and
+        uploaded in the background, a few tracks ahead of the one on air.
+        """
+        if not file_path or not os.path.isfile(file_path):
+            raise TransmitterError(f"File not found: {file_path}")
+        loop = self.settings["playlist_loop"] if loop is None else loop
+        ps = self.settings["playlist_ps"] if ps is None else ps
+        try:
+            prefetch = int(prefetch if prefetch is not None else self.settings["playlist_prefetch"])
+            tracks = load_playlist(file_path)
+        except (TypeError, ValueError):
+            raise TransmitterError("Invalid prefetch count")
+        except OSError as e:
+            raise TransmitterError(f"Can't read {file_path}: {e}")
+        if not tracks:
+            raise TransmitterError(f"No tracks in {os.path.basename(file_path)}")
+
+        # Each track is pinned along with the command from its upload until it is on air
+        files = self._uploads.files
+        feed = PlaylistFeed(tracks, lambda track: self._prepare_feed_track(feed, files, track), loop=loop,
+                            prefetch=prefetch, release=lambda record: self._unpin_track(files, record))
+        first = feed.prepare_first()
+        if first is None:
+            raise TransmitterError(f"None of the tracks in {os.path.basename(file_path)} could be prepared")
+        prepared = PreparedCommand(
+            "playlist", freq_hz,
+            # The first track's upload has set the cache directory
+            f"python3 -u -c {shlex.quote(PLAYLIST_BOOTSTRAP)} rpitx-playlist {freq_hz} "
+            f"{shlex.quote(self.upload_cache.cache_dir)}",
+            stdin_chunks=feed.chunks(build_playlist_script(freq_hz, ps, first.title))
+        )
+        prepared.in_rpitx = False
+        prepared.on_launch = feed.attach
+        return prepared
+
+    def _prepare_feed_track(self, feed, files, track):
+        pins = []
+        record = self.prepare_track(track, pins=pins)
+        with self._pins_lock:
+            if feed.proc is None or feed.proc.active:
+                files.extend(pins)
+                return record
+        # The playlist ended while this one uploaded, and its pins are already released
+        self.upload_cache.unpin(pins)
+        return record
+
+    def _unpin_track(self, files, record):
+        with self._pins_lock:
+            path = next((p for p in files if posixpath.basename(p) == record["file"]), None)
+            if path is None:
+                return
+            files.remove(path)
+        self.upload_cache.unpin([path])
+
+    def prepare_track(self, track, pins=None):
+        """Convert and upload one playlist track. Returns where its samples are on the Pi"""
+        if not os.path.isfile(track.path):
+            raise TransmitterError(f"File not found: {track.path}")
+        fmt = MODE_FORMATS["fmrds"]
+        path, _ = self.prepare_audio("fmrds", track.path, self.settings["preprocess_audio"])
+        try:
+            info = WavInfo(path)
+        except (AudioProcessingError, OSError, struct.error) as e:
+            raise TransmitterError(f"Not a usable WAV file: {e}")
+        # All tracks share the stream's one header, so each must already be in its format
+        if info.is_float or f"{info.sample_rate}/{info.channels}/{info.sample_width * 8}" != fmt.key():
+            raise TransmitterError(f"Needs to be {fmt.key()} PCM (turn on audio preprocessing)")
+        return {"file": posixpath.basename(self.upload(path, pins=pins)), "offset": info.data_offset,
+                "size": info.frames * info.block_align, "title": track.title}
+
+    def _prepare_nfm(self, freq_hz, **params):
+        return self._prepare_audio_mode("nfm", freq_hz, **params)
+
+    def _prepare_ssb(self, freq_hz, **params):
+        return self._prepare_audio_mode("ssb", freq_hz, **params)
+
+    def _prepare_am(self, freq_hz, **params):
+        return self._prepare_audio_mode("am", freq_hz, **params)
+
+    def _prepare_pocsag(self, freq_hz, progress=None, message=None):
+        if not message:
+            raise TransmitterError("POCSAG message is empty")
+        # The message goes straight to pocsag's stdin, no remote temp file needed
+        message = message.replace("\r", " ").replace("\n", " ")
+        return PreparedCommand("pocsag", freq_hz, f"pocsag -f {freq_hz}",
+                               stdin_chunks=[(message + "\n").encode()])
+
+    def _prepare_opera(self, freq_hz, progress=None, callsign=None):
+        if not callsign:
+            raise TransmitterError("Callsign is empty")
+        return PreparedCommand("opera", freq_hz, f"testopera.sh {freq_hz} {shlex.quote(callsign)}")
+
+    def _prepare_rtty(self, freq_hz, progress=None, message=None):
+        if not message:
+            raise TransmitterError("RTTY message is empty")
+        return PreparedCommand("rtty", freq_hz, f"testrtty.sh {freq_hz} {shlex.quote(message)}")
+
+    def _prepare_messages(self, freq_hz, progress=None, kind=None, file_path=None):
+        """Send every valid record of a POCSAG/RTTY/Opera file in one remote job.
+
+        Records are validated here and streamed to an engine on the Pi,
+        which runs the tools itself; invalid records are skipped.
+        """
+        if kind not in MESSAGE_KINDS:
+            raise TransmitterError(f"Message kind must be one of {', '.join(MESSAGE_KINDS)}")
+        if not file_path or not os.path.isfile(file_path):
+            raise TransmitterError(f"File not found: {file_path}")
+        try:
+            records = load_messages(file_path, kind)
+        except (OSError, UnicodeDecodeError) as e:
+            raise TransmitterError(f"Can't read {file_path}: {e}")
+        valid = [r for r in records if r.valid]
+        if not valid:
+            raise TransmitterError(f"No valid {kind} records in {os.path.basename(file_path)}")
+        if len(valid) < len(records):
+            print(f"Skipping {len(records) - len(valid)} invalid records")  # Debug output
+        prepared = PreparedCommand(
+            "messages", freq_hz,
+            f"python3 -u -c {shlex.quote(MESSAGES_BOOTSTRAP)} rpitx-messages {kind} {freq_hz}",
+            stdin_chunks=message_chunks(valid)
+        )
+        prepared.in_rpitx = False
+        return prepared
@@ -0,0 +1,216 @@
+import copy
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rpitx_audio import AudioPreprocessor
+from rpitx_cache import DigestIndex
+from rpitx_controller import TransmitterController, load_settings
+
+FLEET_FILE = "rpitx_fleet.json"
+
+
+def load_inventory(path=FLEET_FILE):
+    """Read the host inventory.
+
+    The file looks like {"defaults": {...}, "hosts": [{"name": "pi1", "host": "10.0.0.11"}, ...]};
+    each host entry overrides the defaults, which override the base settings.
+    """
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"hosts": data}
+    defaults = data.get("defaults", {})
+    hosts = []
+    for i, entry in enumerate(data.get("hosts", [])):
+        if isinstance(entry, str):
+            entry = {"host": entry}
+        merged = dict(defaults, **entry)
+        merged.setdefault("name", merged.get("host", f"host{i + 1}"))
+        if any(h["name"] == merged["name"] for h in hosts):
+            raise ValueError(f"Duplicate host name '{merged['name']}' in {path}")
+        hosts.append(merged)
+    return hosts
+
+
+class HostResult:
+    """Outcome of one fleet operation on one host"""
+
+    def __init__(self, name, ok, value=None, error=None, latency=0.0):
+        self.name = name
+        self.ok = ok
+        self.value = value
+        self.error = error
+        self.latency = latency
+
+    def describe(self):
+        if self.ok:
+            return f"{self.name}: ok ({self.latency * 1000:.0f} ms)"
+        return f"{self.name}: FAILED ({self.latency * 1000:.0f} ms) - {self.error}"
+
+
+class FleetResult:
+    """Per-host results of one fanned-out operation"""
+
+    def __init__(self, operation, results, elapsed, start_at=None):
+        self.operation = operation
+        self.results = results
+        self.elapsed = elapsed
+        self.start_at = start_at
+
+    @property
+    def ok(self):
+        return all(r.ok for r in self.results)
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.ok]
+
+    def latencies(self):
+        return {r.name: r.latency for r in self.results}
+
+    def describe(self):
+        lines = [f"{self.operation}: {len(self.results) - len(self.failed)}/{len(self.results)} ok "
+                 f"in {self.elapsed * 1000:.0f} ms"]
+        lines += ["  " + r.describe() for r in self.results]
+        return "\n".join(lines)
+
+
+class FleetController:
+    """Fans any controller operation out to many Pis at once.
+
+    Every host gets its own TransmitterController (and so its own persistent
+    connection); operations run concurrently on a thread pool sized to the
+    fleet, so a fleet-wide stop costs about one round trip rather than one
+    per host.
+    """
+
+    def __init__(self, hosts, base_settings=None, max_workers=None, on_process_change=None):
+        self.hosts = hosts
+        self.controllers = {}
+        base_settings = base_settings if base_settings is not None else load_settings()
+        # Share hashing and local conversion, so a file is processed once for the whole fleet
+        digests = DigestIndex()
+        preprocessor = AudioPreprocessor(digests=digests)
+        for entry in hosts:
+            settings = copy.deepcopy(base_settings)
+            settings.update({k: v for k, v in entry.items() if k != "name"})
+            if settings.get("log_file") and "log_file" not in entry:
+                # One rotating log per host; handlers sharing a file would fight over rotation
+                root, ext = os.path.splitext(settings["log_file"])
+                settings["log_file"] = f"{root}-{entry['name']}{ext}"
+            name = entry["name"]
+            callback = None
+            if on_process_change is not None:
+                callback = lambda proc, name=name: on_process_change(name, proc)
+            controller = TransmitterController(settings, on_process_change=callback, digests=digests)
+            controller.audio_preprocessor = preprocessor
+            self.controllers[name] = controller
+        self.clock_offsets = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or max(1, len(self.controllers)),
+            thread_name_prefix="rpitx-fleet"
+        )
+
+    @classmethod
+    def from_file(cls, path=FLEET_FILE, base_settings=None, names=None, **kwargs):
+        hosts = load_inventory(path)
+        if names:
+            hosts = [h for h in hosts if h["name"] in names]
+        return cls(hosts, base_settings, **kwargs)
+
+    def dispatch(self, operation, *args, **kwargs):
+        """Call operation(controller, *args, **kwargs) on every host concurrently.
+
+        `operation` is a controller method name or a callable taking the
+        controller first. Returns a FleetResult.
+        """
+        if isinstance(operation, str):
+            name = operation
+            operation = lambda controller, *a, **kw: getattr(controller, name)(*a, **kw)
+        else:
+            name = getattr(operation, "__name__", "operation")
+
+        def call(host, controller):
+            started = time.perf_counter()
+            try:
+                value = operation(controller, *args, **kwargs)
+                return HostResult(host, True, value, latency=time.perf_counter() - started)
+            except Exception as e:
+                return HostResult(host, False, error=str(e), latency=time.perf_counter() - started)
+
+        started = time.perf_counter()
+        futures = [self.executor.submit(call, host, c) for host, c in self.controllers.items()]
+        return FleetResult(name, [f.result() for f in futures], time.perf_counter() - started)
+
+    def connect_all(self):
+        return self.dispatch("connect")
+
+    def measure_clock_offsets(self):
+        """Estimate each Pi's clock offset from ours (NTP style, midpoint of the round trip)"""
+        def measure(controller):
+            offset, rtt = controller.clock_offset()
+            return {"offset": offset, "rtt": rtt}
+
+        result = self.dispatch(measure)
+        for r in result.results:
+            if r.ok:
+                self.clock_offsets[r.name] = r.value["offset"]
+        return result
+
+    def run(self, mode, freq_hz, start_at=None, start_in=None, compensate_clock=True, **params):
+        """Prepare a mode on every host, then start them all.
+
+        With `start_at` (a local epoch time) or `start_in` (seconds after
+        every host is prepared), each Pi waits on its own clock until that
+        moment before keying up, so the transmitters start within their
+        clock error rather than the spread of SSH latencies. Uploads happen
+        in the prepare step, before the countdown matters.
+        """
+        prepared = self.dispatch("prepare", mode, freq_hz, **params)
+        if start_in is not None:
+            start_at = time.time() + start_in
+        if start_at is not None and compensate_clock and not self.clock_offsets:
+            self.measure_clock_offsets()
+
+        ready = {self.controllers[r.name]: r.value for r in prepared.results if r.ok}
+
+        def start(controller):
+            if controller not in ready:
+                raise RuntimeError("prepare failed")
+            command = ready[controller]
+            if start_at is not None:
+                name = next(n for n, c in self.controllers.items() if c is controller)
+                offset = self.clock_offsets.get(name, 0.0) if compensate_clock else 0.0
+                command.start_at = start_at + offset
+            return controller.start(command)
+
+        started = self.dispatch(start)
+        # Report the real prepare error rather than the generic one
+        failures = {r.name: r.error for r in prepared.results if not r.ok}
+        for r in started.results:
+            if r.name in failures:
+                r.error = f"prepare failed: {failures[r.name]}"
+        started.operation = f"{mode} @ {freq_hz / 1e6:.6f} MHz"
+        started.start_at = start_at
+        return started
+
+    def stop_all(self):
+        """Emergency stop on every host at once; a host counts as failed unless verified stopped"""
+        def stop(controller):
+            result = controller.stop()
+            if not result.stopped:
+                raise RuntimeError(result.describe())
+            return result
+
+        result = self.dispatch(stop)
+        print(f"Fleet stop: {result.elapsed * 1000:.0f} ms for {len(result.results)} hosts")  # Debug output
+        return result
+
+    def status_all(self):
+        return self.dispatch("status")
+
+    def close(self):
+        self.dispatch("close")
+        self.executor.shutdown(wait=False)
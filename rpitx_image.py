@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import threading
+
+from rpitx_audio import trim_directory
+from rpitx_cache import DigestIndex
+
+CACHE_VERSION = 1
+
+
+class ImageProcessingError(Exception):
+    """Raised when an image can't be preprocessed (caller should send it as-is)"""
+
+
+class ImageFormat:
+    """Target geometry and colour depth for one transmission mode"""
+
+    def __init__(self, width, height, grayscale=False):
+        self.width = width
+        self.height = height
+        # Only brightness matters to the mode; colour is dropped so the preview shows what goes out
+        self.grayscale = grayscale
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def key(self):
+        return f"{self.width}x{self.height}/{'gray' if self.grayscale else 'rgb'}/8"
+
+
+# What the rpitx test scripts have ImageMagick make of the picture: raw
+# 8-bit RGB at a fixed size. Sending exactly this lets the Pi skip the decode.
+MODE_FORMATS = {
+    "spectrum": ImageFormat(320, 100, grayscale=True),
+    "sstv": ImageFormat(320, 256),
+}
+
+# The tools the test scripts end up running, fed the raw picture directly
+RAW_COMMANDS = {
+    "spectrum": "spectrumpaint {path} {freq_hz} 100000",
+    "sstv": "pisstv {path} {freq_hz}",
+}
+
+
+def require_pil():
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise ImageProcessingError("Pillow is not installed (pip install pillow)")
+    return Image, ImageOps
+
+
+class PreparedImage:
+    """A preprocessed picture ready for transfer, plus a preview Tk can show"""
+
+    def __init__(self, path, preview_path, input_bytes, output_bytes, from_cache):
+        self.path = path
+        self.preview_path = preview_path
+        self.input_bytes = input_bytes
+        self.output_bytes = output_bytes
+        self.from_cache = from_cache
+
+    @property
+    def ratio(self):
+        return self.input_bytes / float(self.output_bytes) if self.output_bytes else 1.0
+
+
+class ImagePreprocessor:
+    """Rotate, crop, scale and requantize pictures locally before they go to the Pi.
+
+    JPEGs are decoded in draft mode, which scales by 1/2 to 1/8 inside the
+    decoder, so a 12 MP photo never has to be unpacked at full size. The
+    result is cached on disk by input digest plus target format.
+    """
+
+    def __init__(self, cache_dir=None, digests=None, max_cache_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".khanfar_tx", "images")
+        self.digests = digests or DigestIndex()
+        self.max_cache_bytes = max_cache_bytes
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def cache_key(self, path, fmt):
+        params = {
+            "digest": self.digests.digest(path),
+            "format": fmt.key(),
+            "version": CACHE_VERSION,
+        }
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def process(self, path, fmt):
+        """Return a PreparedImage for `path` in format `fmt`"""
+        Image, ImageOps = require_pil()
+        input_bytes = os.path.getsize(path)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        key = self.cache_key(path, fmt)
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            out_path = os.path.join(self.cache_dir, key + ".rgb")
+            preview_path = os.path.join(self.cache_dir, key + ".ppm")
+            if os.path.exists(out_path) and os.path.exists(preview_path):
+                os.utime(out_path, None)
+                os.utime(preview_path, None)
+                return PreparedImage(out_path, preview_path, input_bytes, os.path.getsize(out_path), True)
+
+            try:
+                picture = self._convert(Image, ImageOps, path, fmt)
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                raise ImageProcessingError(f"Can't read {os.path.basename(path)}: {e}")
+            for target, data in ((out_path, picture.tobytes()), (preview_path, None)):
+                tmp = target + ".tmp"
+                try:
+                    if data is None:
+                        picture.save(tmp, "PPM")
+                    else:
+                        with open(tmp, "wb") as f:
+                            f.write(data)
+                    os.replace(tmp, target)
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+
+        trim_directory(self.cache_dir, self.max_cache_bytes, keep=(out_path, preview_path))
+        return PreparedImage(out_path, preview_path, input_bytes, os.path.getsize(out_path), False)
+
+    def _convert(self, Image, ImageOps, path, fmt):
+        with Image.open(path) as img:
+            # Let the JPEG decoder scale down while decoding; it stays at least as big as asked
+            img.draft("L" if fmt.grayscale else "RGB", fmt.size)
+            # Phone photos are often stored sideways with an EXIF rotation tag
+            img = ImageOps.exif_transpose(img)
+            img = img.convert("L" if fmt.grayscale else "RGB")
+        # Crop to the target aspect around the centre, then resample to the exact size
+        img = ImageOps.fit(img, fmt.size, Image.LANCZOS)
+        return img.convert("RGB")
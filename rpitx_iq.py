@@ -0,0 +1,252 @@
+import math
+import re
+import time
+
+from rpitx_audio import require_numpy
+
+# sendiq's supported sample rates
+MIN_RATE = 10000
+MAX_RATE = 250000
+DEFAULT_BLOCK = 16384
+
+# Names a waveform `expr` can use besides np, t, n, fs and pi
+EXPR_FUNCTIONS = ("sin", "cos", "exp", "sqrt", "abs", "sign", "floor", "where", "clip", "log", "log10")
+
+WAVEFORM_HELP = """One component per line (or separated by ';'); they are summed.
+Frequencies are in Hz relative to the carrier and may be negative.
+  tone FREQ [AMP]
+  multitone FREQ,FREQ,... [AMP]
+  chirp START STOP SECONDS [AMP]        linear sweep, repeating
+  logchirp START STOP SECONDS [AMP]     logarithmic sweep, repeating
+  steps START STOP COUNT SECONDS [AMP]  COUNT frequencies, SECONDS each
+  noise DBFS                            white Gaussian noise
+  expr EXPRESSION                       complex baseband of t (seconds),
+                                        n (sample index), fs, using np"""
+
+
+class _Component:
+    amplitude = 1.0
+
+    def render(self, np, start, n):
+        """Complex128 samples start..start+n"""
+        raise NotImplementedError
+
+
+class _Sweep(_Component):
+    """Anything defined by its instantaneous frequency; phase stays continuous across blocks"""
+
+    def __init__(self, rate, amplitude=1.0, phase=0.0):
+        self.rate = rate
+        self.amplitude = amplitude
+        self.phase = phase
+
+    def frequency(self, np, index):
+        raise NotImplementedError
+
+    def render(self, np, start, n):
+        index = np.arange(start, start + n, dtype=np.int64)
+        step = self.frequency(np, index) * (2 * math.pi / self.rate)
+        # Phase of each sample is the sum of the steps before it
+        phase = np.cumsum(step)
+        phase -= step
+        phase += self.phase
+        self.phase = float(phase[-1] + step[-1]) % (2 * math.pi)
+        return self.amplitude * np.exp(1j * phase)
+
+
+class _Tone(_Sweep):
+    def __init__(self, rate, freq, amplitude=1.0, phase=0.0):
+        super().__init__(rate, amplitude, phase)
+        self.freq = freq
+
+    def render(self, np, start, n):
+        # A fixed frequency needs no integration
+        phase = self.phase + (2 * math.pi * self.freq / self.rate) * np.arange(n)
+        self.phase = (self.phase + 2 * math.pi * self.freq * n / self.rate) % (2 * math.pi)
+        return self.amplitude * np.exp(1j * phase)
+
+
+class _Chirp(_Sweep):
+    def __init__(self, rate, start, stop, seconds, amplitude=1.0, log=False):
+        super().__init__(rate, amplitude)
+        self.start, self.stop, self.log = start, stop, log
+        self.period = max(int(round(seconds * rate)), 1)
+
+    def frequency(self, np, index):
+        position = (index % self.period) / self.period
+        if self.log:
+            return self.start * (self.stop / self.start) ** position
+        return self.start + (self.stop - self.start) * position
+
+
+class _Steps(_Sweep):
+    def __init__(self, rate, start, stop, count, seconds, amplitude=1.0):
+        super().__init__(rate, amplitude)
+        self.dwell = max(int(round(seconds * rate)), 1)
+        self.freqs = [start + (stop - start) * i / max(count - 1, 1) for i in range(count)]
+
+    def frequency(self, np, index):
+        return np.asarray(self.freqs)[(index // self.dwell) % len(self.freqs)]
+
+
+class _Noise(_Component):
+    amplitude = 0.0
+
+    def __init__(self, dbfs, seed=None):
+        self.sigma = 10 ** (dbfs / 20) / math.sqrt(2)
+        self.seed = seed
+        self.rng = None
+
+    def render(self, np, start, n):
+        if self.rng is None:
+            self.rng = np.random.default_rng(self.seed)
+        return self.rng.standard_normal(2 * n).view(np.complex128) * self.sigma
+
+
+class _Expr(_Component):
+    def __init__(self, rate, text):
+        self.rate = rate
+        self.text = text
+        try:
+            self.code = compile(text, "<waveform>", "eval")
+        except SyntaxError as e:
+            raise ValueError(f"Invalid expression '{text}': {e.msg}")
+
+    def render(self, np, start, n):
+        index = np.arange(start, start + n, dtype=np.int64)
+        names = {name: getattr(np, name) for name in EXPR_FUNCTIONS}
+        names.update(np=np, n=index, t=index / self.rate, fs=self.rate, pi=math.pi, j=1j)
+        try:
+            value = eval(self.code, {"__builtins__": {}}, names)
+            return np.broadcast_to(np.asarray(value, dtype=np.complex128), (n,))
+        except Exception as e:
+            raise ValueError(f"Expression '{self.text}' failed: {e}")
+
+
+def parse_waveform(text, rate, seed=None):
+    """Waveform description (see WAVEFORM_HELP) -> list of components"""
+    if not MIN_RATE <= rate <= MAX_RATE:
+        raise ValueError(f"Sample rate must be between {MIN_RATE} and {MAX_RATE} Hz")
+    components = []
+    for line in re.split(r"[;\n]", text):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        kind, _, rest = line.partition(" ")
+        kind = kind.lower()
+        if kind == "expr":
+            components.append(_Expr(rate, rest.strip()))
+            continue
+        args = rest.split()
+        try:
+            if kind == "multitone":
+                freqs = [float(f) for f in args[0].split(",") if f]
+                amplitude = float(args[1]) if len(args) > 1 else 1.0
+                _check_freqs(freqs, rate)
+                # Schroeder phases keep the peak of the sum low
+                components += [_Tone(rate, f, amplitude / len(freqs), math.pi * i * i / len(freqs))
+                               for i, f in enumerate(freqs)]
+            elif kind == "tone":
+                _check_args(kind, args, 1, 2)
+                _check_freqs([float(args[0])], rate)
+                components.append(_Tone(rate, float(args[0]), *map(float, args[1:])))
+            elif kind in ("chirp", "logchirp"):
+                _check_args(kind, args, 3, 4)
+                start, stop, seconds = map(float, args[:3])
+                _check_freqs([start, stop], rate)
+                if kind == "logchirp" and (start * stop <= 0):
+                    raise ValueError("a log chirp can't cross or start at 0 Hz")
+                if seconds <= 0:
+                    raise ValueError("the sweep time must be positive")
+                amplitude = float(args[3]) if len(args) > 3 else 1.0
+                components.append(_Chirp(rate, start, stop, seconds, amplitude, log=kind == "logchirp"))
+            elif kind == "steps":
+                _check_args(kind, args, 4, 5)
+                start, stop = float(args[0]), float(args[1])
+                count, seconds = int(args[2]), float(args[3])
+                _check_freqs([start, stop], rate)
+                if count < 1 or seconds <= 0:
+                    raise ValueError("need at least one step and a positive dwell time")
+                amplitude = float(args[4]) if len(args) > 4 else 1.0
+                components.append(_Steps(rate, start, stop, count, seconds, amplitude))
+            elif kind == "noise":
+                _check_args(kind, args, 1, 1)
+                components.append(_Noise(float(args[0]), seed=seed))
+            else:
+                raise ValueError(f"unknown component '{kind}'")
+        except (IndexError, ValueError) as e:
+            raise ValueError(f"Invalid waveform line '{line}': {e or 'missing value'}")
+    if not components:
+        raise ValueError("Empty waveform")
+    return components
+
+
+def _check_args(kind, args, least, most):
+    if not least <= len(args) <= most:
+        raise ValueError(f"{kind} takes {least}" + (f" to {most}" if most > least else "") + " values")
+
+
+def _check_freqs(freqs, rate):
+    for f in freqs:
+        if abs(f) > rate / 2:
+            raise ValueError(f"{f:g} Hz is outside +/-{rate / 2:g} Hz at {rate} samples/s")
+
+
+class IQSynth:
+    """Generates complex baseband for sendiq block by block.
+
+    Components are summed and scaled so their peak stays below `level`,
+    then written as interleaved float32 I/Q (sendiq -t float). Only one
+    block is in memory at a time, and phases carry over between blocks,
+    so the stream can run for as long as the transmitter does.
+    """
+
+    def __init__(self, waveform, rate, block=DEFAULT_BLOCK, level=0.9, seed=None):
+        self.np = require_numpy()
+        self.rate = int(rate)
+        self.block = int(block)
+        self.level = level
+        self.components = parse_waveform(waveform, self.rate, seed=seed)
+        peak = sum(c.amplitude for c in self.components) or 1.0
+        self.gain = level / peak
+        self.samples = 0
+        # Try expressions on a few samples now, so a bad one fails before going on air
+        for component in self.components:
+            if isinstance(component, _Expr):
+                component.render(self.np, 0, 16)
+
+    def render(self, n):
+        """The next n samples as complex64"""
+        np = self.np
+        total = np.zeros(n, dtype=np.complex128)
+        for component in self.components:
+            if not isinstance(component, _Noise):
+                total += component.render(np, self.samples, n)
+        total *= self.gain
+        # Noise levels are relative to full scale, so they skip the gain
+        for component in self.components:
+            if isinstance(component, _Noise):
+                total += component.render(np, self.samples, n)
+        self.samples += n
+        out = total.astype(np.complex64)
+        # Noise can poke past full scale; clip I and Q rather than wrap
+        np.clip(out.view(np.float32), -1.0, 1.0, out=out.view(np.float32))
+        return out
+
+    def blocks(self, duration=None):
+        """Yield sample blocks as bytes, forever or for `duration` seconds"""
+        remaining = int(round(duration * self.rate)) if duration else None
+        while remaining is None or remaining > 0:
+            n = self.block if remaining is None else min(self.block, remaining)
+            yield self.render(n).tobytes()
+            if remaining is not None:
+                remaining -= n
+
+    def benchmark(self, seconds=1.0):
+        """Samples per second this machine can generate"""
+        started = time.perf_counter()
+        count = 0
+        while time.perf_counter() - started < seconds:
+            count += len(self.render(self.block))
+        return count / (time.perf_counter() - started)
+
@@ -0,0 +1,350 @@
+import collections
+import itertools
+import json
+import os
+import shlex
+import threading
+import time
+
+from rpitx_controller import TransmitterController, TransmitterError
+from rpitx_presets import normalize_preset, preset_params
+from rpitx_process import STARTING
+
+JOBS_FILE = "rpitx_jobs.json"
+
+
+def describe_job(job):
+    when = time.strftime("%H:%M:%S", time.localtime(job["start_at"])) if job["start_at"] else "next"
+    if job["frequency"] is not None:
+        target = f"{job['frequency']} MHz"
+    else:
+        target = f"preset '{job['preset']}'"
+    text = f"{when}  {job['name']} @ {target}"
+    if job["duration"]:
+        text += f" for {job['duration']:g}s"
+    if job["repeat_every"]:
+        text += f", every {job['repeat_every']:g}s"
+    if job["last_gap"] is not None:
+        text += f" (last gap {job['last_gap'] * 1000:.0f} ms)"
+    if job["last_error"]:
+        text += f" - {job['last_error']}"
+    return text
+
+
+class JobQueue:
+    """Persistent list of queued transmissions (rpitx_jobs.json).
+
+    Jobs are plain dicts, like presets: mode, frequency (MHz) or a preset
+    name, mode params, and optionally start_at (epoch), duration and
+    repeat_every (seconds). One-shot jobs are removed once launched (and
+    kept in `history` for this session, so their handover gap, known only
+    once they're on air, still has a place to go); recurring ones are moved
+    to their next slot.
+    """
+
+    def __init__(self, path=JOBS_FILE, history=100):
+        self.path = path
+        self.jobs = []
+        self.history = collections.deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._load()
+        self._ids = itertools.count(max((job["id"] for job in self.jobs), default=0) + 1)
+
+    def add(self, mode, frequency=None, preset=None, params=None, start_at=None,
+            duration=None, repeat_every=None, name=None):
+        if frequency is None and preset is None:
+            raise TransmitterError("A job needs a frequency or a preset")
+        if repeat_every is not None and repeat_every <= 0:
+            raise TransmitterError("Repeat interval must be positive")
+        job = {
+            "id": next(self._ids),
+            "name": name or mode,
+            "mode": mode,
+            "frequency": frequency,
+            "preset": preset,
+            "params": params or {},
+            "start_at": start_at,
+            "duration": duration,
+            "repeat_every": repeat_every,
+            "created": time.time(),
+            "runs": 0,
+            "last_run": None,
+            "last_error": None,
+            "last_gap": None,
+        }
+        with self._lock:
+            self.jobs.append(job)
+            self._save()
+        return job
+
+    def remove(self, job_id):
+        with self._lock:
+            self.jobs = [job for job in self.jobs if job["id"] != job_id]
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self.jobs = []
+            self._save()
+
+    def list(self):
+        """Jobs in the order they will run"""
+        with self._lock:
+            return sorted((dict(job) for job in self.jobs), key=self._due)
+
+    def next_job(self, horizon):
+        """The first job due before `horizon`, or None"""
+        with self._lock:
+            due = [job for job in self.jobs if self._due(job) <= horizon]
+            return dict(min(due, key=self._due)) if due else None
+
+    def launched(self, job_id, error=None):
+        """Record a run and drop the job, or move a recurring one to its next slot"""
+        now = time.time()
+        with self._lock:
+            job = next((j for j in self.jobs if j["id"] == job_id), None)
+            if job is None:
+                return
+            job["runs"] += 1
+            job["last_run"] = now
+            job["last_error"] = error
+            if job["repeat_every"]:
+                start = job["start_at"] or now
+                # Skip slots that were missed (e.g. while the queue was paused)
+                while start <= now:
+                    start += job["repeat_every"]
+                job["start_at"] = start
+            else:
+                self.jobs.remove(job)
+                self.history.append(job)
+            self._save()
+
+    def record_gap(self, job_id, gap):
+        with self._lock:
+            for job in self.jobs:
+                if job["id"] == job_id:
+                    job["last_gap"] = gap
+                    self._save()
+                    return
+            for job in self.history:
+                if job["id"] == job_id:
+                    job["last_gap"] = gap
+                    return
+
+    def finished(self):
+        """One-shot jobs launched this session, oldest first"""
+        with self._lock:
+            return [dict(job) for job in self.history]
+
+    def has_one_shot_jobs(self):
+        with self._lock:
+            return any(not job["repeat_every"] for job in self.jobs)
+
+    @staticmethod
+    def _due(job):
+        return job["start_at"] or job["created"]
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                self.jobs = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.jobs = []
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.jobs, f, indent=4)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save job queue: {e}")
+
+
+class JobScheduler:
+    """Runs queued jobs back to back on one controller.
+
+    While a job is on air the next one is prepared (uploads, conversion)
+    and launched straight away; the Pi holds it until the current job has
+    touched its done file, so the handover doesn't wait on the network.
+    Each job's start/end is marked on the Pi's clock and the dead air
+    between consecutive jobs is recorded in `gaps`.
+    """
+
+    def __init__(self, controller, queue, prestage=30.0, on_event=None, history=100, presets=None):
+        self.controller = controller
+        self.queue = queue
+        # PresetStore for jobs that name a preset; without one the old settings list is searched
+        self.presets = presets
+        self.prestage = prestage
+        self.on_event = on_event
+        self.gaps = collections.deque(maxlen=history)
+        self._running = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._last = None
+        self._pending_gaps = []
+        self._seq = itertools.count(1)
+        self._clock_offset = None
+        self._jobs_dir_ready = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    @property
+    def jobs_dir(self):
+        return f"{self.controller.remote_temp_dir()}/jobs"
+
+    def start(self):
+        self._running.set()
+        self._wake.set()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def pause(self, cancel_staged=True):
+        """Stop launching jobs and cancel the one waiting on the Pi (blocking).
+
+        The job currently on air keeps going; use the controller's stop for
+        that (it also kills staged jobs, so pass cancel_staged=False then).
+        """
+        self._running.clear()
+        self._wake.set()
+        with self._lock:
+            last = self._last
+        if cancel_staged and last is not None and last[0].state == STARTING:
+            # Kill the waiter before closing the channel, otherwise it would still key up
+            self.controller.exec_command("pkill -f '[r]pitx-start-wait'")
+            self.controller.processes.stop(last[0])
+
+    def wake(self):
+        """Re-check the queue now (call after adding jobs)"""
+        self._wake.set()
+
+    def gap_summary(self):
+        gaps = list(self.gaps)
+        if not gaps:
+            return None
+        return {
+            "count": len(gaps),
+            "last_ms": gaps[-1] * 1000,
+            "min_ms": min(gaps) * 1000,
+            "avg_ms": sum(gaps) / len(gaps) * 1000,
+            "max_ms": max(gaps) * 1000,
+        }
+
+    def idle(self):
+        """True when nothing launched by the scheduler is still running"""
+        with self._lock:
+            return self._last is None or not self._last[0].active
+
+    def resolve(self, job):
+        """Frequency in Hz and prepare() params for a job, filling gaps from its preset"""
+        params = dict(job.get("params") or {})
+        frequency = job.get("frequency")
+        if job.get("preset"):
+            if self.presets is not None:
+                preset = self.presets.get(job["preset"])
+            else:
+                preset = next((normalize_preset(p) for p in self.controller.settings["saved_presets"]
+                               if p["name"] == job["preset"]), None)
+            if preset is None:
+                raise TransmitterError(f"Preset '{job['preset']}' not found")
+            if frequency is None:
+                frequency = preset["frequency"]
+            for key, value in preset_params(preset, job["mode"]).items():
+                params.setdefault(key, value)
+        return TransmitterController.freq_to_hz(frequency), params
+
+    def _emit(self, kind, job=None, detail=None):
+        if self.on_event is not None:
+            try:
+                self.on_event(kind, job, detail)
+            except Exception as e:
+                print(f"Scheduler callback error: {str(e)}")
+
+    def _loop(self):
+        while True:
+            self._wake.wait(0.2)
+            self._wake.clear()
+            self._collect_gaps()
+            if not self._running.is_set():
+                continue
+            try:
+                self._step()
+            except Exception as e:
+                self._emit("error", None, str(e))
+                self._wake.wait(2.0)
+
+    def _ensure_jobs_dir(self):
+        # Once per connection; a missing done file would stall the next job forever
+        transport = self.controller.session.get_transport()
+        if self._jobs_dir_ready is transport:
+            return
+        jobs_dir = shlex.quote(self.jobs_dir)
+        status, out, err = self.controller.exec_command(f"mkdir -p {jobs_dir} && rm -f {jobs_dir}/*.done")
+        if status != 0:
+            raise TransmitterError(f"Could not create {self.jobs_dir}: {err.strip()}")
+        self._jobs_dir_ready = transport
+
+    def _step(self):
+        with self._lock:
+            last = self._last
+        if last is not None and last[0].state == STARTING:
+            # One job is already staged behind the one on air
+            return
+        job = self.queue.next_job(time.time() + self.prestage)
+        if job is None:
+            return
+
+        try:
+            freq_hz, params = self.resolve(job)
+            # Uploads and conversion happen here, while the previous job is still on air
+            prepared = self.controller.prepare(job["mode"], freq_hz, **params)
+        except Exception as e:
+            self.queue.launched(job["id"], error=str(e))
+            self._emit("failed", job, str(e))
+            return
+        if not self._running.is_set():
+            self.controller.release(prepared)
+            return
+
+        prepared.duration = job.get("duration")
+        prepared.done_file = f"{self.jobs_dir}/{next(self._seq)}.done"
+        previous = last[0] if last is not None and last[0].active else None
+        if previous is not None:
+            prepared.after = last[1]
+        if job.get("start_at") and job["start_at"] > time.time():
+            if self._clock_offset is None:
+                self._clock_offset = self.controller.clock_offset()[0]
+            prepared.start_at = job["start_at"] + self._clock_offset
+
+        self._ensure_jobs_dir()
+        proc = self.controller.start(prepared)
+        with self._lock:
+            self._last = (proc, prepared.done_file)
+            if previous is not None:
+                self._pending_gaps.append((previous, proc, job["id"]))
+        self.queue.launched(job["id"])
+        self._emit("launched", job, proc)
+
+    def _collect_gaps(self):
+        with self._lock:
+            pending = list(self._pending_gaps)
+        for entry in pending:
+            previous, proc, job_id = entry
+            ended = previous.mark_time("end")
+            started = proc.mark_time("start")
+            if ended is not None and started is not None:
+                gap = started - ended
+                self.gaps.append(gap)
+                self.queue.record_gap(job_id, gap)
+                print(f"Job handover gap: {gap * 1000:.1f} ms")  # Debug output
+                self._emit("gap", None, gap)
+            elif previous.active or proc.active:
+                # Markers still to come
+                continue
+            with self._lock:
+                self._pending_gaps.remove(entry)
@@ -0,0 +1,120 @@
+import collections
+import itertools
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+
+class LogBuffer:
+    """Fixed-size ring buffer of remote output lines.
+
+    The process monitor feeds raw stdout/stderr chunks in; readers such as
+    the GUI log pane poll `since(seq)` on their own timer and get every new
+    line in one batch, so a chatty process can't flood the Tk loop. Lines
+    can also be mirrored to a rotating log file; the file writes happen on
+    a listener thread, never on the monitor thread.
+    """
+
+    def __init__(self, max_lines=2000, max_line_length=1000, log_file=None,
+                 max_bytes=5 * 1024 * 1024, backups=3):
+        self.max_line_length = max_line_length
+        self.total = 0
+        self.echo = None
+        self._lines = collections.deque(maxlen=max_lines)
+        self._partial = {}
+        self._lock = threading.Lock()
+        self._logger = None
+        self._listener = None
+        if log_file:
+            self.open_file(log_file, max_bytes, backups)
+
+    def open_file(self, log_file, max_bytes=5 * 1024 * 1024, backups=3):
+        self.close()
+        try:
+            handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=max_bytes, backupCount=backups, encoding="utf-8"
+            )
+        except OSError as e:
+            print(f"Could not open log file {log_file}: {e}")
+            return
+        # Lines arrive pre-formatted, one record per chunk (a record per line is far too slow)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        records = queue.Queue()
+        self._logger = logging.getLogger(f"rpitx.remote.{id(self)}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.handlers = [logging.handlers.QueueHandler(records)]
+        self._listener = logging.handlers.QueueListener(records, handler)
+        self._listener.start()
+
+    def close(self):
+        """Flush and close the log file; the in-memory buffer keeps working"""
+        if self._listener is not None:
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+            self._logger = None
+
+    def feed(self, proc, stream, data):
+        """Add a raw output chunk; only complete lines are stored, the rest waits for more"""
+        key = (proc.pid, stream)
+        with self._lock:
+            text = self._partial.pop(key, "") + data.decode(errors="replace")
+            lines = text.split("\n")
+            rest = lines.pop()
+            if len(rest) > self.max_line_length:
+                # No newline in sight; don't let one endless line grow without bound
+                lines.append(rest)
+                rest = ""
+            if rest:
+                self._partial[key] = rest
+        self.add_lines(proc.label, stream, [line.rstrip("\r") for line in lines])
+
+    def finish(self, proc):
+        """Flush any unterminated lines of a process that has ended"""
+        for stream in ("stdout", "stderr"):
+            with self._lock:
+                rest = self._partial.pop((proc.pid, stream), None)
+            if rest:
+                self.add(proc.label, stream, rest)
+
+    def add(self, source, stream, line):
+        self.add_lines(source, stream, [line])
+
+    def add_lines(self, source, stream, lines):
+        if not lines:
+            return
+        now = time.time()
+        entries = [(now, source, stream, line[:self.max_line_length]) for line in lines]
+        with self._lock:
+            self._lines.extend(entries)
+            self.total += len(entries)
+        if self._logger is not None:
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+            self._logger.info("\n".join(f"{stamp} [{source}] {stream}: {e[3]}" for e in entries))
+        if self.echo is not None:
+            self.echo.write("".join(self.format(e) + "\n" for e in entries))
+
+    def since(self, seq):
+        """Lines added after `seq`. Returns (new seq, entries, lines that already fell out of the buffer)"""
+        with self._lock:
+            new = self.total - seq
+            available = min(new, len(self._lines))
+            entries = list(itertools.islice(self._lines, len(self._lines) - available, None))
+            return self.total, entries, new - available
+
+    def tail(self, count=50):
+        with self._lock:
+            return list(self._lines)[-count:]
+
+    def clear(self):
+        with self._lock:
+            self._lines.clear()
+
+    @staticmethod
+    def format(entry):
+        timestamp, source, stream, line = entry
+        return f"{time.strftime('%H:%M:%S', time.localtime(timestamp))} [{source}] {line}"
@@ -0,0 +1,269 @@
+import csv
+import json
+import os
+import re
+
+MESSAGE_KINDS = ("pocsag", "rtty", "opera")
+
+MAX_ADDRESS = 2 ** 21 - 1
+MAX_POCSAG_CHARS = 240
+MAX_RTTY_CHARS = 1000
+# Characters an ITA2 (Baudot) teleprinter can send; text is upper-cased first
+RTTY_CHARS = set("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 -?:$!&#'().,;/\"")
+CALLSIGN = re.compile(r"[A-Z0-9/]{1,10}")
+# Error texts kept in the final report; later failures are listed without one
+MAX_REPORTED_ERRORS = 50
+
+FIELDS = {"pocsag": ("address", "function", "message"), "rtty": ("message",), "opera": ("callsign",)}
+
+# Runs on the Pi as `sudo python3 -u -c MESSAGES_BOOTSTRAP rpitx-messages KIND FREQ`
+# (the tag lets the stop sequence's `pkill -f rpitx` find it). The first stdin
+# line is this script, JSON-encoded; every further line is one record, so no
+# message text ever passes through a shell. POCSAG records with the same
+# function go out together in one pocsag run, in groups of up to 32.
+MESSAGES_BOOTSTRAP = "import json, sys; exec(json.loads(sys.stdin.readline()))"
+MESSAGES_SCRIPT = r'''
+import json, signal, subprocess, sys, time
+
+class Stop(Exception):
+    pass
+
+def on_signal(signum, frame):
+    raise Stop()
+
+def mark(*fields):
+    sys.stderr.write("@rpitx " + " ".join(str(f) for f in fields) + "\n")
+    sys.stderr.flush()
+
+signal.signal(signal.SIGTERM, on_signal)
+signal.signal(signal.SIGINT, on_signal)
+signal.signal(signal.SIGHUP, on_signal)
+
+KIND, FREQ = sys.argv[2], sys.argv[3]
+GROUP = 32
+child = None
+sent, failed_lines, errors = 0, [], {}
+
+def run(args, text=None):
+    global child
+    child = subprocess.Popen(args, stdin=subprocess.PIPE if text is not None else subprocess.DEVNULL,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    _, err = child.communicate(text.encode() if text is not None else None)
+    rc, child = child.returncode, None
+    if rc != 0:
+        return (err.decode(errors="replace").strip().splitlines() or ["exit code %d" % rc])[-1]
+    return None
+
+def finish(records, problem):
+    global sent
+    for record in records:
+        if problem:
+            failed_lines.append(record["line"])
+            if len(errors) < MAX_ERRORS:
+                errors[record["line"]] = problem
+        else:
+            sent += 1
+    mark("progress", sent, len(failed_lines))
+
+def send_pages(group):
+    text = "".join("%d:%s\n" % (r["address"], r["message"]) for r in group)
+    finish(group, run(["./pocsag", "-f", FREQ, "-b", str(group[0]["function"])], text))
+
+started = time.time()
+error, stopped = None, False
+try:
+    group = []
+    for line in sys.stdin:
+        record = json.loads(line)
+        if KIND == "pocsag":
+            if group and (record["function"] != group[0]["function"] or len(group) >= GROUP):
+                send_pages(group)
+                group = []
+            group.append(record)
+        elif KIND == "rtty":
+            finish([record], run(["./testrtty.sh", FREQ, record["message"]]))
+        else:
+            finish([record], run(["./testopera.sh", FREQ, record["callsign"]]))
+    if group:
+        send_pages(group)
+except Stop:
+    stopped = True
+except Exception as e:
+    error = str(e)
+finally:
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if child is not None and child.poll() is None:
+        child.terminate()
+        child.wait()
+
+elapsed = time.time() - started
+report = {"sent": sent, "failed": len(failed_lines), "failed_lines": failed_lines, "errors": errors,
+          "seconds": elapsed, "per_second": sent / elapsed if elapsed > 0 else 0.0, "stopped": stopped,
+          "error": error}
+mark("messages", json.dumps(report, separators=(",", ":")))
+sys.exit(1 if error or failed_lines else 0)
+'''
+
+
+class MessageRecord:
+    """One line of a message file: its values once validated, or why it was rejected"""
+
+    def __init__(self, line, values=None, error=None):
+        self.line = line
+        self.values = values
+        self.error = error
+        self.status = f"invalid: {error}" if error else "pending"
+
+    @property
+    def valid(self):
+        return self.error is None
+
+
+def read_rows(path):
+    """(line number, dict or list) for each non-empty row of a CSV or JSON-lines file"""
+    is_json = os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson", ".json")
+    rows = []
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        if is_json:
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        rows.append((number, json.loads(line)))
+                    except ValueError as e:
+                        rows.append((number, ValueError(f"bad JSON: {e}")))
+            return rows
+        for number, row in enumerate(csv.reader(f), 1):
+            if row and any(cell.strip() for cell in row) and not row[0].lstrip().startswith("#"):
+                rows.append((number, row))
+    return rows
+
+
+def load_messages(path, kind):
+    """Read and validate a message file. Returns a MessageRecord per row, invalid ones included"""
+    if kind not in MESSAGE_KINDS:
+        raise ValueError(f"Unknown message kind '{kind}'")
+    rows = read_rows(path)
+    header = None
+    if rows and isinstance(rows[0][1], list) and any(cell.strip().lower() in FIELDS[kind] for cell in rows[0][1]):
+        header = [cell.strip().lower() for cell in rows.pop(0)[1]]
+    records = []
+    for number, row in rows:
+        try:
+            if isinstance(row, Exception):
+                raise row
+            if isinstance(row, str) and kind != "pocsag":
+                row = {FIELDS[kind][0]: row}
+            fields = row if isinstance(row, dict) else _csv_fields(kind, row, header)
+            records.append(MessageRecord(number, VALIDATORS[kind](fields)))
+        except (KeyError, TypeError, ValueError) as e:
+            message = f"missing {e}" if isinstance(e, KeyError) else str(e)
+            records.append(MessageRecord(number, error=message))
+    return records
+
+
+def _csv_fields(kind, row, header):
+    if header:
+        return {name: value for name, value in zip(header, row) if name}
+    if kind == "pocsag":
+        # address,message or address,function,message; an unquoted comma in the message is kept
+        if len(row) == 2 or not row[1].strip().isdigit():
+            return {"address": row[0], "message": ",".join(row[1:])}
+        return {"address": row[0], "function": row[1], "message": ",".join(row[2:])}
+    return {FIELDS[kind][0]: ",".join(row)}
+
+
+def _text(value, name):
+    if not isinstance(value, str):
+        raise ValueError(f"{name} must be text")
+    # One record is one line on the Pi's side
+    return " ".join(value.split())
+
+
+def _validate_pocsag(fields):
+    function = fields.get("function")
+    try:
+        address = int(str(fields["address"]).strip())
+        # pocsag's own default
+        function = 3 if function is None or str(function).strip() == "" else int(str(function).strip())
+    except ValueError:
+        raise ValueError("address and function must be whole numbers")
+    if not 0 <= address <= MAX_ADDRESS:
+        raise ValueError(f"address must be between 0 and {MAX_ADDRESS}")
+    if not 0 <= function <= 3:
+        raise ValueError("function must be 0-3")
+    message = _text(fields["message"], "message")
+    if not message:
+        raise ValueError("empty message")
+    if len(message) > MAX_POCSAG_CHARS:
+        raise ValueError(f"message longer than {MAX_POCSAG_CHARS} characters")
+    if not all(" " <= c <= "~" for c in message):
+        raise ValueError("message has characters a pager can't show (printable ASCII only)")
+    return {"address": address, "function": function, "message": message}
+
+
+def _validate_rtty(fields):
+    message = _text(fields["message"], "message").upper()
+    if not message:
+        raise ValueError("empty message")
+    if len(message) > MAX_RTTY_CHARS:
+        raise ValueError(f"message longer than {MAX_RTTY_CHARS} characters")
+    bad = sorted(set(message) - RTTY_CHARS)
+    if bad:
+        raise ValueError(f"can't send {''.join(bad)!r} in RTTY")
+    return {"message": message}
+
+
+def _validate_opera(fields):
+    callsign = _text(fields["callsign"], "callsign").upper()
+    if not CALLSIGN.fullmatch(callsign):
+        raise ValueError(f"'{callsign}' is not a callsign (letters, digits and /, up to 10)")
+    return {"callsign": callsign}
+
+
+VALIDATORS = {"pocsag": _validate_pocsag, "rtty": _validate_rtty, "opera": _validate_opera}
+
+
+def message_chunks(records):
+    """The engine followed by the valid records, as JSON lines for its stdin"""
+    yield (json.dumps(f"MAX_ERRORS = {MAX_REPORTED_ERRORS}\n" + MESSAGES_SCRIPT) + "\n").encode()
+    for record in records:
+        if record.valid:
+            yield (json.dumps(dict(record.values, line=record.line), separators=(",", ":")) + "\n").encode()
+
+
+def messages_report(proc):
+    """Final report of a finished messages process, or None"""
+    return proc.mark_json("messages")
+
+
+def apply_report(records, report):
+    """Set each valid record's status from the engine's report (None if it never reported)"""
+    report = report or {}
+    failed = set(report.get("failed_lines", []))
+    errors = {int(line): error for line, error in report.get("errors", {}).items()}
+    done = report.get("sent", 0) + len(failed)
+    # The engine works in file order, so the first `done` valid records were attempted
+    for i, record in enumerate(r for r in records if r.valid):
+        if record.line in failed:
+            record.status = f"failed: {errors.get(record.line, 'see remote output')}"
+        elif i < done:
+            record.status = "sent"
+        else:
+            record.status = "not sent"
+    return records
+
+
+def describe_messages(report, records):
+    invalid = sum(1 for r in records if not r.valid)
+    text = (f"{report['sent']} of {len(records)} sent in {report['seconds']:.1f} s "
+            f"({report['per_second']:.2f} msg/s)")
+    if report["failed"]:
+        text += f", {report['failed']} failed"
+    if invalid:
+        text += f", {invalid} invalid"
+    if report.get("stopped"):
+        text += " - stopped"
+    if report.get("error"):
+        text += f" - {report['error']}"
+    return text
@@ -0,0 +1,207 @@
+import collections
+import contextlib
+import json
+import math
+import os
+import re
+import threading
+import time
+
+METRICS_FILE = "rpitx_metrics.json"
+
+# Phases shown first in the debug panel, roughly in the order they happen
+PHASE_ORDER = ("startup", "ui", "ssh.connect", "agent", "path_check", "image.convert", "upload.digest", "upload.mkdir",
+               "upload.stat", "upload.transfer", "upload.verify", "upload.throughput", "upload.evict", "prepare",
+               "launch.exec", "launch.total", "reattach", "stop.channel", "stop.step", "stop.remote", "stop.total")
+
+
+class Histogram:
+    """Recent samples of one phase plus lifetime count/sum.
+
+    Percentiles come from a sliding window of the last `window` samples,
+    so they follow regressions instead of averaging them away.
+    """
+
+    def __init__(self, unit="seconds", window=1000):
+        self.unit = unit
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def summary(self):
+        values = sorted(self.samples)
+        summary = {"unit": self.unit, "count": self.count, "sum": self.sum, "errors": self.errors}
+        if values:
+            summary.update({
+                "last": self.samples[-1],
+                "min": values[0],
+                "p50": percentile(values, 0.50),
+                "p95": percentile(values, 0.95),
+                "p99": percentile(values, 0.99),
+                "max": values[-1],
+            })
+        return summary
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    return values[min(len(values), max(1, math.ceil(q * len(values)))) - 1]
+
+
+class Metrics:
+    """In-memory per-phase timings, exportable as JSON or Prometheus text.
+
+    Recording is a dict lookup and a deque append under a lock, cheap
+    enough to leave on everywhere. Use `timer(name)` around a phase or
+    `observe(name, value)` for values measured elsewhere (e.g. on the Pi).
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.started = time.time()
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _histogram(self, name, unit):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = Histogram(unit, self.window)
+        return histogram
+
+    def observe(self, name, value, unit="seconds"):
+        with self._lock:
+            self._histogram(name, unit).observe(value)
+
+    def error(self, name, unit="seconds"):
+        with self._lock:
+            self._histogram(name, unit).errors += 1
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Time the block; a block that raises only counts as an error, so failures don't skew the percentiles"""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.error(name)
+            raise
+        self.observe(name, time.perf_counter() - started)
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        """{phase: summary dict}, known phases first"""
+        with self._lock:
+            names = sorted(self._histograms, key=self._sort_key)
+            return {name: self._histograms[name].summary() for name in names}
+
+    @staticmethod
+    def _sort_key(name):
+        # Stable sort: phases of one group (e.g. stop steps) stay in the order they first ran
+        for i, phase in enumerate(PHASE_ORDER):
+            if name == phase or name.startswith(phase + "."):
+                return i
+        return len(PHASE_ORDER)
+
+    def to_json(self):
+        return {"started": self.started, "exported": time.time(), "phases": self.snapshot()}
+
+    def save(self, path=METRICS_FILE):
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.to_json(), f, indent=4)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not save metrics: {e}")
+
+    def prometheus_text(self):
+        """Prometheus text exposition: one summary family per unit, the phase as a label"""
+        families = collections.defaultdict(list)
+        for name, s in self.snapshot().items():
+            families[s["unit"]].append((name, s))
+        lines = []
+        for unit, phases in families.items():
+            family = "rpitx_phase_" + re.sub(r"[^a-zA-Z0-9_]", "_", unit)
+            lines.append(f"# HELP {family} Time (or rate) of each rpitx remote-control phase")
+            lines.append(f"# TYPE {family} summary")
+            for name, s in phases:
+                label = f'phase="{name}"'
+                for q, quantile in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")):
+                    if q in s:
+                        lines.append(f'{family}{{{label},quantile="{quantile}"}} {s[q]:.6g}')
+                lines.append(f"{family}_sum{{{label}}} {s['sum']:.6g}")
+                lines.append(f"{family}_count{{{label}}} {s['count']}")
+            lines.append(f"# TYPE {family}_errors_total counter")
+            for name, s in phases:
+                lines.append(f'{family}_errors_total{{phase="{name}"}} {s["errors"]}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve /metrics (Prometheus) and /metrics.json on a background thread"""
+        import http.server
+        self.stop_server()
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body = json.dumps(metrics.to_json(), indent=4).encode()
+                    content_type = "application/json"
+                elif self.path.startswith("/metrics"):
+                    body = metrics.prometheus_text().encode()
+                    content_type = "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((host, int(port)), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f"Metrics at http://{host}:{self._server.server_port}/metrics")  # Debug output
+        return self._server.server_port
+
+    def stop_server(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def format_table(snapshot):
+    """Plain-text table of a snapshot for the debug panel and the CLI"""
+    lines = [f"{'phase':<28}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}{'err':>5}"]
+    for name, s in snapshot.items():
+        if s["unit"] == "seconds":
+            fmt = lambda v: f"{v * 1000:.1f}ms"
+        elif s["unit"] == "bytes_per_second":
+            fmt = lambda v: f"{v / 1e6:.2f}MB/s"
+        else:
+            fmt = lambda v: f"{v:.3g}"
+        values = [fmt(s[q]) if q in s else "-" for q in ("p50", "p95", "p99", "max")]
+        lines.append(f"{name:<28}{s['count']:>7}" + "".join(f"{v:>10}" for v in values) + f"{s['errors']:>5}")
+    return "\n".join(lines)
+
+
+# Shared by every session, cache and controller in the process (like a logger)
+METRICS = Metrics()
@@ -0,0 +1,365 @@
+import collections
+import json
+import os
+import time
+
+# RDS limits: programme service name and radiotext
+MAX_PS = 8
+MAX_RT = 64
+# Tracks queued on the Pi ahead of the one on air
+DEFAULT_PREFETCH = 2
+POLL = 0.25
+
+# Same bootstrap as the message engine: the first stdin line is the script,
+# JSON-encoded. Runs as `sudo python3 -u -c PLAYLIST_BOOTSTRAP rpitx-playlist FREQ CACHE_DIR`
+# (the tag lets the stop sequence's `pkill -f rpitx` find it).
+PLAYLIST_BOOTSTRAP = "import json, sys; exec(json.loads(sys.stdin.readline()))"
+
+# One pifmrds runs for the whole playlist, reading a single endless WAV
+# stream from this engine. Every further stdin line names a track already in
+# CACHE_DIR (48 kHz mono 16-bit, see MODE_FORMATS) and where its samples
+# are; the engine copies them in back to back, so there is no gap
+# and no restart between tracks. While the next track isn't there yet it
+# feeds silence, so pifmrds never starves. Radiotext goes through pifmrds'
+# -ctl fifo. A WAV stream can't announce more than 4 GiB (~12 h at this
+# rate), so pifmrds is restarted at a track boundary before that runs out.
+# FREQ_MHZ, PS and RT are prepended.
+PLAYLIST_SCRIPT = r'''
+import fcntl, json, os, queue, shutil, signal, struct, subprocess, sys, tempfile, threading, time
+
+class Stop(Exception):
+    pass
+
+def on_signal(signum, frame):
+    raise Stop()
+
+def mark(*fields):
+    sys.stderr.write("@rpitx " + " ".join(str(f) for f in fields) + "\n")
+    sys.stderr.flush()
+
+signal.signal(signal.SIGTERM, on_signal)
+signal.signal(signal.SIGINT, on_signal)
+signal.signal(signal.SIGHUP, on_signal)
+
+CACHE = sys.argv[3]
+RATE, WIDTH = 48000, 2
+CHUNK = 16384
+SILENCE = b"\0" * (RATE * WIDTH // 20)
+MAX_DATA = (0xFFFFFFFF - 36) // WIDTH * WIDTH
+HEADER = struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + MAX_DATA, b"WAVE", b"fmt ", 16, 1, 1,
+                     RATE, RATE * WIDTH, WIDTH, 16, b"data", MAX_DATA)
+# Keep what sits in the pipe short, so the track mark and radiotext change when the track is heard
+PIPE_BYTES = 16384
+
+commands = queue.Queue()
+
+def read_commands():
+    for line in sys.stdin:
+        if line.strip():
+            commands.put(json.loads(line))
+    commands.put(None)
+
+threading.Thread(target=read_commands, daemon=True).start()
+
+ctl_dir = tempfile.mkdtemp(prefix="playlist-")
+ctl_path = os.path.join(ctl_dir, "rds")
+os.mkfifo(ctl_path)
+# Held open for writing, so pifmrds never sees the fifo close
+ctl = os.open(ctl_path, os.O_RDWR | os.O_NONBLOCK)
+
+modulator, written = None, 0
+
+def start_modulator():
+    global modulator, written
+    modulator = subprocess.Popen(["./pifmrds", "-freq", "%.4f" % FREQ_MHZ, "-audio", "-", "-ctl", ctl_path,
+                                  "-ps", PS, "-rt", RT], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, bufsize=0)
+    try:
+        fcntl.fcntl(modulator.stdin.fileno(), getattr(fcntl, "F_SETPIPE_SZ", 1031), PIPE_BYTES)
+    except OSError:
+        pass
+    written = 0
+    send(HEADER)
+
+def stop_modulator():
+    global modulator
+    if modulator is not None:
+        try:
+            modulator.stdin.close()
+        except OSError:
+            pass
+        if modulator.poll() is None:
+            modulator.terminate()
+            try:
+                modulator.wait(2)
+            except subprocess.TimeoutExpired:
+                modulator.kill()
+                modulator.wait()
+    modulator = None
+
+def send(data):
+    view = memoryview(data)
+    try:
+        while view:
+            view = view[os.write(modulator.stdin.fileno(), view):]
+    except BrokenPipeError:
+        raise RuntimeError("pifmrds exited with code %s" % modulator.wait())
+
+def audio(data):
+    global written
+    if written + len(data) > MAX_DATA:
+        stop_modulator()
+        start_modulator()
+        restarts.append(time.time())
+    send(data)
+    written += len(data)
+
+def radiotext(text):
+    try:
+        os.write(ctl, ("RT %s\n" % text).encode("latin-1", "replace"))
+    except OSError:
+        pass
+
+started = time.time()
+played, skipped, restarts = 0, [], []
+gaps, gap_seconds = 0, 0.0
+error, stopped = None, False
+try:
+    tracks, ended, waiting = [], False, False
+    while True:
+        try:
+            while True:
+                item = commands.get(block=modulator is None and not tracks and not ended)
+                if item is None:
+                    ended = True
+                else:
+                    tracks.append(item)
+        except queue.Empty:
+            pass
+        if not tracks:
+            if ended:
+                break
+            # The next track is late; keep the carrier modulated with silence until it arrives
+            if not waiting:
+                gaps += 1
+                waiting = True
+            audio(SILENCE)
+            gap_seconds += len(SILENCE) / float(RATE * WIDTH)
+            continue
+        waiting = False
+        track = tracks.pop(0)
+        try:
+            f = open(os.path.join(CACHE, os.path.basename(track["file"])), "rb")
+        except OSError as e:
+            skipped.append(track["n"])
+            mark("skip", track["n"], e.strerror)
+            continue
+        with f:
+            if modulator is None:
+                start_modulator()
+            elif written + track["size"] > MAX_DATA and written > 0:
+                # Restart now rather than in the middle of the track
+                stop_modulator()
+                start_modulator()
+                restarts.append(time.time())
+            f.seek(track["offset"])
+            remaining = track["size"]
+            mark("track", track["n"], track["title"])
+            radiotext(track["title"])
+            while remaining > 0:
+                data = f.read(min(CHUNK, remaining))
+                if not data:
+                    break
+                audio(data)
+                remaining -= len(data)
+        played += 1
+except Stop:
+    stopped = True
+except Exception as e:
+    error = str(e)
+finally:
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stop_modulator()
+    os.close(ctl)
+    shutil.rmtree(ctl_dir, ignore_errors=True)
+
+report = {"played": played, "skipped": len(skipped), "skipped_tracks": skipped, "gaps": gaps,
+          "gap_seconds": gap_seconds, "restarts": len(restarts), "seconds": time.time() - started,
+          "stopped": stopped, "error": error}
+mark("playlist", json.dumps(report, separators=(",", ":")))
+sys.exit(1 if error else 0)
+'''
+
+
+class Track:
+    """One playlist entry: a local WAV and the radiotext shown while it plays"""
+
+    def __init__(self, path, title=None):
+        self.path = path
+        self.title = rds_text(title or os.path.splitext(os.path.basename(path))[0], MAX_RT)
+
+
+def rds_text(text, limit):
+    """Printable, single-line text cut to an RDS field's length"""
+    text = " ".join(str(text).split())
+    return "".join(c if " " <= c <= "~" else "?" for c in text)[:limit]
+
+
+def load_playlist(path):
+    """Tracks of an M3U/M3U8 playlist or a plain list of WAV paths, one per line.
+
+    Relative paths are taken from the playlist's directory. An #EXTINF
+    title ("#EXTINF:123,Artist - Title") becomes the track's radiotext.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    tracks, title = [], None
+    with open(path, "r", encoding="utf-8-sig", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("#"):
+                if line.upper().startswith("#EXTINF:") and "," in line:
+                    title = line.split(",", 1)[1].strip() or None
+                continue
+            track_path = os.path.expanduser(line)
+            if not os.path.isabs(track_path):
+                track_path = os.path.join(base, track_path)
+            tracks.append(Track(track_path, title))
+            title = None
+    return tracks
+
+
+def build_playlist_script(freq_hz, ps, rt=""):
+    """The engine script with the station settings baked in (sent as the first stdin line)"""
+    header = (f"FREQ_MHZ = {freq_hz / 1e6!r}\nPS = {json.dumps(rds_text(ps, MAX_PS) or 'RPITX')}\n"
+              f"RT = {json.dumps(rds_text(rt, MAX_RT))}\n")
+    return (json.dumps(header + PLAYLIST_SCRIPT) + "\n").encode()
+
+
+class PlaylistFeed:
+    """Feeds tracks to the playlist engine, staying `prefetch` tracks ahead of the one on air.
+
+    `prepare(track)` converts and uploads one track and returns its engine
+    record (file name in the cache, offset and size of the samples); it runs on the stdin streaming
+    thread, so the next tracks are made ready while the current one plays.
+    The engine's "@rpitx track" marks on the process (see attach()) tell how
+    far playback has got. Tracks that can't be prepared are skipped.
+    `release(record)`, if given, is called for each sent track once it is on
+    air (the engine has it open by then), so only the prefetched ones need
+    to stay in the cache.
+    """
+
+    def __init__(self, tracks, prepare, loop=False, prefetch=DEFAULT_PREFETCH, release=None):
+        self.tracks = tracks
+        self.prepare = prepare
+        self.release = release
+        self.loop = loop
+        self.prefetch = max(1, int(prefetch))
+        self.proc = None
+        self.sent = 0
+        self.first = None
+        # (n, record) of the tracks sent that aren't on air yet
+        self.queued = collections.deque()
+
+    def attach(self, proc):
+        self.proc = proc
+
+    def playing(self):
+        """Sequence number of the track on air (0 before the first)"""
+        values = self.proc.marks.get("track") if self.proc is not None else None
+        try:
+            return int(values[0]) if values else 0
+        except ValueError:
+            return 0
+
+    def prepare_first(self):
+        """Make the first track that can be prepared ready, before launch. Returns it or None"""
+        for i, track in enumerate(self.tracks):
+            record = self._prepare(track)
+            if record is not None:
+                self.first = (i, record)
+                return track
+        return None
+
+    def chunks(self, script):
+        yield script
+        start, ready = 0, False
+        if self.first is not None:
+            start, ready = self.first[0] + 1, True
+            yield self._line(self.first[1])
+        while True:
+            for track in self.tracks[start:]:
+                if not self._wait():
+                    return
+                record = self._prepare(track)
+                if record is not None:
+                    ready = True
+                    yield self._line(record)
+            # Don't spin through a list where nothing can be sent any more
+            if not self.loop or not ready:
+                return
+            start, ready = 0, False
+
+    def _wait(self):
+        """Block until another track may be queued; False once the process is gone"""
+        while True:
+            proc = self.proc
+            if proc is not None and not proc.active:
+                return False
+            if proc is not None:
+                playing = self.playing()
+                self._on_air(playing)
+                if self.sent - playing < self.prefetch:
+                    return True
+            time.sleep(POLL)
+
+    def _on_air(self, playing):
+        """Release the tracks up to the one playing (or skipped on the way there)"""
+        while self.queued and self.queued[0][0] <= playing:
+            _, record = self.queued.popleft()
+            if self.release is not None:
+                self.release(record)
+
+    def _prepare(self, track):
+        try:
+            return self.prepare(track)
+        except Exception as e:
+            print(f"Playlist: skipping {os.path.basename(track.path)} ({str(e)})")  # Debug output
+            return None
+
+    def _line(self, record):
+        self.sent += 1
+        self.queued.append((self.sent, record))
+        return (json.dumps(dict(record, n=self.sent), separators=(",", ":")) + "\n").encode()
+
+
+def now_playing(proc):
+    """Radiotext of the track a playlist process has on air, or None"""
+    text = proc.mark_text.get("track")
+    # "<n> <title>"; the title may have spaces of its own
+    return text.split(None, 1)[1] if text and " " in text else None
+
+
+def playlist_report(proc):
+    """Final report of a finished playlist process, or None"""
+    return proc.mark_json("playlist")
+
+
+def describe_playlist(report):
+    seconds = report["seconds"]
+    took = f"{seconds:.0f} s" if seconds < 120 else f"{seconds / 60:.1f} min"
+    text = f"{report['played']} tracks in {took}"
+    if report["gaps"]:
+        text += f", {report['gaps']} gaps ({report['gap_seconds']:.1f} s of silence)"
+    else:
+        text += ", no gaps"
+    if report["skipped"]:
+        text += f", {report['skipped']} skipped"
+    if report["restarts"]:
+        text += f", {report['restarts']} modulator restarts"
+    if report.get("stopped"):
+        text += " - stopped"
+    if report.get("error"):
+        text += f" - {report['error']}"
+    return text
@@ -0,0 +1,271 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+PRESETS_FILE = "rpitx_presets.json"
+
+# Presets saved before the store existed only had chirp settings
+LEGACY_KEYS = {"chirp_bandwidth": ("chirp", "bandwidth"), "chirp_speed": ("chirp", "speed")}
+
+
+def normalize_preset(preset):
+    """Return a preset in the current layout.
+
+    A preset is {"name", "frequency" (MHz), "mode" (default mode or None),
+    "params": {mode: prepare() keyword arguments}, "options": GUI audio
+    toggles, "updated"}. Old presets with chirp_bandwidth/chirp_speed keys
+    are converted.
+    """
+    name = str(preset.get("name", "")).strip()
+    if not name:
+        raise ValueError("Preset needs a name")
+    try:
+        frequency = float(preset["frequency"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Preset '{name}' has no valid frequency")
+    params = {mode: dict(values) for mode, values in (preset.get("params") or {}).items()}
+    for key, (mode, param) in LEGACY_KEYS.items():
+        if preset.get(key) is not None:
+            params.setdefault(mode, {}).setdefault(param, preset[key])
+    return {
+        "name": name,
+        "frequency": frequency,
+        "mode": preset.get("mode"),
+        "params": params,
+        "options": dict(preset.get("options") or {}),
+        "updated": preset.get("updated") or time.time(),
+    }
+
+
+def preset_params(preset, mode):
+    """prepare() keyword arguments a preset holds for `mode`"""
+    return dict(preset.get("params", {}).get(mode) or {})
+
+
+class PresetStore:
+    """Presets keyed by name, persisted as a snapshot plus an append-only journal.
+
+    Each change is appended to `<path>.log` as one JSON line, so saving a
+    preset costs one small write however large the library is, and a
+    crash loses at most the line being written (a torn last line is
+    skipped on load). The snapshot itself is rewritten, atomically via a
+    temp file and rename, only once changes have settled for
+    `compact_delay` seconds, or on close().
+    """
+
+    def __init__(self, path=PRESETS_FILE, compact_delay=2.0, max_journal=1000):
+        self.path = path
+        self.journal_path = path + ".log"
+        self.compact_delay = compact_delay
+        self.max_journal = max_journal
+        self._presets = {}
+        # Lower-case names kept sorted for prefix search
+        self._keys = []
+        self._journal = None
+        self._journal_lines = 0
+        self._timer = None
+        self._lock = threading.RLock()
+        self._load()
+
+    def __len__(self):
+        return len(self._presets)
+
+    def __contains__(self, name):
+        return name in self._presets
+
+    def get(self, name):
+        preset = self._presets.get(name)
+        return json.loads(json.dumps(preset)) if preset is not None else None
+
+    def names(self, limit=None):
+        """Preset names in alphabetical order"""
+        with self._lock:
+            keys = self._keys[:limit] if limit else list(self._keys)
+            return [name for _, name in keys]
+
+    def put(self, preset):
+        return self.put_many([preset])[0]
+
+    def put_many(self, presets):
+        """Add or replace presets (one journal write for all of them)"""
+        presets = [normalize_preset(p) for p in presets]
+        with self._lock:
+            for preset in presets:
+                self._set(preset)
+            self._append([{"op": "put", "preset": p} for p in presets])
+        return presets
+
+    def delete(self, name):
+        with self._lock:
+            if name not in self._presets:
+                return False
+            self._remove(name)
+            self._append([{"op": "delete", "name": name}])
+        return True
+
+    def import_legacy(self, presets):
+        """Add presets from the old settings list, never overwriting newer ones. Returns the count added"""
+        new = []
+        for preset in presets:
+            try:
+                preset = normalize_preset(preset)
+            except ValueError as e:
+                print(f"Skipping preset: {e}")
+                continue
+            if preset["name"] not in self._presets:
+                new.append(preset)
+        if new:
+            self.put_many(new)
+        return len(new)
+
+    def search(self, query, limit=100):
+        """Names matching `query`: prefix matches first, then substring, then fuzzy (letters in order)"""
+        query = query.strip().lower()
+        if not query:
+            return self.names(limit)
+        with self._lock:
+            # Prefix matches are a contiguous run of the sorted keys
+            start = bisect.bisect_left(self._keys, (query, ""))
+            results = []
+            for key, name in self._keys[start:start + limit]:
+                if not key.startswith(query):
+                    break
+                results.append(name)
+            if len(results) >= limit:
+                return results
+            seen = set(results)
+            contains, fuzzy = [], []
+            for key, name in self._keys:
+                if name in seen:
+                    continue
+                position = key.find(query)
+                if position >= 0:
+                    contains.append((position, key, name))
+                elif len(fuzzy) < limit and _subsequence(query, key):
+                    fuzzy.append(name)
+            contains.sort()
+            results += [name for _, _, name in contains]
+            return (results + fuzzy)[:limit]
+
+    def flush(self):
+        """Write the snapshot now and empty the journal"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._journal_lines == 0:
+                return
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(sorted(self._presets.values(), key=lambda p: p["name"].lower()), f,
+                              separators=(",", ":"))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                # Only now is it safe to drop the journal; replaying it again would be harmless anyway
+                self._close_journal()
+                with open(self.journal_path, "w"):
+                    pass
+                self._journal_lines = 0
+            except OSError as e:
+                print(f"Could not save presets: {e}")
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._close_journal()
+
+    def _set(self, preset):
+        name = preset["name"]
+        if name not in self._presets:
+            bisect.insort(self._keys, (name.lower(), name))
+        self._presets[name] = preset
+
+    def _remove(self, name):
+        del self._presets[name]
+        i = bisect.bisect_left(self._keys, (name.lower(), name))
+        if i < len(self._keys) and self._keys[i][1] == name:
+            del self._keys[i]
+
+    def _append(self, records):
+        try:
+            if self._journal is None:
+                self._journal = open(self.journal_path, "a")
+            self._journal.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal_lines += len(records)
+        except OSError as e:
+            print(f"Could not save presets: {e}")
+        if self._journal_lines >= self.max_journal:
+            self.flush()
+        else:
+            self._schedule_compaction()
+
+    def _schedule_compaction(self):
+        # Debounce: a burst of edits ends in a single snapshot rewrite
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.compact_delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                for preset in json.load(f):
+                    self._set(normalize_preset(preset))
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            print(f"Could not read presets from {self.path}: {e}")
+
+        intact, torn = 0, False
+        try:
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash; everything before it is intact
+                        torn = True
+                        break
+                    if record.get("op") == "put":
+                        self._set(normalize_preset(record["preset"]))
+                    elif record.get("op") == "delete" and record.get("name") in self._presets:
+                        self._remove(record["name"])
+                    self._journal_lines += 1
+                    if not line.endswith(b"\n"):
+                        # Complete but unterminated; the next append would run into it
+                        torn = True
+                        break
+                    intact += len(line)
+        except FileNotFoundError:
+            pass
+        if torn:
+            # Cut it off, or new records appended after it would be lost on the next load
+            try:
+                os.truncate(self.journal_path, intact)
+            except OSError as e:
+                print(f"Could not repair {self.journal_path}: {e}")
+        if self._journal_lines:
+            # Fold what was replayed into the snapshot
+            self.flush()
+
+
+def _subsequence(query, text):
+    """True if the letters of query appear in text in order"""
+    position = 0
+    for char in query:
+        position = text.find(char, position) + 1
+        if position == 0:
+            return False
+    return True
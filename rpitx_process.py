@@ -0,0 +1,455 @@
+import collections
+import itertools
+import json
+import select
+import socket
+import threading
+import time
+
+from rpitx_metrics import METRICS
+from rpitx_stream import ChannelStreamer
+from rpitx_supervisor import ADOPT_TAIL_BYTES
+
+STARTING = "starting"
+TRANSMITTING = "transmitting"
+STOPPING = "stopping"
+IDLE = "idle"
+FAILED = "failed"
+
+ACTIVE_STATES = (STARTING, TRANSMITTING, STOPPING)
+
+# Longest stderr line kept while waiting for its newline
+MAX_MARK_LINE = 1024 * 1024
+# Seconds between attempts to pick a detached job back up after the link dropped
+REATTACH_INTERVAL = 1.0
+
+
+class TrackedProcess:
+    """One remote command launched on its own session channel"""
+
+    def __init__(self, pid, command, label=None, tail_bytes=4096):
+        self.pid = pid
+        self.command = command
+        self.label = label or command
+        self.state = STARTING
+        self.exit_code = None
+        self.error = None
+        self.started_at = time.time()
+        self.ended_at = None
+        self.channel = None
+        self.streamer = None
+        self.stop_requested = False
+        # RemoteJob when it runs detached on the Pi (rpitx_supervisor); it outlives the channel
+        self.job = None
+        # Set while the link to a detached job is down
+        self.lost_link = False
+        self.detached_at = None
+        self.last_reattach = 0.0
+        self.reattaching = False
+        # Bytes seen per stream, i.e. where a new follower has to pick up
+        self.received = {"stdout": 0, "stderr": 0}
+        self._tail_bytes = tail_bytes
+        self._stderr_tail = bytearray()
+        self._partial = b""
+        # "@rpitx <name> <values...>" lines from scheduled-command wrappers
+        self.marks = {}
+        # The same lines' values unsplit, for markers carrying JSON with spaces in it
+        self.mark_text = {}
+
+    @property
+    def active(self):
+        return self.state in ACTIVE_STATES
+
+    @property
+    def duration(self):
+        return (self.ended_at or time.time()) - self.started_at
+
+    def add_stderr(self, data):
+        self._stderr_tail += data
+        if len(self._stderr_tail) > self._tail_bytes:
+            del self._stderr_tail[:len(self._stderr_tail) - self._tail_bytes]
+        lines = (self._partial + data).split(b"\n")
+        # Long enough for a message engine's final report, still bounded if a tool never ends a line
+        self._partial = lines.pop()[-MAX_MARK_LINE:]
+        for line in lines:
+            if line.startswith(b"@rpitx "):
+                fields = line.decode(errors="replace").split(None, 2)
+                if len(fields) > 1:
+                    rest = fields[2].strip() if len(fields) > 2 else ""
+                    self.marks[fields[1]] = rest.split()
+                    self.mark_text[fields[1]] = rest
+
+    def mark_time(self, name):
+        """Pi-side timestamp of a marker, or None"""
+        values = self.marks.get(name)
+        try:
+            return float(values[0]) if values else None
+        except ValueError:
+            return None
+
+    def mark_json(self, name):
+        """A marker whose value is one JSON document (engine reports), or None"""
+        text = self.mark_text.get(name)
+        try:
+            return json.loads(text) if text else None
+        except ValueError:
+            return None
+
+    def stderr_tail(self):
+        return self._stderr_tail.decode(errors="replace")
+
+    def describe(self):
+        text = f"{self.label}: {self.state}"
+        if self.exit_code is not None:
+            text += f" (exit code {self.exit_code})"
+        if self.error:
+            text += f" - {self.error}"
+        if self.lost_link:
+            text += " (link lost, still running on the Pi)"
+        return text
+
+
+class ProcessTracker:
+    """Tracks remote transmitter processes from their channel events.
+
+    A single monitor thread select()s on every tracked channel at once, so
+    exits are noticed as soon as the Pi reports them and no thread is spent
+    per process. Each process moves through starting -> transmitting ->
+    (stopping ->) idle/failed, and `on_change(process)` fires on every
+    transition (from the monitor thread; marshal it to the UI yourself).
+    Output is drained as it arrives, so it never piles up in paramiko's
+    buffers; `on_output(process, stream, data)` receives every chunk.
+
+    A detached job (one with a RemoteJob) only loses its follower when the
+    channel drops: it stays active with `lost_link` set and is picked up
+    again through `opener` once the session is back. `exec_command` is used
+    to kill detached jobs, which closing the channel no longer does.
+    """
+
+    def __init__(self, session, on_change=None, history=50, tail_bytes=4096, on_output=None):
+        self.session = session
+        self.on_change = on_change
+        self.on_output = on_output
+        self.tail_bytes = tail_bytes
+        self.history = collections.deque(maxlen=history)
+        self._procs = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._monitor = None
+        self.opener = None
+        self.exec_command = session.exec_command
+
+    def launch(self, command, label=None, stdin_chunks=None, deferred=False, opener=None, job=None):
+        """Start `command` on a new channel and track it (blocking; call off the UI thread).
+
+        A `deferred` command waits on the Pi before keying up; it stays in
+        the starting state until its "@rpitx start" marker arrives.
+        `opener(command)`, if given, starts the command and returns a
+        channel-like object instead (e.g. a job run by the remote agent).
+        `job` is the RemoteJob `command` starts, for jobs run detached.
+        """
+        proc = TrackedProcess(next(self._ids), command, label, self.tail_bytes)
+        proc.job = job
+        with self._lock:
+            self._procs.append(proc)
+        self._notify(proc)
+
+        try:
+            with METRICS.timer("launch.exec"):
+                if opener is not None:
+                    channel = opener(command)
+                else:
+                    channel = self.session.open_channel()
+                    channel.exec_command(command)
+        except Exception as e:
+            proc.error = str(e)
+            self._finish(proc, FAILED)
+            raise
+
+        proc.channel = channel
+        if not deferred:
+            self._set_state(proc, TRANSMITTING)
+        self._start_monitor()
+        self._wake()
+
+        if stdin_chunks is not None:
+            # Feeding stdin is the one thing that needs its own thread
+            proc.streamer = ChannelStreamer(channel)
+            threading.Thread(target=self._feed, args=(proc, stdin_chunks), daemon=True).start()
+        return proc
+
+    def adopt(self, job, label=None):
+        """Track a detached job found on the Pi (started by an earlier session; blocking).
+
+        Only the last ADOPT_TAIL_BYTES of its output so far are replayed.
+        """
+        proc = TrackedProcess(next(self._ids), job.command or job.job_dir, label or job.label, self.tail_bytes)
+        proc.job = job
+        if job.started:
+            proc.started_at = job.started
+        proc.received = {stream: max(0, size - ADOPT_TAIL_BYTES) for stream, size in job.sizes.items()}
+        proc.state = TRANSMITTING
+        with self._lock:
+            self._procs.append(proc)
+        proc.lost_link = True
+        self._reattach(proc)
+        if proc.lost_link:
+            # Keeps retrying from the monitor like any other dropped job
+            self._notify(proc)
+        self._start_monitor()
+        self._wake()
+        return proc
+
+    def stop(self, proc=None, kill_jobs=True):
+        """Ask one process (or all of them) to stop; the monitor closes the channels.
+
+        Detached jobs are also killed on the Pi, unless `kill_jobs` is False
+        because something else (the emergency stop) takes care of that.
+        """
+        with self._lock:
+            targets = [proc] if proc is not None else list(self._procs)
+        for p in targets:
+            if not p.active:
+                continue
+            p.stop_requested = True
+            if p.streamer is not None:
+                p.streamer.cancel()
+            if p.job is not None and kill_jobs:
+                threading.Thread(target=self._kill_job, args=(p,), daemon=True).start()
+            self._set_state(p, STOPPING)
+        self._wake()
+
+    def release(self):
+        """Stop following detached jobs without stopping them (the connection is closing for good)"""
+        with self._lock:
+            targets = [p for p in self._procs if p.job is not None]
+        for p in targets:
+            # Keeps _finish from calling it a failure
+            p.stop_requested = True
+            p.error = "left running on the Pi"
+            self._finish(p, IDLE)
+
+    def active(self):
+        with self._lock:
+            return [p for p in self._procs if p.active]
+
+    def latest(self):
+        with self._lock:
+            if self._procs:
+                return self._procs[-1]
+        return self.history[-1] if self.history else None
+
+    def wait(self, proc, timeout=None):
+        """Block until `proc` has finished. Returns False on timeout"""
+        with self._changed:
+            return self._changed.wait_for(lambda: not proc.active, timeout)
+
+    def is_transmitting(self):
+        return any(p.state in (STARTING, TRANSMITTING) for p in self.active())
+
+    def _kill_job(self, proc):
+        try:
+            status, out, err = self.exec_command(proc.job.kill_command())
+            if status != 0:
+                print(f"Could not stop {proc.job.job_dir}: {err.strip()}")  # Debug output
+        except Exception as e:
+            print(f"Could not stop {proc.job.job_dir}: {str(e)}")  # Debug output
+
+    def _detach(self, proc):
+        """The follower of a detached job went away without its exit code: keep the job"""
+        try:
+            proc.channel.close()
+        except Exception:
+            pass
+        proc.channel = None
+        proc.lost_link = True
+        proc.detached_at = time.time()
+        print(f"Lost the link to {proc.label}; it keeps running on the Pi")  # Debug output
+        self._notify(proc)
+        self._wake()
+
+    def _reattach(self, proc):
+        """Start a new follower from where the last one stopped"""
+        proc.last_reattach = time.time()
+        command = proc.job.follow_command(proc.received["stdout"], proc.received["stderr"])
+        try:
+            if self.opener is not None:
+                channel = self.opener(command)
+            else:
+                channel = self.session.open_channel()
+                channel.exec_command(command)
+        except Exception as e:
+            print(f"Reattach to {proc.label} failed: {str(e)}")  # Debug output
+            return
+        finally:
+            proc.reattaching = False
+        if proc.stop_requested or not proc.active:
+            channel.close()
+            return
+        proc.channel = channel
+        proc.lost_link = False
+        if proc.detached_at is not None:
+            # Link drop to following the job again, including the reconnect
+            METRICS.observe("reattach", time.time() - proc.detached_at)
+            proc.detached_at = None
+        print(f"Reattached to {proc.label}")  # Debug output
+        self._notify(proc)
+        self._wake()
+
+    def _feed(self, proc, chunks):
+        try:
+            proc.streamer.run(chunks)
+        except Exception as e:
+            if not proc.stop_requested:
+                proc.error = f"stream error: {e}"
+        self._wake()
+
+    def _start_monitor(self):
+        if self._monitor is not None and self._monitor.is_alive():
+            return
+        self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+        self._monitor.start()
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"x")
+        except OSError:
+            pass
+
+    def _monitor_loop(self):
+        while True:
+            with self._lock:
+                procs = [p for p in self._procs if p.channel is not None]
+                detached = [p for p in self._procs if p.channel is None and p.lost_link]
+
+            for p in detached:
+                if p.stop_requested:
+                    self._finish(p)
+                elif not p.reattaching and time.time() - p.last_reattach >= REATTACH_INTERVAL:
+                    # Opening the channel also wakes the session's reconnect and waits for it
+                    p.reattaching = True
+                    threading.Thread(target=self._reattach, args=(p,), daemon=True).start()
+
+            watched = {}
+            awaiting_status = False
+            for p in procs:
+                channel = p.channel
+                if p.stop_requested and not channel.closed:
+                    channel.close()
+                if channel.closed:
+                    self._drain(p)
+                    self._end(p)
+                elif channel.eof_received:
+                    self._drain(p)
+                    if channel.exit_status_ready():
+                        self._end(p)
+                    else:
+                        # EOF came before exit-status; it follows within a packet or two
+                        awaiting_status = True
+                else:
+                    watched[channel.fileno()] = p
+
+            if awaiting_status:
+                timeout = 0.05
+            elif detached:
+                timeout = REATTACH_INTERVAL / 4
+            else:
+                timeout = None
+            try:
+                readable, _, _ = select.select(list(watched) + [self._wake_r], [], [], timeout)
+            except (OSError, ValueError):
+                # A channel was closed under us; re-evaluate on the next pass
+                continue
+
+            if self._wake_r in readable:
+                try:
+                    while self._wake_r.recv(4096):
+                        pass
+                except (BlockingIOError, OSError):
+                    pass
+            for fd in readable:
+                p = watched.get(fd)
+                if p is not None:
+                    self._drain(p)
+
+    def _drain(self, proc):
+        channel = proc.channel
+        try:
+            while channel.recv_ready():
+                data = channel.recv(32768)
+                if not data:
+                    break
+                proc.received["stdout"] += len(data)
+                self._output(proc, "stdout", data)
+            while channel.recv_stderr_ready():
+                data = channel.recv_stderr(32768)
+                if not data:
+                    break
+                proc.received["stderr"] += len(data)
+                proc.add_stderr(data)
+                self._output(proc, "stderr", data)
+        except Exception:
+            pass
+        if proc.state == STARTING and "start" in proc.marks:
+            self._set_state(proc, TRANSMITTING)
+
+    def _output(self, proc, stream, data):
+        if self.on_output is not None:
+            try:
+                self.on_output(proc, stream, data)
+            except Exception as e:
+                print(f"Output callback error: {str(e)}")
+
+    def _end(self, proc):
+        channel = proc.channel
+        # A channel closed without an exit-status still reports ready, with -1
+        lost = not (channel.exit_status_ready() and channel.exit_status != -1)
+        if proc.job is not None and lost and not proc.stop_requested:
+            self._detach(proc)
+        else:
+            self._finish(proc)
+
+    def _finish(self, proc, state=None):
+        with self._lock:
+            if proc not in self._procs:
+                return
+            self._procs.remove(proc)
+        channel = proc.channel
+        if channel is not None:
+            # A channel closed without an exit-status still reports ready, with -1
+            if channel.exit_status_ready() and channel.exit_status != -1:
+                proc.exit_code = channel.exit_status
+            try:
+                channel.close()
+            except Exception:
+                pass
+
+        if state is None:
+            if proc.stop_requested or proc.exit_code == 0:
+                state = IDLE
+            else:
+                state = FAILED
+                if proc.exit_code is None and not proc.error:
+                    proc.error = "connection lost"
+        proc.lost_link = False
+        proc.ended_at = time.time()
+        self.history.append(proc)
+        self._set_state(proc, state)
+
+    def _set_state(self, proc, state):
+        if proc.state == state:
+            return
+        proc.state = state
+        self._notify(proc)
+
+    def _notify(self, proc):
+        with self._changed:
+            self._changed.notify_all()
+        if self.on_change is not None:
+            try:
+                self.on_change(proc)
+            except Exception as e:
+                print(f"Process callback error: {str(e)}")
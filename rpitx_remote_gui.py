@@ -1,12 +1,35 @@
+# Imported first so the startup report can time every import below
+from rpitx_startup import STARTUP
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
-import paramiko
+import argparse
 import json
 from pathlib import Path
 import os
 import atexit
-import threading
-import time
+import copy
+import datetime
+import functools
+
+from rpitx_controller import TransmitterController, TransmitterError, DEFAULT_SETTINGS, SETTINGS_FILE
+from rpitx_fleet import FleetController
+from rpitx_jobs import JobQueue, JobScheduler, describe_job
+from rpitx_sweep import parse_plan, sweep_report, describe_report
+from rpitx_iq import WAVEFORM_HELP, parse_waveform
+from rpitx_messages import MESSAGE_KINDS, load_messages, messages_report, apply_report, describe_messages
+from rpitx_playlist import now_playing, playlist_report, describe_playlist
+from rpitx_session import SSHSessionManager, SessionError, warm_up
+from rpitx_worker import UIWorker, CancelToken, OperationCancelled
+from rpitx_process import FAILED
+from rpitx_metrics import METRICS, format_table
+from rpitx_cache import TransferMeter
+from rpitx_presets import PresetStore, preset_params
+from rpitx_watchdog import UIWatchdog, HandlerProfiler
+
+MESSAGE_FILETYPES = [("Message files", "*.csv *.jsonl *.ndjson *.json *.txt"), ("All files", "*")]
+PLAYLIST_FILETYPES = [("Playlists", "*.m3u *.m3u8 *.txt"), ("All files", "*")]
+# Spectrum and SSTV pictures are converted locally, so any format Pillow reads will do
+IMAGE_FILETYPES = [("Images", "*.jpg *.jpeg *.png *.bmp *.gif *.tif *.tiff"), ("JPEG files", "*.jpg")]
 
 class RpitxRemoteGUI:
     def __init__(self, root):
@@ -14,38 +37,120 @@ class RpitxRemoteGUI:
         self.root.title("Khanfar TX v2")
         
         # Default settings
-        self.settings = {
-            "host": "192.168.0.197",
-            "port": 22,
-            "username": "mwk",
-            "password": "",
-            "rpitx_path": "/home/mwk/rpitx",
-            "frequency": 434.0,
-            "chirp_bandwidth": 60000,
-            "chirp_speed": 10,
-            "saved_presets": []
-        }
+        self.settings = copy.deepcopy(DEFAULT_SETTINGS)
         
         self.load_settings()
+        STARTUP.mark("settings")
+        # Last parameters each mode ran with, saved along with a preset
+        self.mode_params = {}
+        self._preset_filter_job = None
+        self.job_queue = JobQueue()
+        # Stall reports and profiles name the handler, so wrap them before any button is made
+        self.watchdog = UIWatchdog(self.root, interval=self.settings["ui_heartbeat_ms"],
+                                   threshold=self.settings["ui_stall_ms"],
+                                   log_file=self.settings["ui_stall_log"])
+        self.profiler = HandlerProfiler(self.settings["profile_dir"])
+        # Until the deferred setup has run, clicks are held and replayed once it has
+        self.ready = False
+        self._early_calls = []
+        self.instrument_handlers()
         self.setup_gui()
-        self.ssh = None
-        self.current_process = None
-        self.is_transmitting = False
+        self.worker = UIWorker(self.root)
+        self.worker.wrap = self.profiler.wrap
+        
+        # All transmit logic lives in the controller; this class only drives it
+        self.controller = TransmitterController(
+            self.settings,
+            on_process_change=lambda proc: self.worker.call_in_ui(self.on_process_change, proc)
+        )
+        self.controller.emergency_stop.latency.on_over_budget = self.on_stop_over_budget
+        # Optional rack of Pis driven all at once (see rpitx_fleet.py)
+        self.fleet = None
+        # Set when quitting with detached jobs left on air
+        self.leave_running = False
+        STARTUP.mark("ui")
+        
+        # Paint the connection and mode controls now; everything else is added once they're on screen,
+        # a step at a time from the event loop so the window keeps responding in between
+        self.root.update()
+        STARTUP.mark("window")
+        self.root.after(0, self.setup_deferred)
         
         # Register cleanup on exit
         atexit.register(self.cleanup)
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
+    def setup_deferred(self):
+        """The parts of startup the first paint doesn't need"""
+        # Import the SSH libraries in the background, ready for the first connect
+        self.ssh_warm_up = warm_up()
+        self.presets = PresetStore(self.settings["presets_file"])
+        if self.settings["saved_presets"]:
+            # Presets used to live in the settings file; move them into the store once
+            self.presets.import_legacy(self.settings["saved_presets"])
+            self.settings["saved_presets"] = []
+            self.save_settings()
+        self.update_preset_list()
+        # Runs queued jobs back to back (see rpitx_jobs.py)
+        self.scheduler = JobScheduler(
+            self.controller, self.job_queue,
+            on_event=lambda kind, job, detail: self.worker.call_in_ui(self.on_job_event, kind, job, detail),
+            presets=self.presets
+        )
+        STARTUP.mark("presets")
+        self.root.after(0, self.setup_deferred_panels)
+        
+    def setup_deferred_panels(self):
+        """Second deferred step: the job, sweep and fleet panels, then replay anything clicked meanwhile"""
+        self.setup_panels()
+        self.refresh_job_list()
+        self.root.after(250, self.update_log)
+        if self.settings["ui_watchdog"]:
+            self.watchdog.start()
+        if self.settings["metrics_port"]:
+            try:
+                METRICS.serve(self.settings["metrics_port"])
+            except OSError as e:
+                print(f"Could not start metrics endpoint: {str(e)}")
+        STARTUP.mark("panels")
+        self.ready = True
+        early, self._early_calls = self._early_calls, []
+        for fn, args, kwargs in early:
+            fn(*args, **kwargs)
+        
+    def instrument_handlers(self):
+        """Route the mode buttons and SSH/stop handlers through the watchdog and profiler"""
+        names = [name for name in dir(self) if name.startswith("run_") and name not in ("run_mode", "run_fleet_mode")]
+        names += ["connect_ssh", "stop_transmission", "force_stop_transmission", "force_kill_all", "cancel_pending"]
+        for name in names:
+            setattr(self, name, self.profiler.wrap(name, self.watchdog.wrap(name, getattr(self, name))))
+        # Everything reachable before the deferred setup is done (presets, scheduler, panels)
+        names += ["save_current_settings", "load_preset", "delete_preset", "on_preset_typed", "on_closing"]
+        for name in names:
+            setattr(self, name, self.until_ready(getattr(self, name)))
+
+    def until_ready(self, fn):
+        """fn, held back and called once startup has finished if it's called before then"""
+        @functools.wraps(fn)
+        def handler(*args, **kwargs):
+            if self.ready:
+                return fn(*args, **kwargs)
+            self._early_calls.append((fn, args, kwargs))
+        return handler
+
     def load_settings(self):
         try:
-            with open('rpitx_settings.json', 'r') as f:
+            with open(SETTINGS_FILE, 'r') as f:
                 self.settings.update(json.load(f))
         except FileNotFoundError:
             self.save_settings()
             
     def save_settings(self):
-        with open('rpitx_settings.json', 'w') as f:
+        # Write a temp file and rename it over the old one, so a crash can't leave half a file
+        tmp_path = SETTINGS_FILE + ".tmp"
+        with open(tmp_path, 'w') as f:
             json.dump(self.settings, f, indent=4)
+        os.replace(tmp_path, SETTINGS_FILE)
             
     def setup_gui(self):
         # Connection Frame
@@ -137,7 +242,8 @@ class RpitxRemoteGUI:
         self.preset_var = tk.StringVar()
         self.preset_combo = ttk.Combobox(preset_frame, textvariable=self.preset_var)
         self.preset_combo.grid(row=0, column=1, padx=5)
-        self.update_preset_list()
+        # Typing filters the list; with thousands of presets only the best matches are shown
+        self.preset_combo.bind("<KeyRelease>", self.on_preset_typed)
         
         ttk.Button(preset_frame, text="Load", 
                   command=self.load_preset).grid(row=0, column=2, padx=5)
@@ -160,12 +266,36 @@ class RpitxRemoteGUI:
             ("SSTV - Slow Scan TV", self.run_sstv),
             ("POCSAG - Pager", self.run_pocsag),
             ("Opera - Morse", self.run_opera),
-            ("RTTY - Teletype", self.run_rtty)
+            ("RTTY - Teletype", self.run_rtty),
+            ("Sweep - Frequency Hopping", self.run_sweep),
+            ("IQ - Synthesized Waveform", self.run_iq),
+            ("Messages - Pager/RTTY/Opera File", self.run_messages),
+            ("Playlist - FM RDS Station", self.run_playlist)
         ]
         
         for i, (text, command) in enumerate(modes):
             btn = ttk.Button(modes_frame, text=text, command=command)
             btn.grid(row=i//2, column=i%2, padx=5, pady=2, sticky="ew")
+        
+        options_row = (len(modes) + 1) // 2
+        
+        # Stream audio modes straight into the modulator instead of uploading first
+        self.stream_var = tk.BooleanVar(value=self.settings["stream_audio"])
+        ttk.Checkbutton(modes_frame, text="Stream audio (no upload)", variable=self.stream_var,
+                        command=self.save_audio_options).grid(row=options_row, column=0, pady=(5, 0), sticky="w")
+        
+        # Convert audio locally to what each mode needs before it goes over the link
+        self.preprocess_var = tk.BooleanVar(value=self.settings["preprocess_audio"])
+        ttk.Checkbutton(modes_frame, text="Preprocess audio", variable=self.preprocess_var,
+                        command=self.save_audio_options).grid(row=options_row, column=1, pady=(5, 0), sticky="w")
+        self.compress_var = tk.BooleanVar(value=self.settings["compress_transfer"])
+        ttk.Checkbutton(modes_frame, text="Compress transfer", variable=self.compress_var,
+                        command=self.save_audio_options).grid(row=options_row + 1, column=1, sticky="w")
+        
+        # Crop/scale pictures to the exact size Spectrum and SSTV send, so the Pi never decodes a photo
+        self.images_var = tk.BooleanVar(value=self.settings["preprocess_images"])
+        ttk.Checkbutton(modes_frame, text="Preprocess images", variable=self.images_var,
+                        command=self.save_audio_options).grid(row=options_row + 1, column=0, sticky="w")
             
         # Control Buttons Frame
         control_frame = ttk.Frame(self.root)
@@ -177,233 +307,613 @@ class RpitxRemoteGUI:
         self.force_stop_btn = ttk.Button(control_frame, text="Force Kill All", command=self.force_kill_all)
         self.force_stop_btn.grid(row=0, column=1, padx=5)
         
+        self.cancel_btn = ttk.Button(control_frame, text="Cancel Pending", command=self.cancel_pending)
+        self.cancel_btn.grid(row=0, column=2, padx=5)
+        
+        ttk.Button(control_frame, text="Latency Metrics...", command=self.show_metrics).grid(row=2, column=0, columnspan=3)
+        self.metrics_window = None
+        self.preview_window = None
+        
         # Status Label
         self.status_label = ttk.Label(control_frame, text="Status: Idle")
-        self.status_label.grid(row=1, column=0, columnspan=2, pady=5)
+        self.status_label.grid(row=1, column=0, columnspan=3, pady=5)
+        
+        # Upload progress (file modes)
+        self.upload_bar = ttk.Progressbar(control_frame, length=300, maximum=1.0)
+        self.upload_bar.grid(row=3, column=0, columnspan=3, pady=(5, 0))
+        self.upload_label = ttk.Label(control_frame, text="")
+        self.upload_label.grid(row=4, column=0, columnspan=3)
         
         # Update status periodically
         self.root.after(1000, self.update_status)
 
+    def setup_panels(self):
+        # Fleet Frame
+        fleet_frame = ttk.LabelFrame(self.root, text="Fleet", padding=10)
+        fleet_frame.grid(row=3, column=1, padx=10, pady=5, sticky="nsew")
+        
+        ttk.Button(fleet_frame, text="Load Inventory...", command=self.load_fleet).grid(row=0, column=0, padx=5)
+        self.fleet_label = ttk.Label(fleet_frame, text="No fleet loaded")
+        self.fleet_label.grid(row=0, column=1, columnspan=2, padx=5, sticky="w")
+        
+        self.fleet_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(fleet_frame, text="Send modes to whole fleet",
+                        variable=self.fleet_var).grid(row=1, column=0, columnspan=3, pady=(5, 0), sticky="w")
+        
+        ttk.Label(fleet_frame, text="Start delay (s):").grid(row=2, column=0, sticky="w")
+        self.start_delay_spinbox = ttk.Spinbox(fleet_frame, from_=0, to=60, increment=0.5, width=6)
+        self.start_delay_spinbox.set(self.settings["fleet_start_delay"])
+        self.start_delay_spinbox.grid(row=2, column=1, padx=5, sticky="w")
+        
+        ttk.Button(fleet_frame, text="Stop All Hosts", command=self.stop_fleet).grid(row=3, column=0, columnspan=3, pady=5)
+        
+        # Job Queue Frame
+        queue_frame = ttk.LabelFrame(self.root, text="Job Queue", padding=10)
+        queue_frame.grid(row=4, column=0, columnspan=2, padx=10, pady=5, sticky="ew")
+        
+        self.queue_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(queue_frame, text="Add modes to queue instead of transmitting",
+                        variable=self.queue_var).grid(row=0, column=0, columnspan=6, sticky="w")
+        
+        ttk.Label(queue_frame, text="Duration (s):").grid(row=1, column=0, sticky="w")
+        self.job_duration_entry = ttk.Entry(queue_frame, width=8)
+        self.job_duration_entry.grid(row=1, column=1, padx=5)
+        ttk.Label(queue_frame, text="Start at (HH:MM):").grid(row=1, column=2, sticky="w")
+        self.job_start_entry = ttk.Entry(queue_frame, width=8)
+        self.job_start_entry.grid(row=1, column=3, padx=5)
+        ttk.Label(queue_frame, text="Repeat every (min):").grid(row=1, column=4, sticky="w")
+        self.job_repeat_entry = ttk.Entry(queue_frame, width=8)
+        self.job_repeat_entry.grid(row=1, column=5, padx=5)
+        
+        self.job_listbox = tk.Listbox(queue_frame, height=5, width=80)
+        self.job_listbox.grid(row=2, column=0, columnspan=6, pady=5, sticky="ew")
+        self.job_ids = []
+        
+        ttk.Button(queue_frame, text="Start Queue", command=self.start_queue).grid(row=3, column=0, columnspan=2, padx=5)
+        ttk.Button(queue_frame, text="Pause Queue", command=self.pause_queue).grid(row=3, column=2, columnspan=2, padx=5)
+        ttk.Button(queue_frame, text="Remove Job", command=self.remove_job).grid(row=3, column=4, columnspan=2, padx=5)
+        
+        self.queue_label = ttk.Label(queue_frame, text="Queue: paused")
+        self.queue_label.grid(row=4, column=0, columnspan=6, pady=(5, 0), sticky="w")
+        
+        # Remote Output Frame
+        log_frame = ttk.LabelFrame(self.root, text="Remote Output", padding=10)
+        log_frame.grid(row=5, column=0, columnspan=2, padx=10, pady=5, sticky="nsew")
+        
+        self.log_text = tk.Text(log_frame, height=10, width=100, state="disabled", wrap="none")
+        self.log_text.grid(row=0, column=0, columnspan=3, sticky="nsew")
+        self.log_text.tag_config("stderr", foreground="red")
+        self.log_text.tag_config("event", foreground="blue")
+        log_scroll = ttk.Scrollbar(log_frame, orient="vertical", command=self.log_text.yview)
+        log_scroll.grid(row=0, column=3, sticky="ns")
+        self.log_text.config(yscrollcommand=log_scroll.set)
+        
+        self.autoscroll_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(log_frame, text="Auto-scroll", variable=self.autoscroll_var).grid(row=1, column=0, sticky="w")
+        ttk.Button(log_frame, text="Clear", command=self.clear_log).grid(row=1, column=1, pady=(5, 0))
+        self.log_seq = 0
+
     def reset_path(self):
         default_path = f"/home/{self.user_entry.get()}/rpitx"
         self.path_entry.delete(0, tk.END)
         self.path_entry.insert(0, default_path)
         
-    def connect_ssh(self):
-        try:
-            self.ssh = paramiko.SSHClient()
-            self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            self.ssh.connect(
-                self.host_entry.get(),
-                username=self.user_entry.get(),
-                password=self.pass_entry.get()
-            )
-            messagebox.showinfo("Success", "Connected to Raspberry Pi")
-            
-            # Save settings
-            self.settings.update({
-                "host": self.host_entry.get(),
-                "username": self.user_entry.get(),
-                "password": self.pass_entry.get(),
-                "rpitx_path": self.path_entry.get()
-            })
+    def connect_ssh(self, on_connected=None):
+        """Connect in the background, reusing the live transport if the target is unchanged"""
+        host = self.host_entry.get()
+        username = self.user_entry.get()
+        password = self.pass_entry.get()
+        rpitx_path = self.path_entry.get()
+        
+        def connect():
+            self.controller.connect(host, username, password, rpitx_path=rpitx_path)
+            if on_connected:
+                return []
+            try:
+                # Jobs left running on the Pi by an earlier session
+                return self.controller.adopt_jobs()
+            except Exception as e:
+                print(f"Could not look for running jobs: {str(e)}")
+                return []
+
+        def connected(adopted):
+            self.connect_btn.config(state="normal")
             self.save_settings()
             
-        except Exception as e:
+            if on_connected:
+                on_connected()
+            elif adopted:
+                messagebox.showinfo(
+                    "Success",
+                    "Connected to Raspberry Pi\n\nStill running on the Pi (use Stop to end them):\n"
+                    + "\n".join(proc.label for proc in adopted)
+                )
+            else:
+                messagebox.showinfo("Success", "Connected to Raspberry Pi")
+            
+        def failed(e):
+            self.connect_btn.config(state="normal")
             messagebox.showerror("Connection Error", str(e))
-            self.ssh = None
             
-    def update_status(self):
-        """Update status label periodically"""
-        if self.is_transmitting:
-            self.status_label.config(text="Status: Transmitting")
+        self.connect_btn.config(state="disabled")
+        self.worker.submit(connect, on_success=connected, on_error=failed, name="connect_ssh")
+            
+    def on_process_change(self, proc):
+        """Called on the UI thread whenever a tracked process changes state"""
+        print(f"Process {proc.describe()}")  # Debug output
+        self.refresh_status()
+        report = sweep_report(proc)
+        if report and not proc.active:
+            messagebox.showinfo("Sweep Finished", describe_report(report))
+        report = playlist_report(proc)
+        if report and not proc.active:
+            messagebox.showinfo("Playlist Finished", describe_playlist(report))
+        report = messages_report(proc)
+        if report and not proc.active:
+            self.show_messages_report(report)
+        elif proc.state == FAILED:
+            details = proc.stderr_tail().strip()
+            messagebox.showwarning(
+                "Transmission Ended",
+                proc.describe() + (f"\n\n{details[-500:]}" if details else "")
+            )
+
+    def show_messages_report(self, report):
+        """Summary of a finished message batch, with the records that didn't go out"""
+        params = self.mode_params.get("messages", {})
+        try:
+            records = apply_report(load_messages(params["file_path"], params["kind"]), report)
+        except (KeyError, OSError, ValueError):
+            records = []
+        problems = [r for r in records if r.status != "sent"]
+        text = describe_messages(report, records)
+        if problems:
+            text += "\n\n" + "\n".join(f"Line {r.line}: {r.status}" for r in problems[:15])
+            if len(problems) > 15:
+                text += f"\n... and {len(problems) - 15} more"
+        print(f"Messages: {describe_messages(report, records)}")  # Debug output
+        if problems or report.get("error"):
+            messagebox.showwarning("Messages Finished", text)
         else:
-            self.status_label.config(text="Status: Idle")
+            messagebox.showinfo("Messages Finished", text)
+
+    def update_status(self):
+        """Update status label periodically (connection and background work)"""
+        self.refresh_status()
         self.root.after(1000, self.update_status)
 
-    def execute_command(self, command):
-        if not self.ssh:
-            messagebox.showerror("Error", "Not connected to Raspberry Pi")
+    def update_log(self):
+        """Append new remote output in one batch every 250 ms"""
+        self.log_seq, entries, dropped = self.controller.log.since(self.log_seq)
+        if entries or dropped:
+            chunks = []
+            if dropped:
+                chunks += [f"... {dropped} lines skipped ...\n", "event"]
+            for entry in entries:
+                chunks += [self.controller.log.format(entry) + "\n", entry[2]]
+            self.log_text.config(state="normal")
+            # One insert call for the whole batch, then trim to the buffer size
+            self.log_text.insert(tk.END, *chunks)
+            # The line after the final newline is empty, so it doesn't count
+            excess = int(self.log_text.index("end-1c").split(".")[0]) - 1 - self.settings["log_lines"]
+            if excess > 0:
+                self.log_text.delete("1.0", f"{excess + 1}.0")
+            self.log_text.config(state="disabled")
+            if self.autoscroll_var.get():
+                self.log_text.see(tk.END)
+        self.root.after(250, self.update_log)
+
+    def clear_log(self):
+        self.controller.log.clear()
+        self.log_text.config(state="normal")
+        self.log_text.delete("1.0", tk.END)
+        self.log_text.config(state="disabled")
+
+    def show_metrics(self):
+        """Debug panel with p50/p95/p99 of every timed phase, refreshed every second"""
+        if self.metrics_window is not None:
+            self.metrics_window.lift()
+            return
+        self.metrics_window = tk.Toplevel(self.root)
+        self.metrics_window.title("Latency Metrics")
+        self.metrics_window.protocol("WM_DELETE_WINDOW", self.close_metrics)
+        
+        self.metrics_text = tk.Text(self.metrics_window, height=30, width=90, state="disabled",
+                                    wrap="none", font=("Courier", 9))
+        self.metrics_text.grid(row=0, column=0, columnspan=2, padx=5, pady=5)
+        ttk.Button(self.metrics_window, text="Export JSON...", command=self.export_metrics).grid(row=1, column=0, pady=5)
+        ttk.Button(self.metrics_window, text="Reset", command=METRICS.reset).grid(row=1, column=1, pady=5)
+        self.profile_var = tk.BooleanVar(value=self.profiler.enabled)
+        ttk.Checkbutton(self.metrics_window, text=f"Profile handlers and SSH operations (reports in {self.profiler.directory}/)",
+                        variable=self.profile_var, command=self.toggle_profiler).grid(row=2, column=0, columnspan=2, pady=5)
+        self.update_metrics()
+
+    def toggle_profiler(self):
+        self.profiler.enabled = self.profile_var.get()
+
+    def update_metrics(self):
+        if self.metrics_window is None:
             return
+        snapshot = METRICS.snapshot()
+        text = format_table(snapshot) if snapshot else "Nothing measured yet"
+        self.metrics_text.config(state="normal")
+        self.metrics_text.delete("1.0", tk.END)
+        self.metrics_text.insert(tk.END, text)
+        self.metrics_text.config(state="disabled")
+        self.root.after(1000, self.update_metrics)
+
+    def close_metrics(self):
+        self.metrics_window.destroy()
+        self.metrics_window = None
+
+    def preview_image(self, mode, file_path):
+        """Convert the picture in the background and show what will be sent"""
+        self.worker.submit(self.controller.prepare_image, mode, file_path, on_success=self.show_image_preview,
+                           on_error=lambda e: print(f"No preview: {str(e)}"), name="preview_image")
+
+    def show_image_preview(self, prepared):
+        if self.preview_window is None:
+            self.preview_window = tk.Toplevel(self.root)
+            self.preview_window.title("Image Preview")
+            self.preview_window.protocol("WM_DELETE_WINDOW", self.close_preview)
+            self.preview_label = ttk.Label(self.preview_window, compound="top")
+            self.preview_label.grid(row=0, column=0, padx=5, pady=5)
+        # Tk reads PPM natively; keep a reference or the image is garbage collected
+        self.preview_photo = tk.PhotoImage(file=prepared.preview_path)
+        self.preview_label.config(image=self.preview_photo,
+                                  text=f"{prepared.input_bytes / 1024:.0f} KB -> {prepared.output_bytes / 1024:.0f} KB")
+        self.preview_window.lift()
+
+    def close_preview(self):
+        self.preview_window.destroy()
+        self.preview_window = None
+
+    def export_metrics(self):
+        path = filedialog.asksaveasfilename(defaultextension=".json", initialfile=self.settings["metrics_file"],
+                                            filetypes=[("JSON files", "*.json")])
+        if path:
+            METRICS.save(path)
+
+    def refresh_status(self):
+        active = self.controller.processes.active()
+        if active:
+            status = active[-1].state.capitalize()
+            if len(active) > 1:
+                status += f" ({len(active)} processes)"
+            hop = active[-1].marks.get("hop")
+            if hop:
+                status += f" (hop {int(hop[0]) + 1} @ {int(hop[1]) / 1e6:.4f} MHz)"
+            title = now_playing(active[-1])
+            if title:
+                status += f" (now playing: {title})"
+        else:
+            status = "Idle"
+        if self.controller.session.state == SSHSessionManager.RECONNECTING:
+            status += " (reconnecting...)"
+        if any(p.lost_link for p in active):
+            status += " (link lost, still on air)"
+        if self.fleet is not None:
+            on_air = sum(1 for c in self.fleet.controllers.values() if c.processes.is_transmitting())
+            status += f" | Fleet: {on_air}/{len(self.fleet.controllers)} on air"
+        if self.worker.pending:
+            status += f" | Busy: {', '.join(op.name for op in self.worker.pending)}"
+        last_stop = self.controller.emergency_stop.latency.last
+        if last_stop is not None:
+            status += f" | Last stop: {last_stop * 1000:.0f} ms"
+        # Pushed by the remote agent every few seconds
+        health = self.controller.agent.health if self.controller.agent.available else None
+        if health and health.get("temp_c") is not None:
+            status += f" | Pi {health['temp_c']:.0f}°C"
+        self.status_label.config(text=f"Status: {status}")
+
+    def run_mode(self, mode, **params):
+        """Prepare (upload/convert) and start a transmission mode in the background"""
+        if self.queue_var.get():
+            return self.queue_job(mode, **params)
+        if self.fleet is not None and self.fleet_var.get():
+            return self.run_fleet_mode(mode, **params)
+        if not self.controller.session.is_configured():
+            messagebox.showerror("Error", "Not connected to Raspberry Pi")
+            return None
             
         try:
-            freq_mhz = float(self.freq_entry.get())
-            freq_hz = int(freq_mhz * 1e6)
+            freq_hz = self.controller.freq_to_hz(self.freq_entry.get())
+        except TransmitterError as e:
+            messagebox.showerror("Error", str(e))
+            return None
+        self.mode_params[mode] = dict(params)
             
-            # First verify rpitx directory exists
-            stdin, stdout, stderr = self.ssh.exec_command(f'test -d {self.settings["rpitx_path"]} && echo "EXISTS"')
-            if not stdout.read().decode().strip() == "EXISTS":
-                messagebox.showerror("Error", f"rpitx directory not found at {self.settings['rpitx_path']}")
-                return
-                
-            # Execute the command with full path
-            full_command = f'cd {self.settings["rpitx_path"]} && sudo ./{command.format(freq_hz=freq_hz)}'
-            print(f"Executing: {full_command}")  # Debug output
-            
-            # Run command in background thread
-            def run_command():
-                try:
-                    self.is_transmitting = True
-                    self.current_process = self.ssh.get_transport().open_session()
-                    self.current_process.exec_command(full_command)
-                    # Wait for process to complete
-                    while not self.current_process.exit_status_ready() and self.is_transmitting:
-                        time.sleep(0.1)
-                    self.is_transmitting = False
-                except Exception as e:
-                    print(f"Command error: {str(e)}")
-                    self.is_transmitting = False
-            
-            # Start command in separate thread
-            thread = threading.Thread(target=run_command, daemon=True)
-            thread.start()
+        token = CancelToken()
+        meter = TransferMeter()
+        
+        def progress(sent, total):
+            # Lets the Cancel button abort an upload mid-transfer
+            token.raise_if_cancelled()
+            if meter.update(sent, total):
+                self.worker.call_in_ui(self.show_upload_progress, meter.fraction, f"Upload: {meter.describe()}")
             
-        except ValueError:
-            messagebox.showerror("Error", "Invalid frequency value")
-        except Exception as e:
-            messagebox.showerror("Error", f"Command execution failed: {str(e)}")
-            self.is_transmitting = False
+        def failed(e):
+            if meter.sent < meter.total:
+                # The partial file stays on the Pi; running the mode again resumes it
+                self.show_upload_progress(meter.fraction, "Upload stopped; run again to resume")
+            if isinstance(e, OperationCancelled):
+                print(f"{mode} cancelled")
+            elif isinstance(e, (TransmitterError, SessionError)):
+                messagebox.showerror("Error", str(e))
+            else:
+                messagebox.showerror("Error", f"Command execution failed: {str(e)}")
+                
+        # The tracker reports the launched process through on_process_change
+        return self.worker.submit(
+            self.controller.run, mode, freq_hz, progress=progress, **params,
+            on_error=failed, token=token, name=mode
+        )
+
+    def show_upload_progress(self, fraction, text):
+        self.upload_bar["value"] = fraction
+        self.upload_label.config(text=text)
 
-    def upload_file(self, local_path, remote_filename):
-        """Upload file with proper permissions"""
-        if not self.ssh:
+    def run_fleet_mode(self, mode, **params):
+        """Same as run_mode, but on every host of the loaded fleet"""
+        try:
+            freq_hz = self.controller.freq_to_hz(self.freq_entry.get())
+            start_in = float(self.start_delay_spinbox.get())
+        except TransmitterError as e:
+            messagebox.showerror("Error", str(e))
+            return None
+        except ValueError:
+            messagebox.showerror("Error", "Invalid start delay")
             return None
             
+        self.settings["fleet_start_delay"] = start_in
+        self.save_settings()
+        return self.worker.submit(
+            self.fleet.run, mode, freq_hz, start_in=start_in if start_in > 0 else None, **params,
+            on_success=self.show_fleet_result, name=f"fleet {mode}"
+        )
+
+    def queue_job(self, mode, **params):
+        """Add a mode with its current settings to the job queue"""
         try:
-            # Create temp directory if it doesn't exist
-            temp_dir = f"/home/{self.settings['username']}/rpitx/temp"
-            
-            # Execute commands and wait for them to complete
-            stdin, stdout, stderr = self.ssh.exec_command(f"sudo mkdir -p {temp_dir}")
-            stdout.channel.recv_exit_status()
-            
-            stdin, stdout, stderr = self.ssh.exec_command(f"sudo chown -R {self.settings['username']}:{self.settings['username']} {temp_dir}")
-            stdout.channel.recv_exit_status()
+            frequency = float(self.freq_entry.get())
+            self.controller.freq_to_hz(frequency)
+            duration = self.job_duration_entry.get().strip()
+            repeat = self.job_repeat_entry.get().strip()
+            job = self.job_queue.add(
+                mode, frequency=frequency, params=params,
+                start_at=self.parse_start_time(self.job_start_entry.get().strip()),
+                duration=float(duration) if duration else None,
+                repeat_every=float(repeat) * 60 if repeat else None
+            )
+        except (TransmitterError, ValueError) as e:
+            messagebox.showerror("Error", f"Invalid job settings: {str(e)}")
+            return None
             
-            stdin, stdout, stderr = self.ssh.exec_command(f"sudo chmod -R 755 {temp_dir}")
-            stdout.channel.recv_exit_status()
+        print(f"Queued job {job['id']}: {describe_job(job)}")  # Debug output
+        self.refresh_job_list()
+        self.scheduler.wake()
+        return job
+
+    def parse_start_time(self, text):
+        """'HH:MM' -> epoch time of the next such moment, or None if blank"""
+        if not text:
+            return None
+        at = datetime.datetime.combine(datetime.date.today(), datetime.datetime.strptime(text, "%H:%M").time())
+        if at <= datetime.datetime.now():
+            at += datetime.timedelta(days=1)
+        return at.timestamp()
+
+    def refresh_job_list(self):
+        jobs = self.job_queue.list()
+        self.job_ids = [job["id"] for job in jobs]
+        self.job_listbox.delete(0, tk.END)
+        for job in jobs:
+            self.job_listbox.insert(tk.END, describe_job(job))
             
-            remote_path = f"{temp_dir}/{remote_filename}"
+        text = f"Queue: {'running' if self.scheduler.running else 'paused'}, {len(jobs)} job(s)"
+        gaps = self.scheduler.gap_summary()
+        if gaps:
+            text += (f" | Handover gap: last {gaps['last_ms']:.0f} ms, "
+                     f"avg {gaps['avg_ms']:.0f} ms, max {gaps['max_ms']:.0f} ms")
+        self.queue_label.config(text=text)
+
+    def on_job_event(self, kind, job, detail):
+        self.refresh_job_list()
+        if kind == "failed":
+            messagebox.showwarning("Job Failed", f"{job['name']}: {detail}")
+        elif kind == "error":
+            print(f"Scheduler error: {detail}")
+
+    def start_queue(self):
+        if not self.controller.session.is_configured():
+            messagebox.showerror("Error", "Not connected to Raspberry Pi")
+            return
+        self.scheduler.start()
+        self.refresh_job_list()
+
+    def pause_queue(self):
+        # Cancelling the staged job needs a round trip, so do it in the background
+        self.worker.submit(self.scheduler.pause, on_success=lambda _: self.refresh_job_list(), name="pause_queue")
+
+    def remove_job(self):
+        selection = self.job_listbox.curselection()
+        if not selection:
+            return
+        self.job_queue.remove(self.job_ids[selection[0]])
+        self.refresh_job_list()
+
+    def load_fleet(self):
+        path = filedialog.askopenfilename(
+            initialfile=self.settings["fleet_file"] or None,
+            filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+        )
+        if not path:
+            return
             
-            # Upload file
-            sftp = self.ssh.open_sftp()
-            sftp.put(local_path, remote_path)
-            sftp.close()
+        def open_fleet():
+            fleet = FleetController.from_file(
+                path, copy.deepcopy(self.settings),
+                on_process_change=lambda name, proc: self.worker.call_in_ui(self.on_fleet_process_change, name, proc)
+            )
+            return fleet, fleet.connect_all()
             
-            # Set permissions on uploaded file
-            stdin, stdout, stderr = self.ssh.exec_command(f"sudo chmod 755 {remote_path}")
-            stdout.channel.recv_exit_status()
+        def opened(value):
+            fleet, result = value
+            if self.fleet is not None:
+                old = self.fleet
+                self.worker.submit(old.close, name="close_fleet")
+            self.fleet = fleet
+            self.settings["fleet_file"] = path
+            self.save_settings()
+            connected = len(result.results) - len(result.failed)
+            self.fleet_label.config(text=f"{len(result.results)} hosts ({connected} connected)")
+            if result.failed:
+                messagebox.showwarning("Fleet", result.describe())
+                
+        def failed(e):
+            messagebox.showerror("Fleet Error", f"Could not load fleet: {str(e)}")
             
-            return remote_path
-        except Exception as e:
-            print(f"Upload error: {str(e)}")  # Debug print
-            messagebox.showerror("Upload Error", f"Failed to upload file: {str(e)}")
-            return None
+        self.worker.submit(open_fleet, on_success=opened, on_error=failed, name="load_fleet")
+
+    def on_fleet_process_change(self, name, proc):
+        print(f"Fleet {name}: {proc.describe()}")  # Debug output
+        if proc.state == FAILED:
+            messagebox.showwarning("Transmission Ended", f"{name}: {proc.describe()}")
+
+    def show_fleet_result(self, result):
+        print(result.describe())  # Debug output
+        if result.failed:
+            messagebox.showwarning("Fleet", result.describe())
+
+    def stop_fleet(self):
+        if self.fleet is None:
+            return
+        self.worker.submit(self.fleet.stop_all, on_success=self.show_fleet_result, name="stop_fleet", urgent=True)
+
+    def save_audio_options(self):
+        self.settings.update({
+            "stream_audio": self.stream_var.get(),
+            "preprocess_audio": self.preprocess_var.get(),
+            "compress_transfer": self.compress_var.get(),
+            "preprocess_images": self.images_var.get()
+        })
+        self.save_settings()
 
     def force_stop_transmission(self):
         """Most aggressive way to stop transmission"""
-        if not self.ssh:
+        if not self.controller.session.is_configured():
             return
             
-        try:
-            # Emergency stop sequence
-            emergency_commands = [
-                # First stop DMA operations
-                "sudo killall -9 rpitx pichirp tune",
-                # Force stop all possible processes
-                "sudo pkill -f -9 rpitx",
-                "sudo pkill -f -9 pichirp",
-                "sudo pkill -f -9 tune",
-                # Kill all test scripts
-                "sudo pkill -f -9 'test.*\.sh'",
-                # Reset GPIO and DMA
-                "sudo gpio -g write 4 0",
-                "sudo gpio -g mode 4 in",
-                # Stop any remaining processes
-                "sudo killall -9 rpitx pichirp tune spectrumpaint pifmrds sendiq pocsag piopera freedv pisstv pirtty",
-                # Clean up DMA
-                "sudo rmmod rpitx_mod 2>/dev/null || true",
-                # Final GPIO cleanup
-                "echo 4 > /sys/class/gpio/unexport 2>/dev/null || true",
-                # Reset PWM
-                "sudo killall pi-blaster 2>/dev/null || true"
-            ]
-            
-            for cmd in emergency_commands:
-                try:
-                    stdin, stdout, stderr = self.ssh.exec_command(cmd)
-                    stdout.channel.recv_exit_status()
-                except:
-                    continue
-                    
-            time.sleep(1)  # Wait for cleanup
-            
-            # Verify transmission has stopped
-            verify_commands = [
-                "pgrep -f 'rpitx|pichirp|tune'",
-                "gpio -g read 4"
-            ]
-            
-            all_stopped = True
-            for cmd in verify_commands:
-                stdin, stdout, stderr = self.ssh.exec_command(cmd)
-                if stdout.read():
-                    all_stopped = False
-                    break
-            
-            if all_stopped:
-                messagebox.showinfo("Success", "Transmission fully stopped")
-            else:
-                messagebox.showwarning("Warning", "Some processes might still be running")
-                
-        except Exception as e:
-            messagebox.showerror("Error", f"Emergency stop failed: {str(e)}")
+        # Don't let the queue put the next job on air; the stop also kills staged jobs
+        self.scheduler.pause(cancel_staged=False)
+        self.refresh_job_list()
+        
+        # Whole kill/GPIO-reset/rmmod sequence plus verification in one round trip
+        self.worker.submit(self.controller.stop, on_success=self.show_stop_result, name="force_stop_transmission",
+                           urgent=True)
+        
+    def show_stop_result(self, result):
+        print(f"Emergency stop: {result.describe()}")  # Debug output
+        
+        if result.error:
+            messagebox.showerror("Error", result.describe())
+        elif result.stopped and not result.failed_steps:
+            messagebox.showinfo("Success", f"Transmission fully stopped ({result.latency * 1000:.0f} ms)")
+        else:
+            messagebox.showwarning("Warning", f"Some processes might still be running\n{result.describe()}")
+
+    def on_stop_over_budget(self, latency):
+        """Called when an emergency stop took longer than the configured budget"""
+        print(f"WARNING: stop latency {latency * 1000:.0f} ms over budget "
+              f"({self.controller.emergency_stop.latency.budget * 1000:.0f} ms)")
 
     def stop_transmission(self):
-        if self.ssh:
-            self.is_transmitting = False
-            if self.current_process:
-                try:
-                    self.current_process.close()
-                except:
-                    pass
-            
-            # Try normal stop first, then force stop
-            try:
-                self.force_stop_transmission()
-            except:
-                self.force_kill_all()
+        if self.fleet is not None and self.fleet_var.get():
+            self.stop_fleet()
+        if self.controller.session.is_configured():
+            self.force_stop_transmission()
 
     def force_kill_all(self):
-        if not self.ssh:
-            if not self.connect_ssh():
-                return
-                
-        self.is_transmitting = False
-        if self.current_process:
-            try:
-                self.current_process.close()
-            except:
-                pass
-        
+        if not self.controller.session.is_configured():
+            # Connect first, then come back here
+            self.connect_ssh(on_connected=self.force_kill_all)
+            return
+            
         # Call emergency stop procedure
         self.force_stop_transmission()
 
+    def cancel_pending(self):
+        """Cancel queued or running background operations (uploads, preprocessing); stops keep going"""
+        count = len(self.worker.pending)
+        self.worker.cancel_all()
+        print(f"Cancelled {count} pending operation(s)")
+
     def cleanup(self):
         """Cleanup function to ensure all processes are stopped"""
-        if self.ssh:
+        if self.ready:
+            self.scheduler.pause(cancel_staged=False)
+            self.presets.close()
+        if self.leave_running:
+            # The user chose to keep them on air when closing the window
+            return
+        if self.fleet is not None:
             try:
-                self.force_stop_transmission()
-                self.ssh.close()
+                self.fleet.stop_all()
+                self.fleet.close()
+            except:
+                pass
+        if self.controller.session.is_connected():
+            try:
+                self.controller.stop()
+                self.controller.close()
             except:
                 pass
 
     def on_closing(self):
         """Handle window closing event"""
         try:
-            if messagebox.askokcancel("Quit", "Do you want to quit? This will stop all transmissions."):
-                self.cleanup()
+            detached = [p for p in self.controller.processes.active() if p.job is not None]
+            if detached:
+                # Detached jobs can stay on air without us; the next connect picks them up again
+                answer = messagebox.askyesnocancel(
+                    "Quit",
+                    "Stop all transmissions before quitting?\n\n"
+                    "Yes: stop everything\nNo: leave running jobs on the Pi (reattached on the next connect)"
+                )
+                if answer is None:
+                    return
+                self.leave_running = not answer
+            elif not messagebox.askokcancel("Quit", "Do you want to quit? This will stop all transmissions."):
+                return
+
+            def finish(_=None):
+                self.watchdog.stop()
+                self.worker.shutdown()
+                self.presets.close()
+                if self.settings["metrics_file"]:
+                    METRICS.save(self.settings["metrics_file"])
+                METRICS.stop_server()
+                self.controller.close()
+                if self.fleet is not None:
+                    self.fleet.close()
+                    self.fleet = None
                 self.root.destroy()
+                
+            def stop_everything():
+                self.scheduler.pause(cancel_staged=False)
+                if self.fleet is not None:
+                    self.fleet.stop_all()
+                return self.controller.stop()
+                
+            if self.leave_running:
+                self.scheduler.pause(cancel_staged=False)
+                finish()
+            elif self.controller.session.is_connected() or self.fleet is not None:
+                # Stop in the background so the window doesn't freeze while closing
+                self.status_label.config(text="Status: Stopping...")
+                self.worker.submit(stop_everything, on_success=finish, on_error=finish, name="on_closing", urgent=True)
+            else:
+                finish()
         except:
             self.root.destroy()
 
@@ -429,18 +939,24 @@ class RpitxRemoteGUI:
             if not name:
                 return
                 
-            # Get current settings
+            # Get current settings, plus whatever each mode last ran with
+            params = {mode: dict(values) for mode, values in self.mode_params.items()}
+            params["chirp"] = {"bandwidth": int(self.bandwidth_var.get()), "speed": int(self.speed_var.get())}
+            options = {
+                "stream": self.stream_var.get(),
+                "preprocess": self.preprocess_var.get(),
+                "compress": self.compress_var.get(),
+                "images": self.images_var.get()
+            }
             preset = {
                 "name": name,
                 "frequency": float(self.freq_entry.get()),
-                "chirp_bandwidth": int(self.bandwidth_var.get()),
-                "chirp_speed": int(self.speed_var.get())
+                "params": params,
+                "options": options
             }
             
-            # Add to saved presets
-            self.settings["saved_presets"] = [p for p in self.settings["saved_presets"] if p["name"] != name]
-            self.settings["saved_presets"].append(preset)
-            self.save_settings()
+            # One journal line, not a rewrite of every preset
+            self.presets.put(preset)
             
             # Update combo box
             self.update_preset_list()
@@ -451,9 +967,18 @@ class RpitxRemoteGUI:
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save settings: {str(e)}")
             
-    def update_preset_list(self):
-        presets = [p["name"] for p in self.settings["saved_presets"]]
-        self.preset_combo["values"] = presets
+    def update_preset_list(self, query=""):
+        self.preset_combo["values"] = self.presets.search(query, limit=200)
+        
+    def on_preset_typed(self, event=None):
+        # Wait for a pause in typing before searching
+        if self._preset_filter_job is not None:
+            self.root.after_cancel(self._preset_filter_job)
+        self._preset_filter_job = self.root.after(150, self.filter_presets)
+        
+    def filter_presets(self):
+        self._preset_filter_job = None
+        self.update_preset_list(self.preset_var.get())
         
     def load_preset(self):
         try:
@@ -461,8 +986,7 @@ class RpitxRemoteGUI:
             if not name:
                 return
                 
-            # Find preset
-            preset = next((p for p in self.settings["saved_presets"] if p["name"] == name), None)
+            preset = self.presets.get(name)
             if not preset:
                 return
                 
@@ -470,8 +994,19 @@ class RpitxRemoteGUI:
             self.freq_entry.delete(0, tk.END)
             self.freq_entry.insert(0, str(preset["frequency"]))
             
-            self.bandwidth_var.set(str(preset["chirp_bandwidth"]))
-            self.speed_var.set(str(preset["chirp_speed"]))
+            chirp = preset_params(preset, "chirp")
+            if "bandwidth" in chirp:
+                self.bandwidth_var.set(str(chirp["bandwidth"]))
+            if "speed" in chirp:
+                self.speed_var.set(str(chirp["speed"]))
+            options = preset.get("options") or {}
+            if options:
+                self.stream_var.set(options.get("stream", self.stream_var.get()))
+                self.preprocess_var.set(options.get("preprocess", self.preprocess_var.get()))
+                self.compress_var.set(options.get("compress", self.compress_var.get()))
+                self.images_var.set(options.get("images", self.images_var.get()))
+                self.save_audio_options()
+            self.mode_params.update(preset["params"])
             
             messagebox.showinfo("Success", f"Loaded settings '{name}'")
             
@@ -486,8 +1021,7 @@ class RpitxRemoteGUI:
                 
             if messagebox.askyesno("Confirm Delete", f"Delete settings '{name}'?"):
                 # Remove preset
-                self.settings["saved_presets"] = [p for p in self.settings["saved_presets"] if p["name"] != name]
-                self.save_settings()
+                self.presets.delete(name)
                 
                 # Update combo box
                 self.update_preset_list()
@@ -500,111 +1034,190 @@ class RpitxRemoteGUI:
 
     # Transmission mode implementations
     def run_tune(self):
-        self.execute_command("./testvfo.sh {freq_hz}")
+        self.run_mode("tune")
         
     def run_chirp(self):
-        try:
-            freq_hz = int(float(self.freq_entry.get()) * 1e6)
-            bandwidth = int(self.bandwidth_var.get())
-            speed = int(self.speed_var.get())
-            
-            # Use original pichirp command with our parameters
-            command = f"./pichirp {freq_hz} {bandwidth} {speed}"
-            self.execute_command(command)
-        except ValueError as e:
-            messagebox.showerror("Error", "Invalid frequency, bandwidth, or speed value")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to start chirp: {str(e)}")
+        # Use original pichirp command with our parameters
+        self.run_mode("chirp", bandwidth=self.bandwidth_var.get(), speed=self.speed_var.get())
             
     def run_spectrum(self):
-        file_path = filedialog.askopenfilename(filetypes=[("JPEG files", "*.jpg")])
+        file_path = filedialog.askopenfilename(filetypes=IMAGE_FILETYPES)
         if file_path:
-            remote_path = self.upload_file(file_path, "temp.jpg")
-            if remote_path:
-                self.execute_command(f"./testspectrum.sh {{freq_hz}} {remote_path}")
+            if self.images_var.get():
+                self.preview_image("spectrum", file_path)
+            self.run_mode("spectrum", file_path=file_path)
             
     def run_fmrds(self):
         file_path = filedialog.askopenfilename(filetypes=[("WAV files", "*.wav")])
         if file_path:
-            remote_path = self.upload_file(file_path, "temp.wav")
-            if remote_path:
-                self.execute_command(f"./testfmrds.sh {{freq_hz}} {remote_path}")
+            self.run_mode("fmrds", file_path=file_path)
             
     def run_nfm(self):
         file_path = filedialog.askopenfilename(filetypes=[("WAV files", "*.wav")])
         if file_path:
-            remote_path = self.upload_file(file_path, "temp.wav")
-            if remote_path:
-                self.execute_command(f"./testnfm.sh {{freq_hz}} {remote_path}")
+            self.run_mode("nfm", file_path=file_path)
             
     def run_ssb(self):
         file_path = filedialog.askopenfilename(filetypes=[("WAV files", "*.wav")])
         if file_path:
-            remote_path = self.upload_file(file_path, "temp.wav")
-            if remote_path:
-                self.execute_command(f"./testssb.sh {{freq_hz}} {remote_path}")
+            self.run_mode("ssb", file_path=file_path)
             
     def run_am(self):
         file_path = filedialog.askopenfilename(filetypes=[("WAV files", "*.wav")])
         if file_path:
-            remote_path = self.upload_file(file_path, "temp.wav")
-            if remote_path:
-                self.execute_command(f"./testam.sh {{freq_hz}} {remote_path}")
+            self.run_mode("am", file_path=file_path)
             
     def run_freedv(self):
         file_path = filedialog.askopenfilename(filetypes=[("RF files", "*.rf")])
         if file_path:
-            remote_path = self.upload_file(file_path, "temp.rf")
-            if remote_path:
-                self.execute_command(f"./testfreedv.sh {{freq_hz}} {remote_path}")
+            self.run_mode("freedv", file_path=file_path)
             
     def run_sstv(self):
-        file_path = filedialog.askopenfilename(filetypes=[("JPEG files", "*.jpg")])
+        file_path = filedialog.askopenfilename(filetypes=IMAGE_FILETYPES)
         if file_path:
-            remote_path = self.upload_file(file_path, "temp.jpg")
-            if remote_path:
-                self.execute_command(f"./testsstv.sh {{freq_hz}} {remote_path}")
+            if self.images_var.get():
+                self.preview_image("sstv", file_path)
+            self.run_mode("sstv", file_path=file_path)
             
     def run_pocsag(self):
-        try:
-            # Get message from user
-            message = simpledialog.askstring("POCSAG Message", "Enter message:")
-            if not message:
-                return
-                
-            # Sanitize message to prevent command injection
-            message = message.replace("'", "").replace('"', "").replace(";", "")
-            
-            # Get frequency in Hz
-            freq_hz = int(float(self.freq_entry.get()) * 1e6)
-            
-            # Create temp file for message
-            remote_msg_path = f"/home/{self.settings['username']}/rpitx/temp/pocsag_msg.txt"
-            
-            # Write message to remote file
-            stdin, stdout, stderr = self.ssh.exec_command(f"echo '{message}' > {remote_msg_path}")
-            stdout.channel.recv_exit_status()
-            
-            # Run POCSAG with proper parameters
-            command = f"cat {remote_msg_path} | ./pocsag -f {freq_hz}"
-            self.execute_command(command)
-            
-        except ValueError as e:
-            messagebox.showerror("Error", "Invalid frequency value")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to send POCSAG message: {str(e)}")
+        # Get message from user; it goes to pocsag's stdin, so no shell escaping issues
+        message = simpledialog.askstring("POCSAG Message", "Enter message:")
+        if message:
+            self.run_mode("pocsag", message=message)
             
     def run_opera(self):
         callsign = simpledialog.askstring("Opera Callsign", "Enter callsign:")
         if callsign:
-            self.execute_command(f"./testopera.sh {{freq_hz}} '{callsign}'")
+            self.run_mode("opera", callsign=callsign)
             
     def run_rtty(self):
         message = simpledialog.askstring("RTTY Message", "Enter message:")
         if message:
-            self.execute_command(f"./testrtty.sh {{freq_hz}} '{message}'")
+            self.run_mode("rtty", message=message)
+            
+    def run_sweep(self):
+        # Frequencies as a list or a start-stop:step range, all in MHz
+        plan_text = simpledialog.askstring(
+            "Sweep Plan", "Frequencies in MHz, e.g. 434.0, 434.5 or 434.0-435.0:0.1",
+            initialvalue=self.settings.get("sweep_plan") or self.freq_entry.get()
+        )
+        if not plan_text:
+            return
+        try:
+            plan = parse_plan(plan_text)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        dwell = simpledialog.askfloat("Sweep Dwell", "Dwell time per frequency (ms):",
+                                      initialvalue=self.settings.get("sweep_dwell_ms", 500), minvalue=20)
+        if dwell is None:
+            return
+        loops = simpledialog.askinteger("Sweep Loops", "Passes through the plan (0 = until stopped):",
+                                        initialvalue=1, minvalue=0)
+        if loops is None:
+            return
+            
+        self.settings.update({"sweep_plan": plan_text, "sweep_dwell_ms": dwell})
+        self.save_settings()
+        # The first hop doubles as the frequency for the frequency check and the job list
+        self.freq_entry.delete(0, tk.END)
+        self.freq_entry.insert(0, str(plan[0] / 1e6))
+        self.run_mode("sweep", frequencies=plan, dwell=dwell / 1000, loops=loops)
+
+    def run_iq(self):
+        # Generated here and streamed to sendiq, so nothing is uploaded first
+        waveform = simpledialog.askstring("IQ Waveform", WAVEFORM_HELP,
+                                          initialvalue=self.settings["iq_waveform"])
+        if not waveform:
+            return
+        rate = simpledialog.askinteger("IQ Sample Rate", "Samples per second (10000-250000):",
+                                       initialvalue=self.settings["iq_sample_rate"], minvalue=10000, maxvalue=250000)
+        if rate is None:
+            return
+        try:
+            parse_waveform(waveform, rate)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+            
+        self.settings.update({"iq_waveform": waveform, "iq_sample_rate": rate})
+        self.save_settings()
+        self.run_mode("iq", waveform=waveform, rate=rate)
+
+    def run_messages(self):
+        # A whole file of pages or texts goes out through one transmitter run
+        kind = simpledialog.askstring("Message Kind", "pocsag, rtty or opera:",
+                                      initialvalue=self.settings.get("messages_kind", "pocsag"))
+        if not kind:
+            return
+        kind = kind.strip().lower()
+        if kind not in MESSAGE_KINDS:
+            messagebox.showerror("Error", f"Unknown message kind '{kind}'")
+            return
+        file_path = filedialog.askopenfilename(filetypes=MESSAGE_FILETYPES)
+        if not file_path:
+            return
+        try:
+            records = load_messages(file_path, kind)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Can't read {os.path.basename(file_path)}: {e}")
+            return
+        invalid = [r for r in records if not r.valid]
+        if len(invalid) == len(records):
+            messagebox.showerror("Error", "No valid messages in the file" +
+                                 (f"\n\nLine {invalid[0].line}: {invalid[0].error}" if invalid else ""))
+            return
+        if invalid:
+            details = "\n".join(f"Line {r.line}: {r.error}" for r in invalid[:10])
+            if not messagebox.askyesno("Invalid Messages",
+                                       f"{len(invalid)} of {len(records)} records can't be sent:\n\n{details}"
+                                       "\n\nSend the others?"):
+                return
+
+        self.settings["messages_kind"] = kind
+        self.save_settings()
+        self.run_mode("messages", kind=kind, file_path=file_path)
+
+    def run_playlist(self):
+        # One modulator for the whole list; the next tracks upload while the current one plays
+        file_path = filedialog.askopenfilename(filetypes=PLAYLIST_FILETYPES)
+        if not file_path:
+            return
+        ps = simpledialog.askstring("RDS Station Name", "Station name shown on receivers (up to 8 characters):",
+                                    initialvalue=self.settings["playlist_ps"])
+        if ps is None:
+            return
+        loop = messagebox.askyesno("Playlist", "Repeat the playlist until stopped?")
+        
+        self.settings.update({"playlist_ps": ps, "playlist_loop": loop})
+        self.save_settings()
+        self.run_mode("playlist", file_path=file_path, loop=loop, ps=ps)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Khanfar TX v2")
+    parser.add_argument("--startup-report", nargs="?", const="", metavar="JSON",
+                        help="print how long each startup step and the slowest imports took, optionally saving JSON")
+    parser.add_argument("--quit-after-startup", action="store_true", help="close once started (for timing)")
+    args = parser.parse_args()
+    STARTUP.mark("imports")
     root = tk.Tk()
+    STARTUP.mark("tk")
     app = RpitxRemoteGUI(root)
+
+    def startup_report():
+        # Ready means ready to connect, so wait for the deferred setup and the background SSH import as well
+        if not app.ready or app.ssh_warm_up.is_alive():
+            root.after(20, startup_report)
+            return
+        STARTUP.mark("ssh_ready")
+        if args.startup_report is not None:
+            print(STARTUP.format())
+            if args.startup_report:
+                STARTUP.save(args.startup_report)
+        if args.quit_after_startup:
+            app.worker.shutdown()
+            root.destroy()
+
+    if args.startup_report is not None or args.quit_after_startup:
+        root.after(0, startup_report)
     root.mainloop()
@@ -0,0 +1,295 @@
+import socket
+import threading
+
+from rpitx_metrics import METRICS
+
+# paramiko pulls in cryptography, which takes a good part of a second to import
+# on a slow laptop; it is loaded on first connect or by warm_up() instead
+_paramiko = None
+_import_lock = threading.Lock()
+
+
+def load_paramiko():
+    """Import paramiko on first use and return the module"""
+    global _paramiko
+    with _import_lock:
+        if _paramiko is None:
+            with METRICS.timer("startup.paramiko"):
+                import paramiko
+            _paramiko = paramiko
+    return _paramiko
+
+
+def warm_up():
+    """Import paramiko on a background thread, so the first connect doesn't wait for it"""
+    thread = threading.Thread(target=load_paramiko, daemon=True, name="paramiko-warm-up")
+    thread.start()
+    return thread
+
+
+def read_stream(stream, into):
+    """Read a channel stream to EOF into a list (thread target); errors end the read"""
+    try:
+        into.append(stream.read())
+    except Exception:
+        pass
+
+
+class SessionError(Exception):
+    """Raised when no usable SSH transport is available"""
+
+
+class SSHSessionManager:
+    """Owns one long-lived SSH connection to the Raspberry Pi.
+
+    The transport is kept alive with SSH keepalives and re-established in a
+    background thread with exponential backoff when the link drops. Callers
+    borrow channels and a shared SFTP session from here instead of creating a
+    new SSHClient (and paying a full handshake) for every operation.
+    """
+
+    DISCONNECTED = "disconnected"
+    CONNECTING = "connecting"
+    CONNECTED = "connected"
+    RECONNECTING = "reconnecting"
+
+    def __init__(self, keepalive_interval=15, connect_timeout=10,
+                 backoff_initial=0.5, backoff_max=30.0, reconnect_wait=5.0, sftp_window=None):
+        self.keepalive_interval = keepalive_interval
+        self.connect_timeout = connect_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.reconnect_wait = reconnect_wait
+        # SSH window for the SFTP channel: how many bytes may be in flight before the Pi acknowledges
+        self.sftp_window = sftp_window
+
+        self.host = None
+        self.port = 22
+        self.username = None
+        self.password = None
+
+        self.state = self.DISCONNECTED
+        self.last_error = None
+        self.reconnect_count = 0
+
+        self._client = None
+        self._sftp = None
+        self._lock = threading.RLock()
+        self._connected = threading.Event()
+        self._wake = threading.Event()
+        self._closing = False
+        self._monitor = None
+
+    def configure(self, host, username, password, port=22):
+        """Set the connection target. Returns True if the target changed"""
+        target = (host, int(port), username, password)
+        with self._lock:
+            changed = target != (self.host, self.port, self.username, self.password)
+            self.host, self.port, self.username, self.password = target
+        return changed
+
+    def is_configured(self):
+        return self.host is not None
+
+    def is_connected(self):
+        transport = self._client.get_transport() if self._client else None
+        return transport is not None and transport.is_active()
+
+    def connect(self):
+        """Open the connection now (blocking) and start the keepalive monitor.
+
+        Does nothing if a live transport to the same target already exists.
+        Raises the underlying paramiko/socket error on failure.
+        """
+        if not self.is_configured():
+            raise SessionError("No host configured")
+        with self._lock:
+            self._closing = False
+            if not self.is_connected():
+                self._set_state(self.CONNECTING)
+                try:
+                    self._open_client()
+                except Exception as e:
+                    self.last_error = str(e)
+                    self._set_state(self.DISCONNECTED)
+                    raise
+            self._start_monitor()
+
+    def reconnect(self):
+        """Drop the current transport and connect again with the stored target"""
+        with self._lock:
+            self._drop_client()
+        self.connect()
+
+    def get_transport(self, wait=None):
+        """Return the active transport, waiting up to `wait` seconds for a reconnect"""
+        transport = self._client.get_transport() if self._client else None
+        if transport is not None and transport.is_active():
+            return transport
+
+        if not self.is_configured() or self._closing:
+            raise SessionError("Not connected to Raspberry Pi")
+
+        if transport is not None:
+            # Died since the monitor last looked; don't let a stale "connected" skip the wait
+            self._mark_dead(transport)
+            if self.is_connected():
+                return self._client.get_transport()
+        # Link is down; let the monitor reconnect and wait for it briefly
+        self._wake.set()
+        if wait is None:
+            wait = self.reconnect_wait
+        if not self._connected.wait(wait):
+            raise SessionError(f"Connection lost ({self.last_error or 'reconnecting'})")
+        return self._client.get_transport()
+
+    def open_channel(self, timeout=None):
+        """Open a new session channel on the shared transport"""
+        transport = self.get_transport()
+        try:
+            return transport.open_session(timeout=timeout)
+        except Exception:
+            # Transport died under us; let the monitor reconnect and retry once
+            self._mark_dead(transport)
+
+        transport = self.get_transport()
+        try:
+            return transport.open_session(timeout=timeout)
+        except Exception as e:
+            self._mark_dead(transport)
+            raise SessionError(f"Could not open channel: {e}")
+
+    def exec_command(self, command, timeout=None):
+        """Run a short command and wait for it. Returns (exit_status, stdout, stderr)"""
+        channel = self.open_channel(timeout=timeout)
+        try:
+            if timeout is not None:
+                channel.settimeout(timeout)
+            channel.exec_command(command)
+            # Read stderr alongside stdout: a command that fills the stderr window
+            # before closing stdout would otherwise block forever
+            stderr_data = []
+            reader = threading.Thread(target=read_stream, args=(channel.makefile_stderr("rb"), stderr_data),
+                                      daemon=True)
+            reader.start()
+            stdout = channel.makefile("rb").read().decode(errors="replace")
+            reader.join(timeout)
+            stderr = b"".join(stderr_data).decode(errors="replace")
+            return channel.recv_exit_status(), stdout, stderr
+        finally:
+            channel.close()
+
+    def open_sftp(self):
+        """Return the shared SFTP client, reopening it if its channel went away"""
+        with self._lock:
+            sftp = self._sftp
+            if sftp is not None:
+                channel = sftp.get_channel()
+                if channel is not None and not channel.closed and self.is_connected():
+                    return sftp
+            self._sftp = load_paramiko().SFTPClient.from_transport(self.get_transport(),
+                                                                   window_size=self.sftp_window)
+            return self._sftp
+
+    def close(self):
+        """Close the connection and stop reconnecting"""
+        self._closing = True
+        self._wake.set()
+        with self._lock:
+            self._drop_client()
+        self._set_state(self.DISCONNECTED)
+
+    def _open_client(self):
+        paramiko = load_paramiko()
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        with METRICS.timer("ssh.connect"):
+            client.connect(
+                self.host,
+                port=self.port,
+                username=self.username,
+                password=self.password,
+                timeout=self.connect_timeout,
+                banner_timeout=self.connect_timeout,
+                auth_timeout=self.connect_timeout,
+            )
+        client.get_transport().set_keepalive(self.keepalive_interval)
+        try:
+            # Requests to the agent and stop scripts are small writes; don't let Nagle hold them back
+            client.get_transport().sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (AttributeError, OSError):
+            pass
+        self._client = client
+        self.last_error = None
+        self._set_state(self.CONNECTED)
+
+    def _drop_client(self):
+        self._connected.clear()
+        if self._sftp is not None:
+            try:
+                self._sftp.close()
+            except Exception:
+                pass
+            self._sftp = None
+        if self._client is not None:
+            try:
+                self._client.close()
+            except Exception:
+                pass
+            self._client = None
+
+    def _mark_dead(self, transport):
+        """Force-close a failing transport so the monitor reconnects right away"""
+        try:
+            transport.close()
+        except Exception:
+            pass
+        self._connected.clear()
+        self._wake.set()
+
+    def _set_state(self, state):
+        self.state = state
+        if state == self.CONNECTED:
+            self._connected.set()
+        else:
+            self._connected.clear()
+
+    def _start_monitor(self):
+        if self._monitor is not None and self._monitor.is_alive():
+            return
+        self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+        self._monitor.start()
+
+    def _monitor_loop(self):
+        """Watch the transport and reconnect with exponential backoff when it dies"""
+        backoff = self.backoff_initial
+        while not self._closing:
+            self._wake.wait(self.keepalive_interval)
+            self._wake.clear()
+            if self._closing:
+                break
+            if self.is_connected():
+                backoff = self.backoff_initial
+                continue
+
+            with self._lock:
+                if self._closing or self.is_connected():
+                    continue
+                self._drop_client()
+                self._set_state(self.RECONNECTING)
+                try:
+                    self._open_client()
+                    self.reconnect_count += 1
+                    backoff = self.backoff_initial
+                    continue
+                except Exception as e:
+                    self.last_error = str(e)
+                    self._set_state(self.RECONNECTING)
+
+            # Sleep out the backoff, but wake early if someone closes us or asks for the link
+            self._wake.clear()
+            if self._closing:
+                break
+            self._wake.wait(backoff)
+            backoff = min(backoff * 2, self.backoff_max)
+            self._wake.set()
@@ -0,0 +1,117 @@
+import time
+
+# When the GUI module started loading; it imports this module before anything else
+STARTED = time.perf_counter()
+
+import builtins  # noqa: E402
+import json  # noqa: E402
+import sys  # noqa: E402
+import threading  # noqa: E402
+
+from rpitx_metrics import METRICS  # noqa: E402
+
+
+class ImportTimer:
+    """Times the modules imported on one thread, like python -X importtime.
+
+    Wraps builtins.__import__ while installed and records, per module, the
+    time spent importing it (cumulative) and that time minus the imports it
+    triggered (self).
+    """
+
+    def __init__(self):
+        self.modules = {}  # name -> [self seconds, cumulative seconds]
+        self._original = None
+        self._thread = None
+        self._children = []
+
+    def install(self):
+        if self._original is None:
+            self._original = builtins.__import__
+            self._thread = threading.get_ident()
+            builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def slowest(self, count=15):
+        """[(name, self, cumulative)] with the largest cumulative times first"""
+        rows = [(name, own, cumulative) for name, (own, cumulative) in self.modules.items()]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows[:count]
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original or builtins.__import__
+        if level or threading.get_ident() != self._thread or not self._loads_something(name, fromlist):
+            return original(name, globals, locals, fromlist, level)
+
+        self._children.append(0.0)
+        started = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            children = self._children.pop()
+            if self._children:
+                self._children[-1] += elapsed
+            entry = self.modules.setdefault(name, [0.0, 0.0])
+            entry[0] += elapsed - children
+            entry[1] += elapsed
+
+    @staticmethod
+    def _loads_something(name, fromlist):
+        module = sys.modules.get(name)
+        if module is None:
+            return True
+        # "from package import submodule" loads the submodule even though the package is there
+        return any(item != "*" and not hasattr(module, item) for item in fromlist or ())
+
+
+class StartupTimer:
+    """How long each step of starting the GUI took, with an import breakdown.
+
+    mark(step) records the time since the previous mark as the metric
+    "startup.<step>", so startup shows in the Latency Metrics panel and the
+    Prometheus export like any other phase.
+    """
+
+    def __init__(self, started=STARTED):
+        self.started = started
+        self.imports = ImportTimer()
+        self.steps = []  # (step, seconds, seconds since start)
+        self._last = started
+
+    def mark(self, step):
+        now = time.perf_counter()
+        # Imports after the first step are lazy ones and belong to whatever triggered them
+        self.imports.uninstall()
+        METRICS.observe(f"startup.{step}", now - self._last)
+        self.steps.append((step, now - self._last, now - self.started))
+        self._last = now
+
+    def report(self, top=15):
+        return {
+            "steps": [{"step": step, "ms": seconds * 1000, "at_ms": at * 1000}
+                      for step, seconds, at in self.steps],
+            "imports": [{"module": name, "self_ms": own * 1000, "cumulative_ms": cumulative * 1000}
+                        for name, own, cumulative in self.imports.slowest(top)],
+        }
+
+    def format(self, top=15):
+        lines = [f"{'startup step':<24}{'ms':>10}{'at ms':>10}"]
+        for step, seconds, at in self.steps:
+            lines.append(f"{step:<24}{seconds * 1000:>10.1f}{at * 1000:>10.1f}")
+        lines += ["", f"{'slowest imports':<40}{'self ms':>10}{'cumul ms':>10}"]
+        for name, own, cumulative in self.imports.slowest(top):
+            lines.append(f"{name:<40}{own * 1000:>10.1f}{cumulative * 1000:>10.1f}")
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=4)
+
+
+STARTUP = StartupTimer()
+STARTUP.imports.install()
@@ -0,0 +1,268 @@
+import collections
+import threading
+import time
+
+from rpitx_metrics import METRICS
+from rpitx_session import SessionError
+
+# Emergency stop sequence, run as root in a single remote shell.
+# Each entry is (step name, shell command, exit codes that count as success);
+# killall/pkill exit with 1 when there was simply nothing left to kill.
+STOP_STEPS = [
+    # First stop DMA operations
+    ("killall", "killall -9 rpitx pichirp tune", (0, 1)),
+    # Force stop all possible processes
+    ("pkill_rpitx", "pkill -f -9 rpitx", (0, 1)),
+    ("pkill_pichirp", "pkill -f -9 pichirp", (0, 1)),
+    ("pkill_tune", "pkill -f -9 tune", (0, 1)),
+    # Kill all test scripts
+    ("pkill_scripts", "pkill -f -9 'test.*\\.sh'", (0, 1)),
+    # Reset GPIO and DMA
+    ("gpio_write", "gpio -g write 4 0", (0,)),
+    ("gpio_mode", "gpio -g mode 4 in", (0,)),
+    # Stop any remaining processes
+    ("killall_modes", "killall -9 rpitx pichirp tune spectrumpaint pifmrds sendiq pocsag piopera freedv pisstv pirtty", (0, 1)),
+    # Clean up DMA
+    ("rmmod", "rmmod rpitx_mod 2>/dev/null || true", (0,)),
+    # Final GPIO cleanup
+    ("gpio_unexport", "echo 4 > /sys/class/gpio/unexport 2>/dev/null || true", (0,)),
+    # Reset PWM
+    ("pi_blaster", "killall pi-blaster 2>/dev/null || true", (0,)),
+]
+
+VERIFY_PATTERN = "rpitx|pichirp|tune"
+
+
+def build_stop_script(steps=STOP_STEPS, verify_timeout=2.0, poll_interval=0.05):
+    """Build the shell script that runs the whole stop sequence plus verification.
+
+    The script is fed to `sudo sh -s` on stdin rather than passed on the
+    command line, otherwise `pkill -f rpitx` would match (and kill) the shell
+    running it. It prints one `STEP <name> <rc> <ns timestamp>` line per
+    step, then polls until the transmitter processes are gone instead of
+    sleeping a fixed time.
+    """
+    polls = max(1, int(verify_timeout / poll_interval))
+    lines = ["start=$(date +%s%N)"]
+    for name, command, _ in steps:
+        lines.append(f'( {command} ) >/dev/null 2>&1; rc=$?; echo "STEP {name} $rc $(date +%s%N)"')
+    lines += [
+        "i=0",
+        f"while pgrep -f '{VERIFY_PATTERN}' >/dev/null 2>&1; do",
+        f"    [ $i -ge {polls} ] && break",
+        f"    sleep {poll_interval}",
+        "    i=$((i+1))",
+        "done",
+        f"echo \"VERIFY procs $(pgrep -f '{VERIFY_PATTERN}' | wc -l)\"",
+        'echo "VERIFY gpio $(gpio -g read 4 2>/dev/null)"',
+        'echo "START $start"',
+        'echo "ELAPSED $(( ($(date +%s%N) - start) / 1000000 ))"',
+    ]
+    return "\n".join(lines) + "\n"
+
+
+class StopResult:
+    """Outcome of one emergency stop"""
+
+    def __init__(self, latency, step_codes, running, gpio, remote_ms, error=None, steps=STOP_STEPS, step_ms=None):
+        self.latency = latency
+        self.step_codes = step_codes
+        # How long each step took on the Pi
+        self.step_ms = step_ms or {}
+        self.running = running
+        self.gpio = gpio
+        self.remote_ms = remote_ms
+        self.error = error
+        ok_codes = {name: codes for name, _, codes in steps}
+        self.failed_steps = [
+            name for name, _, _ in steps
+            if step_codes.get(name) not in ok_codes[name]
+        ]
+
+    @property
+    def stopped(self):
+        """True when no transmitter process is left and GPIO4 is not driven high"""
+        return self.error is None and self.running == 0 and self.gpio != "1"
+
+    def describe(self):
+        if self.error:
+            return f"Emergency stop failed: {self.error}"
+        parts = [f"Stop took {self.latency * 1000:.0f} ms"]
+        if self.running:
+            parts.append(f"{self.running} transmitter process(es) still running")
+        if self.gpio == "1":
+            parts.append("GPIO4 still high")
+        if self.failed_steps:
+            parts.append("failed steps: " + ", ".join(self.failed_steps))
+        return "; ".join(parts)
+
+
+def parse_stop_output(output, latency, steps=STOP_STEPS):
+    step_codes = {}
+    step_ends = []
+    start_ns = None
+    running = None
+    gpio = ""
+    remote_ms = None
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) >= 3 and fields[0] == "STEP":
+            step_codes[fields[1]] = int(fields[2])
+            if len(fields) >= 4 and fields[3].isdigit():
+                step_ends.append((fields[1], int(fields[3])))
+        elif len(fields) == 2 and fields[0] == "START" and fields[1].isdigit():
+            start_ns = int(fields[1])
+        elif len(fields) >= 2 and fields[:2] == ["VERIFY", "procs"]:
+            running = int(fields[2]) if len(fields) > 2 else 0
+        elif len(fields) >= 2 and fields[:2] == ["VERIFY", "gpio"]:
+            gpio = fields[2] if len(fields) > 2 else ""
+        elif len(fields) == 2 and fields[0] == "ELAPSED":
+            remote_ms = int(fields[1])
+
+    step_ms = {}
+    if start_ns is not None:
+        previous = start_ns
+        for name, ended in step_ends:
+            step_ms[name] = (ended - previous) / 1e6
+            previous = ended
+
+    error = None
+    if running is None:
+        error = "stop script did not complete"
+    return StopResult(latency, step_codes, running, gpio, remote_ms, error=error, steps=steps, step_ms=step_ms)
+
+
+class StopLatencyTracker:
+    """Keeps recent stop latencies and flags the ones over budget"""
+
+    def __init__(self, budget=1.5, history=100, on_over_budget=None):
+        self.budget = budget
+        self.on_over_budget = on_over_budget
+        self.history = collections.deque(maxlen=history)
+        self.over_budget_count = 0
+
+    def record(self, latency):
+        self.history.append(latency)
+        if latency > self.budget:
+            self.over_budget_count += 1
+            if self.on_over_budget:
+                self.on_over_budget(latency)
+
+    @property
+    def last(self):
+        return self.history[-1] if self.history else None
+
+    def summary(self):
+        values = sorted(self.history)
+        if not values:
+            return {"count": 0, "budget": self.budget, "over_budget": 0}
+        return {
+            "count": len(values),
+            "budget": self.budget,
+            "over_budget": self.over_budget_count,
+            "last": self.history[-1],
+            "min": values[0],
+            "median": values[len(values) // 2],
+            "max": values[-1],
+        }
+
+
+class EmergencyStop:
+    """Runs the full stop sequence as one remote invocation.
+
+    A spare session channel is kept open ahead of time so pressing Stop costs
+    a single round trip on the existing transport. When the remote agent is
+    running it runs the script instead, already as root, so there is no
+    channel to open and no sudo to start.
+    """
+
+    def __init__(self, session, budget=1.5, verify_timeout=2.0, poll_interval=0.05):
+        self.session = session
+        self.verify_timeout = verify_timeout
+        self.poll_interval = poll_interval
+        self.latency = StopLatencyTracker(budget=budget)
+        # RemoteAgent, set by the controller
+        self.agent = None
+        self._standby = None
+        self._lock = threading.Lock()
+
+    def prepare(self):
+        """Open the standby channel used by the next stop"""
+        with self._lock:
+            if self._standby_usable():
+                return
+            try:
+                self._standby = self.session.open_channel()
+            except SessionError:
+                self._standby = None
+
+    def prepare_async(self):
+        threading.Thread(target=self.prepare, daemon=True).start()
+
+    def run(self):
+        """Stop everything and return a StopResult. Never raises"""
+        started = time.perf_counter()
+        script = build_stop_script(verify_timeout=self.verify_timeout, poll_interval=self.poll_interval)
+        try:
+            output = self._run_on_agent(script)
+            if output is None:
+                output = self._run_on_channel(script)
+            result = parse_stop_output(output, time.perf_counter() - started)
+        except Exception as e:
+            result = StopResult(time.perf_counter() - started, {}, None, "", None, error=str(e))
+
+        self.latency.record(result.latency)
+        self._record_metrics(result)
+        self.prepare_async()
+        return result
+
+    def _run_on_channel(self, script):
+        with METRICS.timer("stop.channel"):
+            channel = self._take_channel()
+        try:
+            channel.settimeout(self.verify_timeout + 10)
+            channel.exec_command("sudo sh -s")
+            channel.sendall(script.encode())
+            channel.shutdown_write()
+            output = channel.makefile("rb").read().decode(errors="replace")
+            channel.recv_exit_status()
+        finally:
+            channel.close()
+        return output
+
+    def _run_on_agent(self, script):
+        """The stop script's output from the agent, or None to use a channel"""
+        agent = self.agent
+        if agent is None or not agent.available:
+            return None
+        try:
+            status, output, err = agent.exec_command("sh -s", timeout=self.verify_timeout + 10, root=True,
+                                                     stdin=script)
+            return output
+        except SessionError as e:
+            print(f"Agent stop failed ({e}); using a channel")
+            return None
+
+    def _record_metrics(self, result):
+        if result.error:
+            METRICS.error("stop.total")
+            return
+        METRICS.observe("stop.total", result.latency)
+        if result.remote_ms is not None:
+            METRICS.observe("stop.remote", result.remote_ms / 1000)
+        for name, ms in result.step_ms.items():
+            METRICS.observe(f"stop.step.{name}", ms / 1000)
+
+    def _standby_usable(self):
+        channel = self._standby
+        return (channel is not None and not channel.closed
+                and channel.get_transport() is not None
+                and channel.get_transport().is_active())
+
+    def _take_channel(self):
+        with self._lock:
+            channel = self._standby if self._standby_usable() else None
+            self._standby = None
+        if channel is None:
+            channel = self.session.open_channel()
+        return channel
@@ -0,0 +1,125 @@
+import queue
+import threading
+import time
+
+DEFAULT_CHUNK_SIZE = 32 * 1024
+
+# rpitx test scripts for the audio modes; each takes a frequency and a WAV path
+AUDIO_SCRIPTS = {
+    "fmrds": "testfmrds.sh",
+    "nfm": "testnfm.sh",
+    "ssb": "testssb.sh",
+    "am": "testam.sh",
+}
+
+# Same scripts reading their input from stdin instead of an uploaded file
+STREAM_COMMANDS = {mode: f"{script} {{freq_hz}} /dev/stdin" for mode, script in AUDIO_SCRIPTS.items()}
+
+
+def file_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield a local file in fixed-size chunks"""
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield chunk
+
+
+class ChannelStreamer:
+    """Pushes a stream of byte chunks into a remote process's stdin.
+
+    Chunks come from any iterable (a file reader, a PCM generator, ...) and
+    are produced on a helper thread into a bounded queue, so at most
+    `queue_depth` chunks are held in memory. The sender blocks on the SSH
+    flow-control window, which gives backpressure all the way back to the
+    producer when the Pi consumes slower than we can read.
+    """
+
+    def __init__(self, channel, chunk_size=DEFAULT_CHUNK_SIZE, queue_depth=8, on_progress=None):
+        self.channel = channel
+        self.chunk_size = chunk_size
+        self.queue_depth = queue_depth
+        self.on_progress = on_progress
+        self.bytes_sent = 0
+        self.started = None
+        self.first_byte_at = None
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def rate(self):
+        """Average send rate in bytes/s"""
+        if not self.started:
+            return 0.0
+        elapsed = time.perf_counter() - self.started
+        return self.bytes_sent / elapsed if elapsed > 0 else 0.0
+
+    def run(self, chunks, close_stdin=True):
+        """Send every chunk, then signal EOF. Returns the number of bytes sent"""
+        self.started = time.perf_counter()
+        buffer = queue.Queue(maxsize=self.queue_depth)
+        done = object()
+        errors = []
+        stop = threading.Event()
+
+        def stopping():
+            return stop.is_set() or self._cancel.is_set()
+
+        def produce():
+            try:
+                for chunk in chunks:
+                    # Re-slice oversized chunks so a single item stays bounded
+                    for i in range(0, len(chunk), self.chunk_size):
+                        while not stopping():
+                            try:
+                                buffer.put(chunk[i:i + self.chunk_size], timeout=0.2)
+                                break
+                            except queue.Full:
+                                continue
+                        if stopping():
+                            return
+            except Exception as e:
+                errors.append(e)
+            finally:
+                while True:
+                    try:
+                        buffer.put(done, timeout=0.2)
+                        break
+                    except queue.Full:
+                        if stopping():
+                            break
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+
+        try:
+            while not self._cancel.is_set():
+                try:
+                    chunk = buffer.get(timeout=0.2)
+                except queue.Empty:
+                    if self.channel.closed:
+                        break
+                    continue
+                if chunk is done:
+                    break
+                self.channel.sendall(chunk)
+                if self.first_byte_at is None:
+                    self.first_byte_at = time.perf_counter()
+                self.bytes_sent += len(chunk)
+                if self.on_progress:
+                    self.on_progress(self.bytes_sent)
+        finally:
+            stop.set()
+            producer.join(timeout=1)
+            if close_stdin and not self.channel.closed:
+                try:
+                    self.channel.shutdown_write()
+                except Exception:
+                    pass
+
+        if errors:
+            raise errors[0]
+        return self.bytes_sent
@@ -0,0 +1,268 @@
+import base64
+import hashlib
+import json
+import posixpath
+import shlex
+import time
+
+# How much of an adopted job's earlier output is replayed when picking it up
+ADOPT_TAIL_BYTES = 64 * 1024
+# Finished jobs' state directories are removed after this many seconds
+KEEP_FINISHED = 24 * 3600
+# Exit code a follower reports when the job's directory is gone (e.g. the Pi rebooted)
+JOB_NOT_FOUND = 255
+
+# Uploaded once per connection into the remote temp directory. Jobs started
+# through it run detached from the SSH channel under a small supervisor that
+# keeps their pid, output and exit code in the job's directory:
+#
+#   start DIR META   start the job, then follow it
+#   follow DIR OUT ERR   stream stdout/stderr from those offsets until the job ends
+#   kill DIR         SIGTERM the job (sudo relays it to the tool)
+#   list RUN_DIR     JSON list of jobs; prunes old finished ones
+#
+# The channel only carries a follower, so when the link drops the job keeps
+# going and a new follower picks up where the old one stopped. META is
+# base64 JSON so patterns like `pkill -f rpitx-start-wait` can't match it.
+SUPERVISOR_SCRIPT = r'''
+import base64, json, os, select, signal, subprocess, sys, time
+
+POLL = 0.02
+
+def write(d, name, text):
+    tmp = os.path.join(d, name + ".tmp")
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, os.path.join(d, name))
+
+def read(d, name):
+    try:
+        with open(os.path.join(d, name)) as f:
+            return f.read()
+    except OSError:
+        return None
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def pids(d):
+    try:
+        return [int(p) for p in read(d, "pid").split()]
+    except (AttributeError, ValueError):
+        return None
+
+def descendants(pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open("/proc/%s/stat" % entry) as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    found, todo = [], [pid]
+    while todo:
+        found.append(todo.pop())
+        todo.extend(children.get(found[-1], []))
+    return found
+
+def supervise(d, command):
+    # Nothing of the channel may stay open here, or it would never close
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    with open(os.path.join(d, "stdout"), "ab") as out, open(os.path.join(d, "stderr"), "ab") as err:
+        child = subprocess.Popen(["/bin/sh", "-c", command], stdin=devnull, stdout=out, stderr=err)
+
+    def terminate(signum, frame):
+        for pid in descendants(child.pid):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+    signal.signal(signal.SIGTERM, terminate)
+    write(d, "pid", "%d %d" % (os.getpid(), child.pid))
+    rc = child.wait()
+    write(d, "exit", str(rc if rc >= 0 else 128 - rc))
+    os._exit(0)
+
+def give_away(d):
+    # Under the agent this runs as root; leave the files to the SSH user
+    uid, gid = os.environ.get("SUDO_UID"), os.environ.get("SUDO_GID")
+    if os.getuid() == 0 and uid and gid:
+        for name in [""] + os.listdir(d):
+            try:
+                os.chown(os.path.join(d, name), int(uid), int(gid))
+            except OSError:
+                pass
+
+def start(d, meta):
+    os.makedirs(d)
+    write(d, "meta.json", json.dumps(dict(meta, started=time.time())))
+    for name in ("stdout", "stderr"):
+        open(os.path.join(d, name), "ab").close()
+    pid = os.fork()
+    if pid == 0:
+        # Double fork: the supervisor ends up a child of init, not of this follower
+        if os.fork() == 0:
+            supervise(d, meta["command"])
+        os._exit(0)
+    os.waitpid(pid, 0)
+    deadline = time.time() + 5
+    while pids(d) is None and time.time() < deadline:
+        time.sleep(0.005)
+    give_away(d)
+    follow(d, 0, 0)
+
+def follow(d, out_offset, err_offset):
+    if not os.path.isdir(d):
+        sys.stderr.write("job %s not found\n" % d)
+        sys.exit(NOT_FOUND)
+    streams = []
+    for name, sink, offset in (("stdout", sys.stdout.buffer, out_offset), ("stderr", sys.stderr.buffer, err_offset)):
+        f = open(os.path.join(d, name), "rb")
+        f.seek(offset)
+        streams.append((f, sink))
+    # The channel's end of our stdout/stderr; it reports an error once nobody reads any more
+    watch = select.poll()
+    for _, sink in streams:
+        watch.register(sink.fileno(), 0)
+    while True:
+        # Looked at before reading, so output written just before the exit is still sent
+        code = read(d, "exit")
+        running = pids(d)
+        moved = False
+        for f, sink in streams:
+            data = f.read(65536)
+            if data:
+                sink.write(data)
+                sink.flush()
+                moved = True
+        if moved:
+            continue
+        if code is not None:
+            sys.exit(int(code))
+        if running is not None and not alive(running[0]):
+            # The supervisor was killed (emergency stop) before it could record the exit
+            sys.stderr.write("job killed on the Pi\n")
+            sys.exit(137)
+        if watch.poll(POLL * 1000):
+            # The link dropped or the client let go; the job carries on without a follower
+            sys.exit(0)
+
+def kill(d):
+    running = pids(d)
+    if running and read(d, "exit") is None:
+        os.kill(running[0], signal.SIGTERM)
+
+def listing(run_dir):
+    jobs = []
+    for name in sorted(os.listdir(run_dir)) if os.path.isdir(run_dir) else []:
+        d = os.path.join(run_dir, name)
+        try:
+            meta = json.loads(read(d, "meta.json") or "{}")
+        except ValueError:
+            meta = {}
+        code, running = read(d, "exit"), pids(d)
+        alive_now = code is None and running is not None and alive(running[0])
+        if not alive_now and time.time() - os.path.getmtime(d) > KEEP_FINISHED:
+            subprocess.call(["rm", "-rf", d])
+            continue
+        sizes = {}
+        for stream in ("stdout", "stderr"):
+            try:
+                sizes[stream] = os.path.getsize(os.path.join(d, stream))
+            except OSError:
+                sizes[stream] = 0
+        jobs.append({"dir": d, "label": meta.get("label"), "command": meta.get("command"),
+                     "started": meta.get("started"), "running": alive_now,
+                     "exit_code": int(code) if code is not None else None, "sizes": sizes})
+    json.dump(jobs, sys.stdout)
+
+action, d = sys.argv[1], sys.argv[2]
+if action == "start":
+    start(d, json.loads(base64.b64decode(sys.argv[3]).decode()))
+elif action == "follow":
+    follow(d, int(sys.argv[3]), int(sys.argv[4]))
+elif action == "kill":
+    kill(d)
+elif action == "list":
+    listing(d)
+'''
+
+
+def script_source():
+    return f"NOT_FOUND = {JOB_NOT_FOUND}\nKEEP_FINISHED = {KEEP_FINISHED}\n" + SUPERVISOR_SCRIPT
+
+
+SCRIPT_NAME = f"jobctl-{hashlib.sha256(script_source().encode()).hexdigest()[:12]}.py"
+
+
+class RemoteJob:
+    """A detached job's state directory on the Pi and the commands that act on it"""
+
+    def __init__(self, script_path, job_dir, label=None, command=None):
+        self.script_path = script_path
+        self.job_dir = job_dir
+        self.label = label
+        self.command = command
+        # Filled in from `list` for jobs found on the Pi
+        self.started = None
+        self.running = None
+        self.exit_code = None
+        self.sizes = {"stdout": 0, "stderr": 0}
+
+    def _command(self, *args):
+        return " ".join(["python3 -u", shlex.quote(self.script_path)] + [shlex.quote(str(a)) for a in args])
+
+    def start_command(self, command, label):
+        self.command, self.label = command, label
+        meta = base64.b64encode(json.dumps({"label": label, "command": command}).encode()).decode()
+        return self._command("start", self.job_dir, meta)
+
+    def follow_command(self, stdout_offset=0, stderr_offset=0):
+        return self._command("follow", self.job_dir, stdout_offset, stderr_offset)
+
+    def kill_command(self):
+        # The supervisor may be root's (started by the agent)
+        return "sudo " + self._command("kill", self.job_dir)
+
+
+def run_dir(temp_dir):
+    return posixpath.join(temp_dir, "run")
+
+
+def list_command(script_path, temp_dir):
+    return f"python3 {shlex.quote(script_path)} list {shlex.quote(run_dir(temp_dir))}"
+
+
+def describe_remote_job(job):
+    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(job.started)) if job.started else "?"
+    if job.running:
+        state = "running"
+    elif job.exit_code is not None:
+        state = f"exit code {job.exit_code}"
+    else:
+        state = "killed"
+    return f"{when}  {job.label}: {state}  ({posixpath.basename(job.job_dir)})"
+
+
+def parse_job_list(output, script_path):
+    """RemoteJobs from the output of list_command()"""
+    jobs = []
+    for entry in json.loads(output or "[]"):
+        job = RemoteJob(script_path, entry["dir"], entry.get("label"), entry.get("command"))
+        job.started = entry.get("started")
+        job.running = entry.get("running")
+        job.exit_code = entry.get("exit_code")
+        job.sizes = entry.get("sizes") or job.sizes
+        jobs.append(job)
+    return jobs
@@ -0,0 +1,145 @@
+import json
+import re
+
+MIN_DWELL = 0.02
+MAX_HOPS = 100000
+
+# Runs on the Pi under `sudo python3 -u - rpitx-sweep` (the tag lets the stop
+# sequence's `pkill -f rpitx` find it). PLAN, DWELL and LOOPS are prepended.
+# Hops are timed against absolute deadlines so errors don't accumulate.
+SWEEP_SCRIPT = r'''
+import json, signal, subprocess, sys, time
+
+class Stop(Exception):
+    pass
+
+def on_signal(signum, frame):
+    raise Stop()
+
+def mark(*fields):
+    sys.stderr.write("@rpitx " + " ".join(str(f) for f in fields) + "\n")
+    sys.stderr.flush()
+
+def stop_child(child):
+    if child is not None and child.poll() is None:
+        child.terminate()
+        try:
+            child.wait(2)
+        except subprocess.TimeoutExpired:
+            child.kill()
+            child.wait()
+
+signal.signal(signal.SIGTERM, on_signal)
+signal.signal(signal.SIGINT, on_signal)
+signal.signal(signal.SIGHUP, on_signal)
+
+child = None
+starts, lateness, switches = [], [], []
+error = None
+t0 = time.time() + 0.05
+hop = 0
+try:
+    loop = 0
+    while LOOPS == 0 or loop < LOOPS:
+        for freq in PLAN:
+            planned = t0 + hop * DWELL
+            while True:
+                remaining = planned - time.time()
+                if remaining <= 0:
+                    break
+                if child is not None and child.poll() is not None:
+                    raise RuntimeError("tune exited with code %d" % child.returncode)
+                time.sleep(min(0.05, remaining))
+            switch_at = time.time()
+            stop_child(child)
+            child = subprocess.Popen(["./tune", "-f", str(freq)],
+                                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+            started = time.time()
+            starts.append(started)
+            lateness.append(started - planned)
+            switches.append(started - switch_at)
+            mark("hop", hop, freq, "%.6f" % started)
+            hop += 1
+        loop += 1
+    # Hold the last frequency for its full dwell
+    end = t0 + hop * DWELL
+    while time.time() < end:
+        if child.poll() is not None:
+            raise RuntimeError("tune exited with code %d" % child.returncode)
+        time.sleep(max(0, min(0.05, end - time.time())))
+except Stop:
+    pass
+except Exception as e:
+    error = str(e)
+finally:
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stop_child(child)
+
+dwells = [b - a for a, b in zip(starts, starts[1:])]
+def stats(values):
+    values = sorted(abs(v) * 1000 for v in values)
+    if not values:
+        return None
+    return {"mean_ms": sum(values) / len(values), "p95_ms": values[int(0.95 * (len(values) - 1))],
+            "max_ms": values[-1]}
+report = {
+    "hops": hop,
+    "dwell_ms": DWELL * 1000,
+    "dwell_error": stats([d - DWELL for d in dwells]),
+    "start_lateness": stats(lateness),
+    "switch": stats(switches),
+    "error": error,
+}
+mark("sweep", json.dumps(report, separators=(",", ":")))
+sys.exit(1 if error else 0)
+'''
+
+
+def parse_plan(text):
+    """Frequency plan in MHz -> list of Hz.
+
+    Accepts a list ("434.0, 434.1, 434.25") or a range with a step
+    ("434.0-435.0:0.1"). Range ends are inclusive.
+    """
+    text = text.strip()
+    match = re.fullmatch(r"([\d.]+)\s*-\s*([\d.]+)\s*:\s*([\d.]+)", text)
+    try:
+        if match:
+            start, stop, step = (float(v) for v in match.groups())
+            if step <= 0:
+                raise ValueError("step must be positive")
+            count = int(round(abs(stop - start) / step)) + 1
+            direction = 1 if stop >= start else -1
+            if count > MAX_HOPS:
+                raise ValueError(f"more than {MAX_HOPS} hops")
+            return [int(round((start + direction * i * step) * 1e6)) for i in range(count)]
+        plan = [int(round(float(v) * 1e6)) for v in re.split(r"[,\s]+", text) if v]
+    except ValueError as e:
+        raise ValueError(f"Invalid frequency plan '{text}': {e}")
+    if not plan:
+        raise ValueError("Empty frequency plan")
+    return plan
+
+
+def build_sweep_script(plan, dwell, loops=1):
+    """The engine script with the plan baked in (sent over stdin)"""
+    header = f"PLAN = {json.dumps([int(f) for f in plan])}\nDWELL = {float(dwell)!r}\nLOOPS = {int(loops)}\n"
+    return (header + SWEEP_SCRIPT).encode()
+
+
+def sweep_report(proc):
+    """Dwell accuracy report of a finished sweep process, or None"""
+    return proc.mark_json("sweep")
+
+
+def describe_report(report):
+    text = f"{report['hops']} hops at {report['dwell_ms']:.0f} ms dwell"
+    if report.get("dwell_error"):
+        e = report["dwell_error"]
+        text += f"; dwell error mean {e['mean_ms']:.2f} ms, p95 {e['p95_ms']:.2f} ms, max {e['max_ms']:.2f} ms"
+    if report.get("switch"):
+        text += f"; hop switch {report['switch']['mean_ms']:.1f} ms"
+    if report.get("error"):
+        text += f" - {report['error']}"
+    return text
@@ -0,0 +1,218 @@
+import collections
+import cProfile
+import functools
+import itertools
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import traceback
+
+from rpitx_metrics import METRICS
+
+STALL_LOG = "rpitx_ui_stalls.log"
+PROFILE_DIR = "profiles"
+# From Python 3.12 cProfile sits on sys.monitoring, which takes one profiler
+# per process; enabling a second raises ValueError. So one profile at a time
+_profiling = threading.Lock()
+
+
+class UIWatchdog:
+    """Measures Tk event-loop lag and catches the stack of whatever blocks it.
+
+    A heartbeat re-arms itself with root.after every `interval` ms; how late
+    each beat fires is the loop's lag (metric "ui.lag"). A watchdog thread
+    notices when the beats stop for more than `threshold` ms and grabs the
+    Tk thread's stack with sys._current_frames(), so the report shows the
+    handler that held the loop and the line it was stuck on. Each stall is
+    logged (metric "ui.stall", console and `log_file`) once the loop runs
+    again, or early if it is still blocked after `hang_after` seconds.
+
+    Create and start it on the Tk thread.
+    """
+
+    def __init__(self, root, interval=50, threshold=200, log_file=STALL_LOG, hang_after=10.0):
+        self.root = root
+        self.interval = interval / 1000.0
+        self.threshold = threshold / 1000.0
+        self.log_file = log_file
+        self.hang_after = hang_after
+        # Name of the wrapped handler running on the Tk thread, if any
+        self.current = None
+        self.stalls = collections.deque(maxlen=50)
+        self._tk_thread = threading.get_ident()
+        self._expected = None
+        self._ended = collections.deque()
+        self._stall = None
+        self._stop = threading.Event()
+        self._after_id = None
+
+    def start(self):
+        self._stop.clear()
+        self._schedule()
+        threading.Thread(target=self._watch, daemon=True, name="ui-watchdog").start()
+
+    def stop(self):
+        self._stop.set()
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+
+    def wrap(self, name, fn):
+        """fn, with stalls during it reported under `name`"""
+        @functools.wraps(fn)
+        def handler(*args, **kwargs):
+            previous, self.current = self.current, name
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.current = previous
+        return handler
+
+    def _schedule(self):
+        self._expected = time.perf_counter() + self.interval
+        self._after_id = self.root.after(int(self.interval * 1000), self._beat)
+
+    def _beat(self):
+        late = time.perf_counter() - self._expected
+        METRICS.observe("ui.lag", max(0.0, late))
+        if late > self.threshold:
+            # Handed to the watchdog thread, which does the logging off the Tk thread
+            self._ended.append(late)
+        if not self._stop.is_set():
+            self._schedule()
+
+    def _watch(self):
+        while not self._stop.wait(self.interval / 2):
+            while self._ended:
+                seconds = self._ended.popleft()
+                stall, self._stall = self._stall, None
+                METRICS.observe("ui.stall", seconds)
+                self._report(seconds, stall or {"handler": self.current, "stack": None}, ended=True)
+            blocked = time.perf_counter() - self._expected
+            if blocked <= self.threshold:
+                continue
+            if self._stall is None:
+                frame = sys._current_frames().get(self._tk_thread)
+                self._stall = {
+                    "handler": self.current or handler_from_stack(frame),
+                    "stack": traceback.extract_stack(frame) if frame is not None else None,
+                    "reported": False,
+                }
+            elif blocked > self.hang_after and not self._stall["reported"]:
+                self._stall["reported"] = True
+                self._report(blocked, self._stall, ended=False)
+
+    def _report(self, seconds, stall, ended):
+        handler = stall["handler"] or "unknown handler"
+        stack = stall["stack"]
+        where = f" at {os.path.basename(stack[-1].filename)}:{stack[-1].lineno} in {stack[-1].name}" if stack else ""
+        if ended:
+            headline = f"UI stalled {seconds * 1000:.0f} ms in {handler}{where}"
+        else:
+            headline = f"UI blocked for {seconds:.0f} s so far in {handler}{where}"
+        print(headline)  # Debug output
+        self.stalls.append({"time": time.time(), "ms": seconds * 1000, "handler": handler, "ended": ended})
+        if not self.log_file:
+            return
+        try:
+            with open(self.log_file, "a", encoding="utf-8") as f:
+                f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {headline}\n")
+                f.write("".join(traceback.format_list(stack)) if stack else "  (stack not captured)\n")
+                f.write("\n")
+        except OSError as e:
+            print(f"Could not write stall log: {e}")
+
+
+def handler_from_stack(frame):
+    """Name of the Tk callback a stack is in: the frame right after tkinter's CallWrapper"""
+    if frame is None:
+        return None
+    entries = traceback.extract_stack(frame)
+    for i in range(len(entries) - 1, 0, -1):
+        previous = entries[i - 1]
+        if previous.name == "__call__" and previous.filename.endswith(os.path.join("tkinter", "__init__.py")):
+            return entries[i].name
+    return None
+
+
+class HandlerProfiler:
+    """Runs wrapped handlers under cProfile while `enabled` and writes a report per call.
+
+    Each call leaves NAME.prof in `directory` (open it with pstats or
+    snakeviz to sort any way) and NAME.txt with the top functions by
+    `sort`. Before Python 3.12 cProfile only sees the calling thread, so
+    wrap both the Tk handler and the worker operation it submits.
+
+    Only one call is profiled at a time. A worker thread waits up to `wait`
+    seconds for the current profile (usually the Tk handler that submitted
+    it) to end; anything else overlapping runs unprofiled. Reports are
+    written on a background thread unless `background` is False (a CLI
+    about to exit).
+    """
+
+    def __init__(self, directory=PROFILE_DIR, enabled=False, sort="cumulative", top=40, background=True,
+                 wait=1.0):
+        self.directory = directory
+        self.enabled = enabled
+        self.background = background
+        self.wait = wait
+        self.sort = sort
+        self.top = top
+        self.last_report = None
+        self._ids = itertools.count(1)
+        self._active = threading.local()
+
+    def wrap(self, name, fn):
+        @functools.wraps(fn)
+        def profiled(*args, **kwargs):
+            # A wrapped handler calling another one is already being profiled
+            if not self.enabled or getattr(self._active, "on", False):
+                return fn(*args, **kwargs)
+            return self.run(name, fn, *args, **kwargs)
+        return profiled
+
+    def run(self, name, fn, *args, **kwargs):
+        # Never hold up the Tk thread waiting for someone else's profile
+        wait = 0 if threading.current_thread() is threading.main_thread() else self.wait
+        if not _profiling.acquire(timeout=wait):
+            return fn(*args, **kwargs)
+        try:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler (a debugger, say) already has sys.monitoring
+                return fn(*args, **kwargs)
+            self._active.on = True
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.disable()
+                self._active.on = False
+                if self.background:
+                    # Writing the report takes a while; keep it off the (possibly Tk) calling thread
+                    threading.Thread(target=self._save, args=(name, profile), daemon=True).start()
+                else:
+                    self._save(name, profile)
+        finally:
+            _profiling.release()
+
+    def _save(self, name, profile):
+        safe = re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+        base = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{next(self._ids)}-{safe}")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(base + ".prof")
+            with open(base + ".txt", "w") as f:
+                pstats.Stats(profile, stream=f).sort_stats(self.sort).print_stats(self.top)
+        except OSError as e:
+            print(f"Could not write profile for {name}: {e}")
+            return
+        self.last_report = base + ".txt"
+        print(f"Profile of {name}: {base}.txt")  # Debug output
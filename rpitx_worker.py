@@ -0,0 +1,133 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class OperationCancelled(Exception):
+    """Raised from inside an operation once its CancelToken is set"""
+
+
+class CancelToken:
+    """Cooperative cancellation flag shared between the UI and a worker"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise OperationCancelled()
+
+
+class Operation:
+    """Handle for a submitted operation"""
+
+    def __init__(self, name, token, future=None):
+        self.name = name
+        self.token = token
+        self.future = future
+
+    def cancel(self):
+        self.token.cancel()
+        if self.future is not None:
+            self.future.cancel()
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+
+class UIWorker:
+    """Runs blocking work (SSH, uploads, preprocessing) off the Tk main thread.
+
+    Tkinter must only be touched from the thread running mainloop, so
+    workers never call back into Tk directly. Their results are put on a
+    queue that the main thread drains with root.after, and the success/error
+    callbacks run there.
+
+    Stops are submitted with `urgent=True`: they get threads of their own, so
+    they never wait behind a long upload, and cancel_all() leaves them alone.
+    """
+
+    def __init__(self, root, max_workers=4, poll_interval=20):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rpitx-worker")
+        # Two, so a fleet stop and the local stop run side by side
+        self.urgent_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rpitx-stop")
+        self.pending = []
+        self._callbacks = queue.Queue()
+        self._closed = False
+        # Optional wrap(name, fn) applied to every operation, e.g. HandlerProfiler.wrap
+        self.wrap = None
+        self.root.after(self.poll_interval, self._drain)
+
+    def submit(self, fn, *args, on_success=None, on_error=None, name=None, token=None, urgent=False, **kwargs):
+        """Run fn(*args, **kwargs) on a worker thread.
+
+        on_success(result) or on_error(exception) is later called on the UI
+        thread. Pass a CancelToken that fn checks if it should be cancellable.
+        Urgent operations skip the queue and aren't cancelled by cancel_all().
+        """
+        op = Operation(name or getattr(fn, "__name__", "operation"), token or CancelToken())
+        if self.wrap is not None:
+            fn = self.wrap(op.name, fn)
+
+        def run():
+            try:
+                op.token.raise_if_cancelled()
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                if on_error is not None:
+                    self.call_in_ui(on_error, e)
+                elif not isinstance(e, OperationCancelled):
+                    print(f"{op.name} failed: {str(e)}")
+            else:
+                if on_success is not None:
+                    self.call_in_ui(on_success, result)
+
+        if urgent:
+            op.future = self.urgent_executor.submit(run)
+        else:
+            self.pending.append(op)
+            op.future = self.executor.submit(run)
+        # Also fires for operations cancelled before they started
+        op.future.add_done_callback(lambda future: self.call_in_ui(self._forget, op))
+        return op
+
+    def call_in_ui(self, fn, *args):
+        """Schedule fn(*args) on the Tk thread; safe to call from any thread"""
+        self._callbacks.put((fn, args))
+
+    def cancel_all(self):
+        for op in list(self.pending):
+            op.cancel()
+
+    def shutdown(self):
+        self._closed = True
+        self.cancel_all()
+        self.executor.shutdown(wait=False)
+        self.urgent_executor.shutdown(wait=False)
+
+    def _forget(self, op):
+        if op in self.pending:
+            self.pending.remove(op)
+
+    def _drain(self):
+        # Bound the work per tick so a burst of results can't stall the UI
+        for _ in range(100):
+            try:
+                fn, args = self._callbacks.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"UI callback error: {str(e)}")
+        if not self._closed:
+            self.root.after(self.poll_interval, self._drain)
@@ -0,0 +1,31 @@
+import pytest
+
+from rpitx_audio import StreamingResampler
+
+np = pytest.importorskip("numpy")
+
+
+def resample(in_rate, out_rate, signal, block):
+    resampler = StreamingResampler(np, in_rate, out_rate, 1)
+    parts = [resampler.process(signal[i:i + block]) for i in range(0, len(signal), block)]
+    parts.append(resampler.flush())
+    return np.concatenate(parts)[:, 0], resampler
+
+
+@pytest.mark.parametrize("in_rate, out_rate", [(44100, 48000), (48000, 22050), (8000, 48000)])
+def test_length_follows_the_rate(in_rate, out_rate):
+    signal = np.zeros((in_rate, 1), dtype=np.float32)
+    out, resampler = resample(in_rate, out_rate, signal, 4096)
+    # Output samples fall on the input span, plus the filter delay flushed out at the end
+    delay = (len(resampler.taps) - 1) // 2 if resampler.taps is not None else 0
+    assert len(out) == int((len(signal) - 1 + delay) / resampler.step) + 1
+
+
+@pytest.mark.parametrize("in_rate, out_rate", [(44100, 48000), (48000, 22050)])
+def test_no_seams_between_blocks(in_rate, out_rate):
+    t = np.arange(in_rate // 2) / in_rate
+    signal = (0.5 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)[:, None]
+    whole, _ = resample(in_rate, out_rate, signal, len(signal))
+    blocked, _ = resample(in_rate, out_rate, signal, 1000)
+    assert len(blocked) == len(whole)
+    assert np.allclose(blocked, whole, atol=1e-5)
@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+from rpitx_cache import DigestIndex, RemoteFileCache
+
+
+class FakeSFTP:
+    def __init__(self, files):
+        # name -> (mtime, size)
+        self.files = files
+
+    def listdir_attr(self, path):
+        return [SimpleNamespace(filename=name, st_mtime=mtime, st_size=size)
+                for name, (mtime, size) in self.files.items()]
+
+    def remove(self, path):
+        del self.files[path.rsplit("/", 1)[1]]
+
+
+class FakeSession:
+    def __init__(self, sftp):
+        self.sftp = sftp
+
+    def exec_command(self, command):
+        raise AssertionError("not expected")
+
+    def open_sftp(self):
+        return self.sftp
+
+
+def make_cache(tmp_path, files, max_bytes):
+    sftp = FakeSFTP(files)
+    cache = RemoteFileCache(FakeSession(sftp), "/cache", "pi", max_bytes=max_bytes,
+                            digests=DigestIndex(str(tmp_path / "digests.json")))
+    return cache, sftp
+
+
+def test_evict_removes_least_recently_used_first(tmp_path):
+    cache, sftp = make_cache(tmp_path, {"a": (1, 100), "b": (2, 100), "c": (3, 100)}, max_bytes=200)
+    assert cache.evict() == ["/cache/a"]
+    assert sorted(sftp.files) == ["b", "c"]
+
+
+def test_evict_skips_pinned_and_kept_files(tmp_path):
+    cache, sftp = make_cache(tmp_path, {"a": (1, 100), "b": (2, 100), "c": (3, 100), "d": (4, 100)},
+                             max_bytes=200)
+    cache.pin(["/cache/a"])
+    assert cache.evict(keep="/cache/b") == ["/cache/c", "/cache/d"]
+    assert sorted(sftp.files) == ["a", "b"]
+
+
+def test_pins_are_counted(tmp_path):
+    cache, sftp = make_cache(tmp_path, {"a": (1, 100), "b": (2, 100)}, max_bytes=100)
+    cache.pin(["/cache/a"])
+    cache.pin(["/cache/a"])
+    cache.unpin(["/cache/a"])
+    assert cache.evict() == ["/cache/b"]
+    cache.unpin(["/cache/a"])
+    assert not cache.pinned
+    sftp.files["b"] = (2, 100)
+    assert cache.evict() == ["/cache/a"]
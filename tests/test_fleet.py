@@ -0,0 +1,21 @@
+import json
+
+import pytest
+
+from rpitx_fleet import load_inventory
+
+
+def test_inventory_defaults_and_names(tmp_path):
+    path = tmp_path / "fleet.json"
+    path.write_text(json.dumps({"defaults": {"username": "pi", "port": 22},
+                                "hosts": ["10.0.0.11", {"name": "roof", "host": "10.0.0.12", "port": 2222}]}))
+    hosts = load_inventory(str(path))
+    assert [(h["name"], h["host"], h["port"], h["username"]) for h in hosts] == [
+        ("10.0.0.11", "10.0.0.11", 22, "pi"), ("roof", "10.0.0.12", 2222, "pi")]
+
+
+def test_inventory_rejects_duplicate_names(tmp_path):
+    path = tmp_path / "fleet.json"
+    path.write_text(json.dumps(["10.0.0.11", "10.0.0.11"]))
+    with pytest.raises(ValueError, match="Duplicate host name"):
+        load_inventory(str(path))
@@ -0,0 +1,33 @@
+import pytest
+
+from rpitx_iq import IQSynth, parse_waveform
+
+
+@pytest.mark.parametrize("text, message", [
+    ("", "Empty waveform"),
+    ("# just a comment", "Empty waveform"),
+    ("buzz 100", "unknown component 'buzz'"),
+    ("tone", "tone takes 1 to 2 values"),
+    ("tone 60000", r"outside \+/-24000 Hz"),
+    ("chirp -1000 1000 0", "sweep time must be positive"),
+    ("logchirp -1000 1000 1", "can't cross or start at 0 Hz"),
+    ("steps 0 1000 0 1", "at least one step"),
+    ("tone abc", "Invalid waveform line 'tone abc'"),
+])
+def test_bad_waveforms(text, message):
+    with pytest.raises(ValueError, match=message):
+        parse_waveform(text, 48000)
+
+
+def test_rate_out_of_range():
+    with pytest.raises(ValueError, match="Sample rate"):
+        parse_waveform("tone 1000", 1000)
+
+
+def test_synth_blocks_stay_under_level():
+    np = pytest.importorskip("numpy")
+    synth = IQSynth("tone 1000; chirp -5000 5000 0.5 0.5", 48000, block=4800)
+    blocks = list(synth.blocks(0.25))
+    samples = np.frombuffer(b"".join(blocks), dtype=np.complex64)
+    assert len(samples) == 12000
+    assert np.abs(samples).max() <= 0.9 + 1e-6
@@ -0,0 +1,29 @@
+import pytest
+
+from rpitx_controller import TransmitterError
+from rpitx_jobs import JobQueue
+
+
+def test_gap_of_a_launched_one_shot_job_lands_in_history(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.json"))
+    job = queue.add("tune", frequency=434.0)
+    queue.launched(job["id"])
+    assert queue.list() == []
+    queue.record_gap(job["id"], 0.012)
+    assert [(j["id"], j["last_gap"]) for j in queue.finished()] == [(job["id"], 0.012)]
+
+
+def test_recurring_job_moves_to_its_next_slot(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.json"))
+    job = queue.add("tune", frequency=434.0, start_at=1000.0, repeat_every=60)
+    queue.launched(job["id"])
+    [moved] = queue.list()
+    assert moved["runs"] == 1 and moved["start_at"] > moved["last_run"]
+    assert (moved["start_at"] - 1000.0) % 60 == 0
+    assert queue.finished() == []
+
+
+def test_job_needs_a_target(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.json"))
+    with pytest.raises(TransmitterError):
+        queue.add("tune")
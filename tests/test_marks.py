@@ -0,0 +1,33 @@
+from rpitx_process import TrackedProcess
+from rpitx_playlist import now_playing, playlist_report
+from rpitx_sweep import sweep_report
+
+
+def test_failed_sweep_report_survives_spaces():
+    proc = TrackedProcess(1, "sweep")
+    proc.add_stderr(b'@rpitx sweep {"hops":3,"dwell_ms":500.0,"error":"tune exited with code 1"}\n')
+    report = sweep_report(proc)
+    assert report["hops"] == 3
+    assert report["error"] == "tune exited with code 1"
+
+
+def test_marker_split_across_reads():
+    proc = TrackedProcess(1, "sweep")
+    proc.add_stderr(b"@rpitx start 1700000000.25\n@rpitx sweep {\"hops\":2,")
+    proc.add_stderr(b'"error":null}\n')
+    assert proc.mark_time("start") == 1700000000.25
+    assert sweep_report(proc) == {"hops": 2, "error": None}
+
+
+def test_garbled_report_is_none():
+    proc = TrackedProcess(1, "sweep")
+    proc.add_stderr(b"@rpitx sweep {not json\n")
+    assert sweep_report(proc) is None
+
+
+def test_failed_playlist_report_and_title():
+    proc = TrackedProcess(1, "playlist")
+    proc.add_stderr(b"@rpitx track 2 Artist -  Two  Spaces\n")
+    proc.add_stderr(b'@rpitx playlist {"played":1,"error":"pifmrds exited with code 1"}\n')
+    assert now_playing(proc) == "Artist -  Two  Spaces"
+    assert playlist_report(proc) == {"played": 1, "error": "pifmrds exited with code 1"}
@@ -0,0 +1,14 @@
+from rpitx_messages import MessageRecord, apply_report, messages_report
+from rpitx_process import TrackedProcess
+
+
+def test_report_with_failures():
+    proc = TrackedProcess(1, "messages")
+    proc.add_stderr(b'@rpitx messages {"sent":1,"failed":1,"failed_lines":[3],"errors":{"3":"exit code 1"},'
+                    b'"seconds":2.0,"per_second":0.5,"stopped":false,"error":null}\n')
+    report = messages_report(proc)
+    assert report["errors"] == {"3": "exit code 1"}
+
+    records = [MessageRecord(2, {"address": 1, "message": "a"}), MessageRecord(3, {"address": 2, "message": "b"})]
+    apply_report(records, report)
+    assert [r.status for r in records] == ["sent", "failed: exit code 1"]
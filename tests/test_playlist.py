@@ -0,0 +1,60 @@
+import copy
+import json
+import os
+import wave
+
+from rpitx_controller import DEFAULT_SETTINGS, TransmitterController
+
+
+class FakeProc:
+    active = True
+
+    def __init__(self):
+        self.marks = {}
+
+
+def write_track(path):
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(48000)
+        w.writeframes(b"\0\0" * 480)
+
+
+def test_looping_playlist_pins_only_the_prefetch_window(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    settings = copy.deepcopy(DEFAULT_SETTINGS)
+    settings.update({"host": "pi", "preprocess_audio": False})
+    controller = TransmitterController(settings)
+    controller.session.configure("pi", "pi", "x")
+    cache = controller.upload_cache
+
+    def upload(local_path, progress=None, pins=None):
+        remote_path = "/cache/" + os.path.basename(local_path)
+        cache.pin([remote_path])
+        pins.append(remote_path)
+        return remote_path
+
+    monkeypatch.setattr(controller, "upload", upload)
+    names = ["one.wav", "two.wav", "three.wav"]
+    for name in names:
+        write_track(str(tmp_path / name))
+    (tmp_path / "loop.m3u").write_text("\n".join(names) + "\n")
+
+    prefetch = 2
+    prepared = controller.prepare("playlist", 100000000, file_path=str(tmp_path / "loop.m3u"), loop=True,
+                                  prefetch=prefetch)
+    proc = FakeProc()
+    prepared.on_launch(proc)
+    chunks = iter(prepared.stdin_chunks)
+    next(chunks)
+    # Four times round the list, the engine staying `prefetch` tracks behind what was sent
+    for _ in range(4 * len(names)):
+        n = json.loads(next(chunks))["n"]
+        assert sum(cache.pinned.values()) <= prefetch
+        proc.marks["track"] = [str(max(0, n - prefetch + 1))]
+
+    controller.release(prepared)
+    assert not cache.pinned
+    proc.active = False
+    assert next(chunks, None) is None
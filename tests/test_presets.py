@@ -0,0 +1,43 @@
+import json
+
+from rpitx_presets import PresetStore
+
+
+def test_journal_is_replayed_into_the_snapshot(tmp_path):
+    path = str(tmp_path / "presets.json")
+    store = PresetStore(path, compact_delay=60)
+    store.put({"name": "Net", "frequency": 145.5})
+    store.put({"name": "Beacon", "frequency": 434.0})
+    store.delete("Beacon")
+    # No close(): as after a crash, only the journal has the changes
+
+    store = PresetStore(path)
+    assert store.names() == ["Net"]
+    assert store.get("Net")["frequency"] == 145.5
+    with open(path) as f:
+        assert [p["name"] for p in json.load(f)] == ["Net"]
+    with open(path + ".log") as f:
+        assert f.read() == ""
+    store.close()
+
+
+def test_torn_journal_line_is_cut_off(tmp_path):
+    path = str(tmp_path / "presets.json")
+    with open(path + ".log", "w") as f:
+        f.write('{"op":"put","preset":{"name":"Ne')
+
+    store = PresetStore(path, compact_delay=60)
+    assert len(store) == 0
+    store.put({"name": "Later", "frequency": 433.5})
+    # Crash again: the new record must not have been appended to the torn line
+    store = PresetStore(path)
+    assert store.names() == ["Later"]
+    store.close()
+
+
+def test_search_order(tmp_path):
+    store = PresetStore(str(tmp_path / "presets.json"))
+    store.put_many([{"name": name, "frequency": 144.0} for name in ("Repeater 2", "Net", "My Repeater", "Rpt")])
+    assert store.search("rep") == ["Repeater 2", "My Repeater"]
+    assert store.search("rpt") == ["Rpt", "My Repeater", "Repeater 2"]
+    store.close()